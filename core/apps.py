@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+
+    def ready(self):
+        from .dbhooks import install_wrappers
+        connection_created.connect(install_wrappers, dispatch_uid='core.dbhooks.install_wrappers')
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Serve the read-heavy endpoints with their async views; see feature_railways/async_views.py
+os.environ.setdefault('ASYNC_READ_VIEWS', 'True')
+# Each request's queries run on a fresh thread, so persistent connections would never be reused
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -0,0 +1,58 @@
+import fcntl
+import os
+import pickle
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+from . import metrics
+
+_MISSING = object()
+
+
+class InstrumentedFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache that counts hits and misses for /metrics.
+
+    add() and incr() hold a lock shared by every process using the cache directory,
+    so counters built on them (OTP attempts, send rate limits) stay exact under
+    concurrent requests; FileBasedCache's own versions are a read followed by a
+    write. incr() also keeps the key's expiry instead of resetting it.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        metrics.inc('django_cache_gets_total', {'result': 'miss' if value is _MISSING else 'hit'})
+        return default if value is _MISSING else value
+
+    @contextmanager
+    def _counter_lock(self):
+        # One lock for the directory; add() and incr() are rare next to get() and set()
+        self._createdir()
+        with open(os.path.join(self._dir, 'counters.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._counter_lock():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._counter_lock():
+            try:
+                with open(self._key_to_file(key, version), 'rb') as f:
+                    expiry = pickle.load(f)
+                    value = pickle.loads(zlib.decompress(f.read()))
+            except (FileNotFoundError, EOFError):
+                expiry, value = 0, _MISSING
+            if value is _MISSING or (expiry is not None and expiry < time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            value += delta
+            self.set(key, value, None if expiry is None else max(expiry - time.time(), 0.001), version)
+            return value
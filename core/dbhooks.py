@@ -0,0 +1,51 @@
+"""
+Execute wrappers installed on every database connection as it is opened.
+
+Wrapping `connections.all()` around a request only covers the connections of the
+thread running the middleware, but under ASGI the ORM runs in executor threads, and
+management commands have no request at all. So the wrappers are installed once per
+connection and read their per-request state from context variables, which asgiref
+copies into those threads:
+
+- core.querytags.add_query_comment prepends the request id, view and service tags;
+- time_queries passes each query's timing to the callbacks registered with
+  observe_queries() (metrics, the slow request log and the profiler use it).
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .querytags import add_query_comment
+
+_observers = ContextVar('query_observers', default=())
+
+
+@contextmanager
+def observe_queries(callback):
+    """Call `callback(alias, sql, params, many, seconds)` after every query run inside the block."""
+    token = _observers.set(_observers.get() + (callback,))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
+
+
+def time_queries(execute, sql, params, many, context):
+    observers = _observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        alias = context['connection'].alias
+        for observer in observers:
+            observer(alias, sql, params, many, duration)
+
+
+def install_wrappers(sender, connection, **kwargs):
+    # The first wrapper is outermost, so observers see the tagged SQL
+    for wrapper in (add_query_comment, time_queries):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
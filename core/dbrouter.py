@@ -0,0 +1,104 @@
+"""
+Read replica routing.
+
+Reads made inside a @replica_reads view (search, availability, departure boards,
+analytics and history pages) go to the REPLICA_DATABASE alias; everything else,
+and every write, goes to the primary. Two things send those reads back to the
+primary:
+
+- pinning: once a request writes, the rest of it reads from the primary, and
+  ReplicaPinMiddleware sets a short-lived cookie so that client's next requests do
+  too. That way users see their own bookings and payments despite replication lag;
+- fallback: if the replica can't be reached it is skipped for REPLICA_RETRY_SECONDS.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+PIN_COOKIE = 'replica_pin'
+
+# Per-request state: {'replica': reads may use the replica, 'pinned': they may not, 'wrote': a write happened}
+_state = ContextVar('replica_state', default=None)
+_replica_down_until = 0.0
+
+
+@contextmanager
+def request_state(pinned=False):
+    state = {'replica': False, 'pinned': pinned, 'wrote': False}
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def reading_from_replica():
+    state = _state.get()
+    if state is None:
+        # Outside a request (commands, tests); keep the block's state to itself
+        with request_state() as state:
+            state['replica'] = True
+            yield
+        return
+    previous = state['replica']
+    state['replica'] = True
+    try:
+        yield
+    finally:
+        state['replica'] = previous
+
+
+def replica_reads(view):
+    """Let the view's reads go to the replica; for views that only read."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            with reading_from_replica():
+                return await view(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with reading_from_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _replica_available(alias):
+    global _replica_down_until
+    if time.monotonic() < _replica_down_until:
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except OperationalError:
+        _replica_down_until = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        return False
+    return True
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = settings.REPLICA_DATABASE
+        state = _state.get()
+        if not alias or state is None or not state['replica'] or state['pinned'] or state['wrote']:
+            return None
+        if not _replica_available(alias):
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
@@ -0,0 +1,101 @@
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer a running server with concurrent GETs and report throughput and latency; '
+        'pass several --target URLs (e.g. the gunicorn and ASGI deployments) to compare them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Paths to request in turn, e.g. /railways/board/NDLS/data/')
+        parser.add_argument(
+            '--target', action='append', dest='targets', default=[],
+            help='name=base URL, repeatable (default: local=http://localhost:8000)'
+        )
+        parser.add_argument('--concurrency', type=int, default=32, help='Clients sending requests at once')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds to measure each target for')
+        parser.add_argument('--warmup', type=float, default=2, help='Seconds of unmeasured requests first')
+        parser.add_argument('--header', action='append', dest='headers', default=[], help='"Name: value", repeatable, e.g. a session cookie')
+
+    def _client(self, base, paths, headers, deadline, measure_from, results, lock):
+        parts = urlsplit(base)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(parts.netloc, timeout=30)
+        latencies = []
+        errors = 0
+        i = 0
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.monotonic()
+            try:
+                connection.request('GET', parts.path.rstrip('/') + path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                ok = False
+            if start >= measure_from:
+                if ok:
+                    latencies.append(time.monotonic() - start)
+                else:
+                    errors += 1
+        connection.close()
+        with lock:
+            results['latencies'].extend(latencies)
+            results['errors'] += errors
+
+    def _run(self, base, paths, headers, options):
+        results = {'latencies': [], 'errors': 0}
+        lock = threading.Lock()
+        measure_from = time.monotonic() + options['warmup']
+        deadline = measure_from + options['duration']
+        clients = [
+            threading.Thread(target=self._client, args=(base, paths, headers, deadline, measure_from, results, lock))
+            for _ in range(options['concurrency'])
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return results
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets'] or ['local=http://localhost:8000']:
+            name, sep, base = target.partition('=')
+            if not sep:
+                raise CommandError(f'--target must be name=url, got {target!r}')
+            targets.append((name, base))
+        headers = {}
+        for header in options['headers']:
+            name, sep, value = header.partition(':')
+            if not sep:
+                raise CommandError(f'--header must be "Name: value", got {header!r}')
+            headers[name.strip()] = value.strip()
+
+        self.stdout.write(
+            f"{len(options['paths'])} paths, {options['concurrency']} concurrent clients, {options['duration']:g}s per target"
+        )
+        self.stdout.write(f"{'target':<12} {'requests':>9} {'errors':>7} {'req/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, base in targets:
+            results = self._run(base, options['paths'], headers, options)
+            latencies = sorted(latency * 1000 for latency in results['latencies'])
+            if not latencies:
+                self.stdout.write(self.style.ERROR(f"{name:<12} no successful requests, {results['errors']} errors"))
+                continue
+            percentile = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+            self.stdout.write(
+                f"{name:<12} {len(latencies):>9} {results['errors']:>7} {len(latencies) / options['duration']:>9.1f} "
+                f"{statistics.mean(latencies):>9.1f} {percentile(0.5):>9.1f} {percentile(0.95):>9.1f} {percentile(0.99):>9.1f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Load tested {len(targets)} targets'))
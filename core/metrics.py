@@ -0,0 +1,236 @@
+"""
+Request metrics shared across gunicorn workers without an external service.
+
+Each worker process keeps its counters and histograms in memory and writes them to
+METRICS_DIR/metrics-<pid>.json at most every METRICS_FLUSH_INTERVAL seconds. The
+/metrics view merges every worker file and renders the Prometheus text format, so
+totals keep counting across worker restarts. Files of workers that have exited are
+folded into METRICS_DIR/metrics-archive.json and removed, so the directory holds
+one file per live worker plus the archive. Labels are kept to view names, methods
+and status codes to bound the number of series.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+METRICS = {
+    'django_http_requests_total': ('counter', 'Requests by view, method and status code'),
+    'django_http_request_duration_seconds': ('histogram', 'Request latency by view'),
+    'django_http_response_size_bytes': ('histogram', 'Response body size by view'),
+    'django_db_queries_per_request': ('histogram', 'Database queries per request by view'),
+    'django_db_query_duration_seconds_total': ('counter', 'Time spent in database queries by view'),
+    'django_cache_gets_total': ('counter', 'Cache reads by result (hit or miss)'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_flush = 0.0
+# The pid whose file this process has taken over; a file already there belonged to an exited worker
+_owned_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, labels=None, value=1):
+    key = _key(name, labels or {})
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets, labels=None):
+    key = _key(name, labels or {})
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0, 'count': 0}
+        for i, bound in enumerate(histogram['buckets']):
+            if value <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def _worker_path(pid=None):
+    return os.path.join(settings.METRICS_DIR, f'metrics-{pid or os.getpid()}.json')
+
+
+def _serialize(counters, histograms):
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, histogram] for (name, labels), histogram in histograms.items()],
+    }
+
+
+def _write(path, data):
+    # Write then rename so a concurrent scrape never reads half a file
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def flush(force=False):
+    """Write this worker's metrics to its file; cheap to call after every request."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    with _lock:
+        _last_flush = now
+        data = _serialize(_counters, _histograms)
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _take_over_worker_file()
+    _write(_worker_path(), data)
+
+
+def _take_over_worker_file():
+    """Archive a file left under this pid by an exited worker before the first write replaces it."""
+    global _owned_pid
+    pid = os.getpid()
+    if _owned_pid == pid:
+        return
+    with _directory_lock():
+        # Checked again under the lock, as another thread's first flush may have got here first
+        if _owned_pid != pid:
+            if os.path.exists(_worker_path(pid)):
+                _archive_dead_workers([_worker_path(pid)])
+            _owned_pid = pid
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def _worker_exited(filename):
+    pid = filename[len('metrics-'):-len('.json')]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _merge(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, histogram in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.setdefault(key, {'buckets': histogram['buckets'], 'counts': [0] * len(histogram['buckets']), 'sum': 0, 'count': 0})
+        merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+        merged['sum'] += histogram['sum']
+        merged['count'] += histogram['count']
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _archive_dead_workers(dead_paths):
+    """Add the files of exited workers to the archive and delete them, keeping totals unchanged."""
+    archive_path = os.path.join(settings.METRICS_DIR, 'metrics-archive.json')
+    counters = {}
+    histograms = {}
+    for path in [archive_path, *dead_paths]:
+        data = _read(path)
+        if data is not None:
+            _merge(counters, histograms, data)
+    _write(archive_path, _serialize(counters, histograms))
+    for path in dead_paths:
+        os.remove(path)
+
+
+@contextmanager
+def _directory_lock():
+    # Held while archiving and scraping, so no file is archived twice or read mid-archive
+    with open(os.path.join(settings.METRICS_DIR, 'metrics.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def collect():
+    """Sum the files of every worker, current and past."""
+    flush(force=True)
+    counters = {}
+    histograms = {}
+    with _directory_lock():
+        filenames = [
+            filename for filename in os.listdir(settings.METRICS_DIR)
+            if filename.startswith('metrics-') and filename.endswith('.json')
+        ]
+        dead = [filename for filename in filenames if _worker_exited(filename)]
+        if dead:
+            _archive_dead_workers([os.path.join(settings.METRICS_DIR, filename) for filename in dead])
+            filenames = [filename for filename in filenames if filename not in dead]
+            if 'metrics-archive.json' not in filenames:
+                filenames.append('metrics-archive.json')
+
+        for filename in filenames:
+            data = _read(os.path.join(settings.METRICS_DIR, filename))
+            if data is not None:
+                _merge(counters, histograms, data)
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render():
+    counters, histograms = collect()
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+        else:
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+                lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget this worker's in-memory metrics and its file (used by tests)."""
+    global _owned_pid
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _owned_pid = None
@@ -0,0 +1,249 @@
+import random
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import dbrouter, metrics, profiling, querytags, slowlog
+from .dbhooks import observe_queries
+
+REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively under both WSGI and ASGI, so async views
+    are not pushed back onto a thread. Subclasses implement `handle` and `ahandle`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.ahandle(request)
+        return self.handle(request)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Records latency, response size and database usage per view; see core.metrics."""
+
+    def handle(self, request):
+        db_stats = {'queries': 0, 'time': 0.0}
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._count_query(db_stats, *query)):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, db_stats)
+        return response
+
+    async def ahandle(self, request):
+        db_stats = {'queries': 0, 'time': 0.0}
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._count_query(db_stats, *query)):
+            response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, db_stats)
+        return response
+
+    @staticmethod
+    def _count_query(db_stats, alias, sql, params, many, duration):
+        db_stats['queries'] += 1
+        db_stats['time'] += duration
+
+    @staticmethod
+    def _record(request, response, duration, db_stats):
+        view = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+        metrics.inc('django_http_requests_total', {'view': view, 'method': request.method, 'status': str(response.status_code)})
+        metrics.observe('django_http_request_duration_seconds', duration, metrics.LATENCY_BUCKETS, {'view': view})
+        metrics.observe('django_db_queries_per_request', db_stats['queries'], metrics.QUERY_COUNT_BUCKETS, {'view': view})
+        metrics.inc('django_db_query_duration_seconds_total', {'view': view}, db_stats['time'])
+        if not response.streaming:
+            metrics.observe('django_http_response_size_bytes', len(response.content), metrics.RESPONSE_SIZE_BUCKETS, {'view': view})
+        metrics.flush()
+
+
+class QueryTagMiddleware(HybridMiddleware):
+    """
+    Gives every request an id (kept from a sane incoming X-Request-ID, e.g. from the
+    proxy) and tags its SQL with that id and the view name; see core.querytags.
+    """
+
+    def handle(self, request):
+        request_id = self._request_id(request)
+        with querytags.tags(request_id=request_id):
+            response = self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def ahandle(self, request):
+        request_id = self._request_id(request)
+        with querytags.tags(request_id=request_id):
+            response = await self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+    @staticmethod
+    def _request_id(request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        return request_id
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        querytags.set_tag('view', request.resolver_match.view_name)
+
+
+class SlowRequestMiddleware(HybridMiddleware):
+    """Logs slow requests and slow queries with their SQL and plans; see core.slowlog."""
+
+    def handle(self, request):
+        if not settings.SLOW_REQUEST_LOGGING:
+            return self.get_response(request)
+        queries = []
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._add_query(queries, *query)):
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if slowlog.is_slow(duration_ms, queries):
+            slowlog.log_request(request, response, duration_ms, queries)
+        return response
+
+    async def ahandle(self, request):
+        if not settings.SLOW_REQUEST_LOGGING:
+            return await self.get_response(request)
+        queries = []
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._add_query(queries, *query)):
+            response = await self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if slowlog.is_slow(duration_ms, queries):
+            # EXPLAIN needs a database connection, which can't be used from the event loop
+            await sync_to_async(slowlog.log_request)(request, response, duration_ms, queries)
+        return response
+
+    @staticmethod
+    def _add_query(queries, alias, sql, params, many, duration):
+        queries.append((alias, sql, params, many, duration * 1000))
+
+
+class ReplicaPinMiddleware(HybridMiddleware):
+    """
+    Tracks whether a request wrote to the database and, if it did, keeps that
+    client's reads on the primary for REPLICA_PIN_SECONDS; see core.dbrouter.
+    """
+
+    def handle(self, request):
+        with dbrouter.request_state(pinned=dbrouter.PIN_COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        self._pin(response, state)
+        return response
+
+    async def ahandle(self, request):
+        with dbrouter.request_state(pinned=dbrouter.PIN_COOKIE in request.COOKIES) as state:
+            response = await self.get_response(request)
+        self._pin(response, state)
+        return response
+
+    @staticmethod
+    def _pin(response, state):
+        if state['wrote'] and settings.REPLICA_DATABASE:
+            response.set_cookie(dbrouter.PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Profiles a request when a staff user asks for it with `?_profile=1` or an
+    `X-Profile: 1` header, and a random PROFILING_SAMPLE_RATE share of all other
+    requests. Must come after AuthenticationMiddleware; see core.profiling.
+
+    Under ASGI the request's work is spread over the event loop and executor
+    threads, so every thread is sampled and concurrent requests show up too.
+    """
+
+    def handle(self, request):
+        requested = self._requested(request)
+        trigger = self._trigger(requested and request.user.is_staff)
+        if trigger is None:
+            return self.get_response(request)
+
+        profile_id, started_at, queries, sampler = self._start(all_threads=False)
+        sampler.start()
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._add_query(queries, *query)):
+            try:
+                response = self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+        duration = time.perf_counter() - start
+        self._save(request, request.user, response, trigger, profile_id, started_at, duration, queries, stacks)
+        return response
+
+    async def ahandle(self, request):
+        requested = self._requested(request)
+        # request.user would query the database from the event loop
+        user = await request.auser() if requested else None
+        trigger = self._trigger(requested and user.is_staff)
+        if trigger is None:
+            return await self.get_response(request)
+        if user is None:
+            user = await request.auser()
+
+        profile_id, started_at, queries, sampler = self._start(all_threads=True)
+        sampler.start()
+        start = time.perf_counter()
+        with observe_queries(lambda *query: self._add_query(queries, *query)):
+            try:
+                response = await self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+        duration = time.perf_counter() - start
+        self._save(request, user, response, trigger, profile_id, started_at, duration, queries, stacks)
+        return response
+
+    @staticmethod
+    def _requested(request):
+        return request.GET.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+
+    @staticmethod
+    def _trigger(staff_requested):
+        if staff_requested:
+            return 'staff'
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return 'sampled'
+        return None
+
+    @staticmethod
+    def _start(all_threads):
+        sampler = profiling.StackSampler(settings.PROFILING_INTERVAL, all_threads=all_threads)
+        return profiling.new_profile_id(), timezone.now(), [], sampler
+
+    @staticmethod
+    def _add_query(queries, alias, sql, params, many, duration):
+        queries.append({'alias': alias, 'sql': sql, 'ms': round(duration * 1000, 3)})
+
+    @staticmethod
+    def _save(request, user, response, trigger, profile_id, started_at, duration, queries, stacks):
+        profiling.save_profile(profile_id, {
+            'id': profile_id,
+            'trigger': trigger,
+            'started_at': started_at.isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': request.resolver_match.view_name if request.resolver_match else 'unmatched',
+            'user': user.get_username() if user.is_authenticated else '',
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'interval_ms': settings.PROFILING_INTERVAL * 1000,
+            'stacks': dict(stacks),
+            'sql': queries,
+        })
+        if trigger == 'staff':
+            response['X-Profile-Id'] = profile_id
@@ -0,0 +1,126 @@
+"""
+Per-request profiling that stores flamegraph-ready output.
+
+A background thread samples the request thread's Python stack (every thread's
+under ASGI) every PROFILING_INTERVAL seconds and counts each distinct stack. The
+counts are stored in the "folded" format (`frame;frame;frame count`) that
+flamegraph.pl, speedscope and inferno read directly. Each profile is one JSON file
+in PROFILES_DIR, holding the request details, the folded stacks and every SQL
+statement with its duration; only the newest PROFILES_KEEP files are kept.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$')
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}:{code.co_firstlineno}"
+
+
+class StackSampler:
+    """
+    Samples the calling thread's stack, or with `all_threads` every other thread's,
+    from a helper thread until stopped.
+    """
+
+    def __init__(self, interval, all_threads=False):
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        target = None if self.all_threads else threading.get_ident()
+        # Frames above the caller (server, earlier middleware) are the same for every sample
+        root = sys._getframe(1)
+        self._thread = threading.Thread(target=self._run, args=(target, root), daemon=True)
+        self._thread.start()
+
+    def _run(self, target, root):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if target is not None:
+                frames = {target: frames.get(target)}
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and frame is not root:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def new_profile_id():
+    return f'{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+
+def save_profile(profile_id, data):
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILES_DIR, f'{profile_id}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+    for stale in _profile_files()[settings.PROFILES_KEEP:]:
+        try:
+            os.remove(os.path.join(settings.PROFILES_DIR, stale))
+        except OSError:
+            pass
+
+
+def _profile_files():
+    """Profile file names, newest first (ids start with a timestamp)."""
+    try:
+        names = os.listdir(settings.PROFILES_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if PROFILE_ID_RE.match(name[:-5]) and name.endswith('.json')), reverse=True)
+
+
+def load_profile(profile_id):
+    """Return a stored profile, or None for unknown or malformed ids."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILES_DIR, f'{profile_id}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def recent_profiles(limit=50):
+    """Summaries of the newest profiles, without their stacks and SQL."""
+    profiles = []
+    for name in _profile_files()[:limit]:
+        profile = load_profile(name[:-5])
+        if profile is None:
+            continue
+        profile.pop('stacks', None)
+        sql = profile.pop('sql', [])
+        profile['query_count'] = len(sql)
+        profile['query_ms'] = round(sum(query['ms'] for query in sql), 2)
+        profiles.append(profile)
+    return profiles
+
+
+def folded(profile):
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
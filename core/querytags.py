@@ -0,0 +1,84 @@
+"""
+SQL comments that tie each query back to the code that issued it.
+
+QueryTagMiddleware sets a request id and the resolved view name, and service
+classes decorated with @tag_service_methods add the service method being run. The
+execute wrapper, installed on every connection by core.dbhooks, prepends them as a
+comment, e.g.
+
+    /*request_id='3f2a...',view='feature_railways:search_trains',service='BookingService.check_seat_availability'*/ SELECT ...
+
+so they show up in pg_stat_activity, the slow query log and auto_explain output.
+pg_stat_statements ignores comments when grouping, so there each statement keeps
+the tags of whichever call it first saw; use the logs for per-view attribution.
+"""
+import contextvars
+import functools
+import re
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+
+TAG_ORDER = ('request_id', 'view', 'service')
+_UNSAFE = re.compile(r'[^\w.:-]')
+
+_tags = contextvars.ContextVar('query_tags', default=None)
+
+
+def current():
+    return _tags.get() or {}
+
+
+@contextmanager
+def tags(**values):
+    """Add tags to every query run inside the block; inner values win."""
+    token = _tags.set({**current(), **values})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def set_tag(name, value):
+    """Change a tag for the rest of the innermost tags() block."""
+    active = _tags.get()
+    if active is not None:
+        active[name] = value
+
+
+def service(name):
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tags(service=name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tags(service=name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tag_service_methods(cls):
+    """Tag queries from every static method of a service class with `Class.method`."""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod):
+            setattr(cls, name, staticmethod(service(f'{cls.__name__}.{name}')(attr.__func__)))
+    return cls
+
+
+def comment():
+    values = current()
+    # Values are reduced to a safe charset so they can't close the comment or add a % placeholder
+    return ','.join(f"{name}='{_UNSAFE.sub('_', str(values[name]))}'" for name in TAG_ORDER if values.get(name))
+
+
+def add_query_comment(execute, sql, params, many, context):
+    tag_comment = comment()
+    if tag_comment:
+        sql = f'/*{tag_comment}*/ {sql}'
+    return execute(sql, params, many, context)
@@ -64,6 +64,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     
     # Allauth apps
     'allauth',
@@ -72,6 +73,7 @@ INSTALLED_APPS = [
     'allauth.socialaccount.providers.google',
     
     #local apps
+    'core',
     'core_home',
     'core_users',
     'feature_railways',
@@ -79,12 +81,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryTagMiddleware',
+    'core.middleware.SlowRequestMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -127,6 +134,39 @@ DATABASES = {
         'PASSWORD' : os.environ.get('POSTGRES_PASSWORD', 'postgres'),
         'HOST' : os.environ.get('DB_HOST', 'db'),
         'PORT' : os.environ.get('DB_PORT', '5432'),
+        # Reuse a worker's connection across requests, checking it is alive before the first query;
+        # core/asgi.py sets 0 since ASGI runs each request's queries on a new thread
+        'CONN_MAX_AGE' : int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS' : True,
+    }
+}
+
+# Read replica
+# Set DB_REPLICA_HOST to a streaming replica of the primary to send search, availability,
+# analytics and history reads there (see core.dbrouter). Without it the alias points at the
+# primary and is never routed to; tests get it as a separate database
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST' : os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+    'PORT' : os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    # Fail fast so the router can fall back to the primary
+    'OPTIONS' : {'connect_timeout': 3},
+    'TEST' : {'NAME': f"test_{DATABASES['default']['NAME']}_replica"},
+}
+DATABASE_ROUTERS = ['core.dbrouter.ReplicaRouter']
+REPLICA_DATABASE = 'replica' if os.environ.get('DB_REPLICA_HOST') else None
+# After a write, that client reads from the primary for this long to cover replication lag
+REPLICA_PIN_SECONDS = 10
+# How long to stop trying an unreachable replica
+REPLICA_RETRY_SECONDS = 30
+
+# Cache
+# File-based by default so every gunicorn worker on the host shares the same entries
+# core.cache locks add() and incr() across workers, which the OTP limits rely on
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.InstrumentedFileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', '/tmp/django_cache'),
     }
 }
 
@@ -225,3 +265,78 @@ ACCOUNT_LOGOUT_REDIRECT_URL = '/'
 
 # Email configuration (for development)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# OTP configuration
+# Pending OTPs live in the cache; use feature_transaction.otp_backends.DatabaseOTPBackend to store every OTP as a row
+OTP_BACKEND = os.environ.get('OTP_BACKEND', 'feature_transaction.otp_backends.CacheOTPBackend')
+OTP_TTL_SECONDS = 300
+OTP_MAX_ATTEMPTS = 5
+OTP_SEND_RATE_LIMIT = int(os.environ.get('OTP_SEND_RATE_LIMIT', '5'))
+OTP_SEND_RATE_WINDOW = 600
+
+# Ticket signing
+# PEM-encoded Ed25519 private key; when empty a key is derived from DJANGO_SECRET_KEY
+TICKET_SIGNING_KEY = os.environ.get('TICKET_SIGNING_KEY', '')
+
+# Rendered QR ticket images; kept outside MEDIA_ROOT because nginx serves /media/ without authentication
+QR_IMAGE_ROOT = os.environ.get('QR_IMAGE_ROOT', str(BASE_DIR / 'ticket_qr'))
+QR_PRERENDER_WORKERS = 2
+
+# Seat occupancy ranges
+# When enabled, bookings also write SeatOccupancy rows and availability is read from their segment ranges
+SEAT_OCCUPANCY_RANGES = os.environ.get('SEAT_OCCUPANCY_RANGES', 'False').lower() == 'true'
+
+# Request metrics
+# Every gunicorn worker writes its counters to METRICS_DIR and /metrics merges them
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/django_metrics')
+METRICS_FLUSH_INTERVAL = 5
+# Bearer token Prometheus sends when scraping /metrics; without it only staff sessions can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Async read views
+# Serve search, availability, departure board and wallet balance with async views; core/asgi.py turns it on
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', 'False').lower() == 'true'
+
+# Request profiling
+# Staff profile a request with ?_profile=1 or an X-Profile: 1 header; recent profiles are listed at /profiles/
+PROFILES_DIR = os.environ.get('PROFILES_DIR', str(BASE_DIR / 'profiles'))
+PROFILES_KEEP = 200
+# Seconds between stack samples
+PROFILING_INTERVAL = 0.005
+# Share of all requests profiled at random, e.g. 0.001 in production
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+
+# Slow request log
+# Requests slower than SLOW_REQUEST_MS, or with a query slower than SLOW_QUERY_MS, are written
+# to SLOW_REQUEST_LOG with their SQL and plans for the slowest SELECTs
+SLOW_REQUEST_LOGGING = os.environ.get('SLOW_REQUEST_LOGGING', 'True').lower() == 'true'
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', '1000'))
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_REQUEST_EXPLAIN_COUNT = 3
+SLOW_REQUEST_LOG = os.environ.get('SLOW_REQUEST_LOG', '/tmp/django_slow_requests.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        # Each slow log record is already a JSON object
+        'json_line': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_REQUEST_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'json_line',
+        },
+    },
+    'loggers': {
+        'core.slowlog': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,66 @@
+"""
+Slow request and slow query log.
+
+SlowRequestMiddleware times every query of a request. When the request took longer
+than SLOW_REQUEST_MS, or one of its queries longer than SLOW_QUERY_MS, one JSON line
+is written to the `core.slowlog` logger (a rotating file, see LOGGING) with the
+request id, the SQL and timings of every query, and `EXPLAIN` plans for the slowest
+SELECTs. Plans are taken without ANALYZE, so nothing is executed twice. Fast
+requests only pay for a timer around each query.
+"""
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Queries may start with the tag comment from core.querytags
+SELECT_RE = re.compile(r'^\s*(/\*.*?\*/\s*)?SELECT\b', re.IGNORECASE | re.DOTALL)
+
+
+def explain(alias, sql, params):
+    """Return the plan of a query as text, or the error that stopped us getting it."""
+    connection = connections[alias]
+    try:
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE off) {sql}', params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def is_slow(duration_ms, queries):
+    """`queries` is a list of (alias, sql, params, many, ms) tuples in execution order."""
+    slowest_ms = max((query[4] for query in queries), default=0)
+    return duration_ms >= settings.SLOW_REQUEST_MS or slowest_ms >= settings.SLOW_QUERY_MS
+
+
+def log_request(request, response, duration_ms, queries):
+    """Write the log line for a request that is_slow()."""
+    plans = []
+    candidates = sorted(
+        (query for query in queries if not query[3] and SELECT_RE.match(query[1])),
+        key=lambda query: query[4], reverse=True
+    )
+    for alias, sql, params, many, ms in candidates[:settings.SLOW_REQUEST_EXPLAIN_COUNT]:
+        if connections[alias].vendor != 'postgresql':
+            break
+        plans.append({'sql': sql, 'ms': ms, 'plan': explain(alias, sql, params)})
+
+    logger.warning(json.dumps({
+        'time': timezone.now().isoformat(),
+        'request_id': getattr(request, 'request_id', ''),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': request.resolver_match.view_name if request.resolver_match else 'unmatched',
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 2),
+        'query_count': len(queries),
+        'query_ms': round(sum(query[4] for query in queries), 2),
+        'queries': [{'alias': alias, 'sql': sql, 'ms': ms} for alias, sql, params, many, ms in queries],
+        'plans': plans,
+    }))
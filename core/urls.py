@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse
 
+from .views import metrics_view, profile_detail, profile_download, profile_list
+
 def health_check(request):
     return HttpResponse("OK", status=200)
 
@@ -28,4 +30,8 @@ urlpatterns = [
     path('railways/', include('feature_railways.urls')),
     path('transactions/', include('feature_transaction.urls')),
     path('health/', health_check, name='health_check'),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profile_list, name='profile_list'),
+    path('profiles/<str:profile_id>/', profile_detail, name='profile_detail'),
+    path('profiles/<str:profile_id>/download/', profile_download, name='profile_download'),
 ]
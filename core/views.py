@@ -1,2 +1,83 @@
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from . import metrics, profiling
+
+
+def is_staff(user):
+    return user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; needs METRICS_TOKEN as a bearer token, or a staff session."""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    authorized = token and constant_time_compare(authorization, f'Bearer {token}')
+    if not authorized and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@user_passes_test(is_staff)
+def profile_list(request):
+    return render(request, 'core/profile_list.html', {'profiles': profiling.recent_profiles()})
+
+
+@login_required
+@user_passes_test(is_staff)
+def profile_detail(request, profile_id):
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+
+    # Self time per frame (the leaf of each stack) and total time (any position in the stack)
+    self_samples = Counter()
+    total_samples = Counter()
+    for stack, count in profile['stacks'].items():
+        frames = stack.split(';')
+        self_samples[frames[-1]] += count
+        for frame in set(frames):
+            total_samples[frame] += count
+    sample_count = sum(self_samples.values())
+    hot_frames = [
+        {
+            'frame': frame,
+            'self': count,
+            'total': total_samples[frame],
+            'self_pct': 100 * count / sample_count,
+            'total_pct': 100 * total_samples[frame] / sample_count,
+        }
+        for frame, count in self_samples.most_common(30)
+    ]
+    slow_queries = sorted(profile['sql'], key=lambda query: query['ms'], reverse=True)
+
+    return render(request, 'core/profile_detail.html', {
+        'profile': profile,
+        'sample_count': sample_count,
+        'hot_frames': hot_frames,
+        'queries': slow_queries,
+        'query_ms': sum(query['ms'] for query in profile['sql']),
+    })
+
 
+@login_required
+@user_passes_test(is_staff)
+def profile_download(request, profile_id):
+    """Folded stacks for flamegraph.pl, speedscope or inferno, or the whole profile as JSON."""
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+    if request.GET.get('format') == 'json':
+        response = HttpResponse(json.dumps(profile, indent=2), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.json"'
+    else:
+        response = HttpResponse(profiling.folded(profile), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.folded"'
+    return response
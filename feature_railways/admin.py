@@ -9,7 +9,35 @@ admin.site.register(SeatClass)
 admin.site.register(Train)
 admin.site.register(TrainSegment)
 admin.site.register(TrainSeat)
-admin.site.register(Booking)
 admin.site.register(Passenger)
 admin.site.register(SeatBooking)
-# admin.site.register()
\ No newline at end of file
+# admin.site.register()
+
+
+@admin.register(Booking)
+class BookingAdmin(admin.ModelAdmin):
+    list_display = ['booking_id', 'user', 'train', 'booking_status', 'total_fare', 'payment_transaction', 'booking_date']
+    list_filter = ['booking_status', 'booking_date']
+    search_fields = ['booking_id', 'user__username', 'payment_transaction__transaction_id']
+    list_select_related = ['user', 'train__route__source_station', 'train__route__destination_station', 'payment_transaction__user']
+    raw_id_fields = ['payment_transaction']
+
+@admin.register(DailyRouteStats)
+class DailyRouteStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'route', 'bookings', 'confirmations', 'cancellations', 'revenue', 'seats_sold']
+    list_filter = ['date', 'route']
+    list_select_related = ['route__source_station', 'route__destination_station']
+
+@admin.register(SeatOccupancy)
+class SeatOccupancyAdmin(admin.ModelAdmin):
+    list_display = ['train_seat', 'segments', 'passenger', 'booked_at']
+    list_select_related = ['train_seat__train__route__source_station', 'train_seat__train__route__destination_station', 'train_seat__seat_class', 'passenger']
+    raw_id_fields = ['train', 'train_seat', 'passenger']
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ['booking_id', 'user', 'train_number', 'route', 'booking_status', 'total_fare', 'departure_datetime', 'archived_at']
+    list_filter = ['booking_status', 'archived_at']
+    search_fields = ['booking_id', 'user__username']
+    list_select_related = ['user', 'route__source_station', 'route__destination_station']
+    raw_id_fields = ['payment_transaction']
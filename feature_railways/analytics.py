@@ -0,0 +1,178 @@
+"""
+Load-factor analytics over a range of departure dates.
+
+Trains, segments, seat capacity and booked seat-segments are pulled in four bulk
+queries (the last two grouped in the database), turned into NumPy arrays and
+aggregated with bincount, so the cost grows with the number of train segments
+rather than with the number of bookings. Load factor is booked seat-segments
+divided by available seat-segments.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Route, SeatBooking, SeatClass, Station, Train, TrainSeat, TrainSegment
+
+MAX_REPORT_DAYS = 186
+
+REPORT_COLUMNS = {
+    'by_class': ['class', 'booked', 'capacity', 'load_factor'],
+    'by_segment': ['route', 'segment', 'from', 'to', 'trains', 'booked', 'capacity', 'load_factor', 'peak_load_factor', 'sold_out'],
+    'by_route_day': ['date', 'route', 'trains', 'booked', 'capacity', 'load_factor'],
+}
+
+
+def _ratio(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def _index_of(keys, values):
+    """Positions of `values` in the sorted unique array `keys`."""
+    return np.searchsorted(keys, values)
+
+
+def compute_load_factors(start_date, end_date):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    trains = Train.objects.filter(departure_date_time__gte=start, departure_date_time__lt=end)
+
+    train_rows = list(trains.order_by('id').values_list('id', 'route_id', 'departure_date_time'))
+    if not train_rows:
+        return {
+            'start_date': start_date, 'end_date': end_date,
+            'trains': 0, 'segments': 0, 'booked': 0, 'capacity': 0, 'load_factor': 0.0,
+            'by_class': [], 'by_segment': [], 'by_route_day': [],
+        }
+
+    train_ids = np.fromiter((row[0] for row in train_rows), dtype=np.int64, count=len(train_rows))
+    train_route = np.fromiter((row[1] for row in train_rows), dtype=np.int64, count=len(train_rows))
+    train_day = np.array([timezone.localtime(row[2], tz).date() for row in train_rows], dtype='datetime64[D]')
+
+    segment_rows = np.array(
+        list(TrainSegment.objects.filter(train__in=trains).order_by('id').values_list(
+            'id', 'train_id', 'segment_number', 'segment_source_id', 'segment_destination_id'
+        )),
+        dtype=np.int64
+    ).reshape(-1, 5)
+    capacity_rows = np.array(
+        list(TrainSeat.objects.filter(train__in=trains).values_list('train_id', 'seat_class_id').annotate(
+            seats=Count('id')
+        ).order_by()),
+        dtype=np.int64
+    ).reshape(-1, 3)
+    booked_rows = np.array(
+        list(SeatBooking.objects.filter(train__in=trains).values_list(
+            'train_segment_id', 'seat_class_id'
+        ).annotate(seats=Count('id')).order_by()),
+        dtype=np.int64
+    ).reshape(-1, 3)
+
+    class_ids = np.unique(np.concatenate([capacity_rows[:, 1], booked_rows[:, 1]]))
+    segment_ids = segment_rows[:, 0]
+    segment_train = _index_of(train_ids, segment_rows[:, 1])
+
+    # capacity[t, c]: seats of class c on train t; booked[s, c]: seats of class c sold on segment s
+    capacity = np.zeros((len(train_ids), len(class_ids)), dtype=np.int64)
+    capacity[_index_of(train_ids, capacity_rows[:, 0]), _index_of(class_ids, capacity_rows[:, 1])] = capacity_rows[:, 2]
+    booked = np.zeros((len(segment_ids), len(class_ids)), dtype=np.int64)
+    known = np.isin(booked_rows[:, 0], segment_ids)
+    booked[_index_of(segment_ids, booked_rows[known, 0]), _index_of(class_ids, booked_rows[known, 1])] = booked_rows[known, 2]
+
+    segment_capacity = capacity[segment_train]
+    segment_booked_total = booked.sum(axis=1)
+    segment_capacity_total = segment_capacity.sum(axis=1)
+    segment_load = _ratio(segment_booked_total, segment_capacity_total)
+
+    # Per class across every segment in the range
+    class_booked = booked.sum(axis=0)
+    class_capacity = segment_capacity.sum(axis=0)
+    class_load = _ratio(class_booked, class_capacity)
+    class_codes = dict(SeatClass.objects.filter(id__in=class_ids.tolist()).values_list('id', 'code'))
+    by_class = [
+        [class_codes.get(int(class_id), str(class_id)), int(class_booked[i]), int(class_capacity[i]), round(float(class_load[i]), 4)]
+        for i, class_id in enumerate(class_ids)
+    ]
+
+    # Per route segment (route, segment number), aggregated over every train in the range
+    segment_route = train_route[segment_train]
+    group_keys = np.stack([segment_route, segment_rows[:, 2]], axis=1)
+    groups, group_index = np.unique(group_keys, axis=0, return_inverse=True)
+    group_index = group_index.reshape(-1)
+    group_count = len(groups)
+    group_trains = np.bincount(group_index, minlength=group_count)
+    group_booked = np.bincount(group_index, weights=segment_booked_total, minlength=group_count)
+    group_capacity = np.bincount(group_index, weights=segment_capacity_total, minlength=group_count)
+    group_load = _ratio(group_booked, group_capacity)
+    group_peak = np.zeros(group_count)
+    np.maximum.at(group_peak, group_index, segment_load)
+    sold_out = (segment_capacity_total > 0) & (segment_booked_total >= segment_capacity_total)
+    group_sold_out = np.bincount(group_index, weights=sold_out, minlength=group_count)
+    # Any train's segment gives the stations for its (route, segment number) group
+    group_first = np.zeros(group_count, dtype=np.int64)
+    group_first[group_index[::-1]] = np.arange(len(group_index))[::-1]
+
+    route_codes = dict(Route.objects.filter(id__in=np.unique(train_route).tolist()).values_list('id', 'code'))
+    station_codes = dict(Station.objects.filter(id__in=np.unique(segment_rows[:, 3:5]).tolist()).values_list('id', 'code'))
+    by_segment = [
+        [
+            route_codes.get(int(route_id), str(route_id)), int(segment_number),
+            station_codes.get(int(segment_rows[group_first[i], 3]), ''), station_codes.get(int(segment_rows[group_first[i], 4]), ''),
+            int(group_trains[i]), int(group_booked[i]), int(group_capacity[i]),
+            round(float(group_load[i]), 4), round(float(group_peak[i]), 4), int(group_sold_out[i]),
+        ]
+        for i, (route_id, segment_number) in enumerate(groups)
+    ]
+
+    # Per route and departure day, counting every segment of every train
+    train_booked = np.bincount(segment_train, weights=segment_booked_total, minlength=len(train_ids))
+    train_capacity = np.bincount(segment_train, weights=segment_capacity_total, minlength=len(train_ids))
+    day_keys = np.stack([train_day.astype(np.int64), train_route], axis=1)
+    days, day_index = np.unique(day_keys, axis=0, return_inverse=True)
+    day_index = day_index.reshape(-1)
+    day_trains = np.bincount(day_index, minlength=len(days))
+    day_booked = np.bincount(day_index, weights=train_booked, minlength=len(days))
+    day_capacity = np.bincount(day_index, weights=train_capacity, minlength=len(days))
+    day_load = _ratio(day_booked, day_capacity)
+    by_route_day = [
+        [
+            str(np.datetime64(int(day), 'D')), route_codes.get(int(route_id), str(route_id)), int(day_trains[i]),
+            int(day_booked[i]), int(day_capacity[i]), round(float(day_load[i]), 4),
+        ]
+        for i, (day, route_id) in enumerate(days)
+    ]
+
+    total_booked = int(segment_booked_total.sum())
+    total_capacity = int(segment_capacity_total.sum())
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'trains': len(train_ids),
+        'segments': len(segment_ids),
+        'booked': total_booked,
+        'capacity': total_capacity,
+        'load_factor': round(total_booked / total_capacity, 4) if total_capacity else 0.0,
+        'by_class': by_class,
+        'by_segment': by_segment,
+        'by_route_day': by_route_day,
+    }
+
+
+def report_to_json(report):
+    data = dict(report, start_date=report['start_date'].isoformat(), end_date=report['end_date'].isoformat())
+    data['columns'] = REPORT_COLUMNS
+    return data
+
+
+def report_to_csv(report, section):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_COLUMNS[section])
+    writer.writerows(report[section])
+    return buffer.getvalue()
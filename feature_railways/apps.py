@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FeatureRailwaysConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'feature_railways'
+
+    def ready(self):
+        # Connects the signals that bump the reference data version
+        import feature_railways.reference
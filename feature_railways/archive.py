@@ -0,0 +1,83 @@
+"""
+Hot/cold archival of finished journeys.
+
+Bookings on trains that arrived more than a retention window ago are copied into
+ArchivedBooking/ArchivedPassenger (one row per booking and per passenger, seats
+reduced to a seat number and segment range) and deleted from the hot tables along
+with their passengers and seat bookings. Trains left without bookings are then
+deleted with their segments and seats, which keeps the indexes the booking flow
+uses limited to upcoming trains. History pages read both tables.
+"""
+from django.db import transaction
+from django.db.models import Max, Min
+
+from .models import ArchivedBooking, ArchivedPassenger, Booking, Passenger, Train
+from .qr_images import delete_qr_images
+
+
+def archivable_bookings(cutoff):
+    return Booking.objects.filter(train__arrival_date_time__lt=cutoff)
+
+
+def archive_bookings(booking_ids):
+    """Move the given bookings into the archive in one transaction; returns how many were moved."""
+    bookings = list(
+        Booking.objects.filter(id__in=booking_ids).select_related('train').order_by('id')
+    )
+    if not bookings:
+        return 0
+
+    passengers = Passenger.objects.filter(booking__in=bookings).annotate(
+        seat_number=Min('seatbooking__train_seat__seat_number'),
+        first_segment=Min('seatbooking__train_segment__segment_number'),
+        last_segment=Max('seatbooking__train_segment__segment_number'),
+    ).values_list('booking_id', 'name', 'age', 'gender', 'seat_number', 'first_segment', 'last_segment').order_by('id')
+
+    with transaction.atomic():
+        archived = ArchivedBooking.objects.bulk_create([
+            ArchivedBooking(
+                booking_id=booking.booking_id,
+                user_id=booking.user_id,
+                train_number=booking.train_id,
+                route_id=booking.train.route_id,
+                seat_class_id=booking.seat_class_id,
+                passenger_count=booking.passenger_count,
+                total_fare=booking.total_fare,
+                # The journey is over, so a confirmed ticket has been used
+                booking_status='COMPLETED' if booking.booking_status == 'CONFIRMED' else booking.booking_status,
+                booking_date=booking.booking_date,
+                journey_source_id=booking.journey_source_id,
+                journey_destination_id=booking.journey_destination_id,
+                departure_datetime=booking.departure_datetime or booking.train.departure_date_time,
+                arrival_datetime=booking.arrival_datetime or booking.train.arrival_date_time,
+                is_verified=booking.is_verified,
+                verification_timestamp=booking.verification_timestamp,
+                payment_transaction_id=booking.payment_transaction_id,
+            )
+            for booking in bookings
+        ])
+        archived_ids = {booking.pk: entry.pk for booking, entry in zip(bookings, archived)}
+        ArchivedPassenger.objects.bulk_create([
+            ArchivedPassenger(
+                booking_id=archived_ids[booking_id], name=name, age=age, gender=gender,
+                seat_number=seat_number or '', first_segment=first_segment, last_segment=last_segment
+            )
+            for booking_id, name, age, gender, seat_number, first_segment, last_segment in passengers
+        ])
+        Booking.objects.filter(id__in=archived_ids).delete()
+
+    for booking in bookings:
+        if booking.qr_code_data:
+            delete_qr_images(booking.booking_id, booking.qr_code_data)
+    return len(bookings)
+
+
+def purge_finished_trains(cutoff, batch_size):
+    """Delete trains that arrived before `cutoff` and have no bookings left; returns how many went."""
+    train_ids = list(
+        Train.objects.filter(arrival_date_time__lt=cutoff, bookings__isnull=True)
+        .order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    if train_ids:
+        Train.objects.filter(id__in=train_ids).delete()
+    return len(train_ids)
@@ -0,0 +1,157 @@
+"""
+Async versions of the read-heavy public endpoints, served when ASYNC_READ_VIEWS is
+on (core/asgi.py turns it on). Under ASGI a request waiting on the database
+doesn't hold a worker process; whether that buys throughput depends on the
+hardware and how long queries wait, so compare the two deployments with the
+load_test command (see docker-compose.asgi.yml) before switching.
+
+Stations come from the reference data cache, which answers from memory on the
+event loop between version checks, and the search and availability queries use
+the async ORM. Code that only runs sync (form validation against the database,
+template rendering, the station board builder and the rare halt timing fallback)
+goes through one sync_to_async call each.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from core.dbrouter import replica_reads
+
+from . import reference, views
+from .booking_services import BookingService
+from .forms import TrainSearchForm
+from .models import Station, Train, TrainSegment
+from .services import STATION_BOARD_CACHE_TIMEOUT, STATION_BOARD_MAX_HOURS, get_segment_timing, get_station_board
+
+
+async def _get_station(station_id=None, code=None):
+    """From the reference data cache, or the database for a station the cache hasn't picked up yet."""
+    if code is not None:
+        station = await reference.aget_station_by_code(code)
+        lookup = {'code__iexact': code}
+    else:
+        station = await reference.aget_station(station_id)
+        lookup = {'id': station_id}
+    if station is not None:
+        return station
+    try:
+        return await Station.objects.aget(**lookup)
+    except Station.DoesNotExist:
+        raise Http404('Station not found')
+
+
+async def _render_search(request, form, trains=(), source=None, destination=None):
+    # Rendering reads request.user and the station choices
+    return await sync_to_async(render)(request, 'feature_railways/search_results.html', {
+        'form': form,
+        'trains': trains,
+        'search_source': source,
+        'search_destination': destination,
+        'current_time': timezone.now()
+    })
+
+
+@replica_reads
+async def search_trains(request):
+    """views.search_trains on the async ORM."""
+    form = TrainSearchForm(request.GET or None)
+    # The station fields are ModelChoiceFields, which look the ids up while validating
+    if not await sync_to_async(form.is_valid)():
+        return await _render_search(request, form)
+    source = form.cleaned_data['source']
+    destination = form.cleaned_data['destination']
+    if source == destination:
+        messages.error(request, "Source and destination stations cannot be the same. Please select different stations.")
+        return await _render_search(request, form)
+
+    current_time = timezone.now()
+    date_trains = views.departing_trains(form.cleaned_data['date'], current_time)
+    trains = [
+        train async for train in date_trains.filter(route__source_station=source, route__destination_station=destination)
+    ]
+    other_trains = {train.id: train async for train in date_trains.exclude(id__in=[train.id for train in trains])}
+
+    departures = {
+        segment['train_id']: segment async for segment in TrainSegment.objects.filter(
+            train_id__in=other_trains, segment_source=source
+        ).values('train_id', 'segment_number', 'departure_date_time')
+    }
+    arrivals = {
+        segment['train_id']: segment async for segment in TrainSegment.objects.filter(
+            train_id__in=departures, segment_destination=destination
+        ).values('train_id', 'segment_number', 'arrival_date_time')
+    }
+
+    for train_id, arrival in arrivals.items():
+        departure = departures[train_id]
+        if departure['segment_number'] > arrival['segment_number']:
+            continue
+        train = other_trains[train_id]
+        if departure['departure_date_time'] is None or arrival['arrival_date_time'] is None:
+            timing = await sync_to_async(get_segment_timing)(train, source, destination)
+            if not timing:
+                continue
+            train.segment_departure = timing['segment_departure']
+            train.segment_arrival = timing['segment_arrival']
+        else:
+            train.segment_departure = departure['departure_date_time']
+            train.segment_arrival = arrival['arrival_date_time']
+        train.segment_duration = train.segment_arrival - train.segment_departure
+        if train.segment_departure <= current_time:
+            continue
+        train.journey_source = source
+        train.journey_destination = destination
+        trains.append(train)
+
+    trains.sort(key=lambda t: getattr(t, 'segment_departure', t.departure_date_time))
+
+    for train in trains:
+        route = await reference.aget_route(train.route_id)
+        train.seat_availability = {}
+        for route_seat in route.seat_classes:
+            train.seat_availability[route_seat.seat_class] = await BookingService.aget_seat_availability(
+                train, route_seat.seat_class, source, destination
+            )
+
+    return await _render_search(request, form, trains, source, destination)
+
+
+@replica_reads
+async def train_availability(request, train_id):
+    train = await Train.objects.filter(id=train_id).afirst()
+    if train is None:
+        raise Http404('Train not found')
+    try:
+        source_id, destination_id = views.parse_journey_ids(request)
+    except ValueError:
+        return JsonResponse({'error': 'source and destination must both be station ids'}, status=400)
+    journey_source = await _get_station(source_id) if source_id else None
+    journey_destination = await _get_station(destination_id) if destination_id else None
+    availability = await sync_to_async(BookingService.get_train_availability)(train, journey_source, journey_destination)
+    return JsonResponse(availability)
+
+
+@replica_reads
+async def station_board(request, station_code):
+    station = await _get_station(code=station_code)
+    board = await sync_to_async(get_station_board)(station)
+    # Rendering reads request.user through the context processors
+    return await sync_to_async(render)(request, 'feature_railways/station_board.html', {
+        'station': station,
+        'board': board,
+        'refresh_seconds': STATION_BOARD_CACHE_TIMEOUT,
+    })
+
+
+@replica_reads
+async def station_board_data(request, station_code):
+    station = await _get_station(code=station_code)
+    try:
+        hours = min(max(int(request.GET.get('hours', 3)), 1), STATION_BOARD_MAX_HOURS)
+    except ValueError:
+        return JsonResponse({'error': 'hours must be a number'}, status=400)
+    response = JsonResponse(await sync_to_async(get_station_board)(station, hours))
+    response['Cache-Control'] = f'public, max-age={STATION_BOARD_CACHE_TIMEOUT}'
+    return response
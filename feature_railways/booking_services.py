@@ -1,17 +1,40 @@
-from django.db import transaction
+import logging
+
+from django.db import IntegrityError, transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db.models import Q, Count, Sum
+from django.db.models import F, Q, Count, Sum, Case, When, Value, DateTimeField
+from django.db.models.functions import Coalesce, Least
+from django.utils.dateparse import parse_datetime
 from decimal import Decimal
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-from feature_transaction.models import Transaction
+from core.querytags import tag_service_methods
+from feature_transaction.models import Transaction, Wallet
+from feature_transaction.services import OTPService
+from . import reference
+from .manifest import invalidate_train_manifest
+from .occupancy import count_available_seats, free_seats, journey_segment_range, occupancy_enabled, record_occupancy, segment_range
+from .qr_images import delete_qr_images, schedule_qr_prerender
+from .rollups import record_booking_cancelled, record_booking_confirmed, record_booking_created
+from .services import get_segment_timing
+from .tickets import issue_ticket_token, verify_ticket_token
 from .models import (
     Train, TrainSeat, TrainSegment, SeatBooking, Booking, 
-    Passenger, RouteSeatClass, SeatClass, RouteHalt
+    Passenger, SeatClass, ArchivedBooking
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Relations read by booking pages through the actual_* properties and templates
+BOOKING_DETAIL_RELATED = (
+    'train__route__source_station', 'train__route__destination_station',
+    'journey_source', 'journey_destination', 'seat_class'
 )
 
 
+@tag_service_methods
 class BookingService:
 
     @staticmethod
@@ -19,7 +42,7 @@ class BookingService:
         try:
             total_seats = TrainSeat.objects.filter(
                 train=train,
-                seat_class=seat_class
+                seat_class_id=seat_class.pk
             ).count()
             
             if total_seats == 0:
@@ -41,12 +64,6 @@ class BookingService:
                         'total_seats': total_seats,
                         'message': "No valid segments found for this journey"
                     }
-                
-                segment_availability = BookingService._get_segment_availability(
-                    train, seat_class, segments_to_check
-                )
-                available_seats = segment_availability['available_seats']
-                
             else:
                 segments_to_check = TrainSegment.objects.filter(train=train)
                 if not segments_to_check.exists():
@@ -56,6 +73,10 @@ class BookingService:
                         'total_seats': total_seats,
                         'message': "No segments configured for this train"
                     }
+            
+            if occupancy_enabled():
+                available_seats = count_available_seats(train, seat_class, journey_segment_range(segments_to_check))
+            else:
                 segment_availability = BookingService._get_segment_availability(
                     train, seat_class, segments_to_check
                 )
@@ -82,55 +103,66 @@ class BookingService:
                 'message': f"Error checking availability: {str(e)}"
             }
     
+    @staticmethod
+    def get_train_availability(train, journey_source=None, journey_destination=None):
+        """Seats left in every class of a train, over the whole route or one journey."""
+        classes = []
+        for route_seat in reference.get_route_seat_classes(train.route_id):
+            availability = BookingService.check_seat_availability(
+                train, route_seat.seat_class, 1, journey_source, journey_destination
+            )
+            classes.append({
+                'code': route_seat.seat_class.code,
+                'class_type': route_seat.seat_class.class_type,
+                'available_seats': availability['available_seats'],
+                'total_seats': availability['total_seats'],
+            })
+        return {
+            'train': train.id,
+            'source': journey_source.code if journey_source else None,
+            'destination': journey_destination.code if journey_destination else None,
+            'classes': classes,
+        }
+
+    @staticmethod
+    async def aget_seat_availability(train, seat_class, journey_source, journey_destination):
+        """Seats left and in total for one journey, as check_seat_availability counts them, with the async ORM."""
+        total_seats = await TrainSeat.objects.filter(train=train, seat_class_id=seat_class.pk).acount()
+        if total_seats == 0:
+            return {'available_seats': 0, 'total_seats': 0}
+
+        route = await reference.aget_route(train.route_id)
+        segments = BookingService._get_overlapping_segments(train, journey_source, journey_destination, route)
+        segment_numbers = [number async for number in segments.values_list('segment_number', flat=True)]
+        if not segment_numbers:
+            return {'available_seats': 0, 'total_seats': total_seats}
+
+        if occupancy_enabled():
+            occupied = segment_range(min(segment_numbers), max(segment_numbers))
+            available_seats = await free_seats(train, seat_class, occupied).acount()
+        else:
+            booked_counts = SeatBooking.objects.filter(
+                train=train,
+                seat_class_id=seat_class.pk,
+                segment_number__in=segment_numbers
+            ).values('segment_number').annotate(booked=Count('train_seat')).order_by()
+            most_booked = max([row['booked'] async for row in booked_counts], default=0)
+            available_seats = max(0, total_seats - most_booked)
+        return {'available_seats': available_seats, 'total_seats': total_seats}
+
     @staticmethod
     def calculate_fare(train, seat_class, passenger_count, journey_source=None, journey_destination=None):
         try:
-            route = train.route
+            route = reference.get_route(train.route_id)
+            if route is None:
+                raise ValidationError("Route not found for this train")
             
-            try:
-                route_seat_class = RouteSeatClass.objects.get(
-                    route=route,
-                    seat_class=seat_class
-                )
-                base_fare_per_hour = route_seat_class.base_fare_per_hour
-            except RouteSeatClass.DoesNotExist:
-                base_fare_per_hour = Decimal('50.00')
+            route_seat_class = route.get_seat_class(seat_class.pk)
+            base_fare_per_hour = route_seat_class.base_fare_per_hour if route_seat_class else Decimal('50.00')
             
-            if journey_source and journey_destination:
-                station_sequence = []
-                
-                station_sequence.append({
-                    'station': route.source_station,
-                    'sequence': 0,
-                    'duration_from_start': timedelta(seconds=0)
-                })
-                
-                for halt in RouteHalt.objects.filter(route=route).order_by('sequence_number'):
-                    station_sequence.append({
-                        'station': halt.station,
-                        'sequence': halt.sequence_number,
-                        'duration_from_start': halt.journey_duration_from_source
-                    })
-                
-                station_sequence.append({
-                    'station': route.destination_station,
-                    'sequence': len(station_sequence),
-                    'duration_from_start': route.journey_duration
-                })
-                
-                source_timing = None
-                destination_timing = None
-                
-                for station_item in station_sequence:
-                    if station_item['station'] == journey_source:
-                        source_timing = station_item
-                    if station_item['station'] == journey_destination:
-                        destination_timing = station_item
-                
-                if source_timing and destination_timing:
-                    journey_duration = destination_timing['duration_from_start'] - source_timing['duration_from_start']
-                else:
-                    journey_duration = route.journey_duration
+            if (journey_source and journey_destination
+                    and journey_source.pk in route.station_offsets and journey_destination.pk in route.station_offsets):
+                journey_duration = route.station_offsets[journey_destination.pk] - route.station_offsets[journey_source.pk]
             else:
                 journey_duration = route.journey_duration
             
@@ -204,7 +236,7 @@ class BookingService:
             
             all_seats = list(TrainSeat.objects.filter(
                 train=train,
-                seat_class=seat_class
+                seat_class_id=seat_class.pk
             ).order_by('seat_number'))
             
             if len(all_seats) == 0:
@@ -217,31 +249,15 @@ class BookingService:
             else:
                 segments_to_check = train_segments
             
-            if journey_source and journey_destination:
-                segment_availability = BookingService._get_segment_availability(
-                    train, seat_class, segments_to_check
-                )
-                
-                all_seat_ids = set(seat.id for seat in all_seats)
-                available_seat_ids = all_seat_ids.copy()
-                
-                for segment in segments_to_check:
-                    segment_booked_seats = set(SeatBooking.objects.filter(
-                        train_segment=segment,
-                        train_seat__seat_class=seat_class
-                    ).values_list('train_seat_id', flat=True))
-                    
-                    available_seat_ids -= segment_booked_seats
-                
-                available_seats = [seat for seat in all_seats if seat.id in available_seat_ids]
+            occupancy_range = journey_segment_range(segments_to_check) if occupancy_enabled() else None
+            if occupancy_range is not None:
+                available_seats = list(free_seats(train, seat_class, occupancy_range))
             else:
-                booked_seat_ids = set()
-                for segment in segments_to_check:
-                    segment_bookings = SeatBooking.objects.filter(
-                        train_segment=segment,
-                        train_seat__seat_class=seat_class
-                    ).values_list('train_seat_id', flat=True)
-                    booked_seat_ids.update(segment_bookings)
+                booked_seat_ids = set(SeatBooking.objects.filter(
+                    train=train,
+                    seat_class_id=seat_class.pk,
+                    segment_number__in=[segment.segment_number for segment in segments_to_check]
+                ).values_list('train_seat_id', flat=True))
                 
                 available_seats = [seat for seat in all_seats if seat.id not in booked_seat_ids]
             
@@ -250,46 +266,53 @@ class BookingService:
             
             selected_seats = available_seats[:passenger_count]
             
-            # Create booking first (temporarily without passengers)
-            booking = Booking.objects.create(
-                user=user,
-                train=train,
-                seat_class=seat_class,
-                passenger_count=passenger_count,
-                total_fare=fare_info['total_fare'],
-                booking_status='PENDING_PAYMENT',
-                journey_source=journey_source,
-                journey_destination=journey_destination
-            )
-            
-            # Now create passengers and link them to the booking
-            passengers = []
-            for passenger_data in passengers_data:
-                passenger = Passenger.objects.create(
-                    name=passenger_data['name'].strip(),
-                    age=passenger_data['age'],
-                    gender=passenger_data['gender'],
-                    booking_by=user,
-                    booking=booking
+            with transaction.atomic():
+                # Create booking first (temporarily without passengers)
+                booking = Booking.objects.create(
+                    user=user,
+                    train=train,
+                    seat_class_id=seat_class.pk,
+                    passenger_count=passenger_count,
+                    total_fare=fare_info['total_fare'],
+                    booking_status='PENDING_PAYMENT',
+                    journey_source_id=journey_source.pk if journey_source else None,
+                    journey_destination_id=journey_destination.pk if journey_destination else None
                 )
-                passengers.append(passenger)
-            
-            if journey_source and journey_destination:
-                timing = BookingService._get_segment_timing(train, journey_source, journey_destination)
-                if timing:
-                    booking.departure_datetime = timing['departure']
-                    booking.arrival_datetime = timing['arrival']
-                    booking.save()
-            
-            for i, passenger in enumerate(passengers):
-                seat = selected_seats[i]
-                for segment in segments_to_check:
-                    SeatBooking.objects.create(
-                        train_seat=seat,
-                        train_segment=segment,
-                        passenger=passenger,
-                        price_for_segment=fare_info['per_passenger_fare']
+                
+                # Now create passengers and link them to the booking
+                passengers = []
+                for passenger_data in passengers_data:
+                    passenger = Passenger.objects.create(
+                        name=passenger_data['name'].strip(),
+                        age=passenger_data['age'],
+                        gender=passenger_data['gender'],
+                        booking_by=user,
+                        booking=booking
                     )
+                    passengers.append(passenger)
+                
+                if journey_source and journey_destination:
+                    timing = BookingService._get_segment_timing(train, journey_source, journey_destination)
+                    if timing:
+                        booking.departure_datetime = timing['departure']
+                        booking.arrival_datetime = timing['arrival']
+                        booking.save()
+                
+                if occupancy_range is not None:
+                    record_occupancy(train, seat_class, zip(passengers, selected_seats), occupancy_range)
+                
+                for i, passenger in enumerate(passengers):
+                    seat = selected_seats[i]
+                    for segment in segments_to_check:
+                        SeatBooking.objects.create(
+                            train_seat=seat,
+                            train_segment=segment,
+                            passenger=passenger,
+                            price_for_segment=fare_info['per_passenger_fare']
+                        )
+            
+            invalidate_train_manifest(train.id)
+            record_booking_created(booking)
             
             return {
                 'success': True,
@@ -297,6 +320,13 @@ class BookingService:
                 'message': f'Booking created successfully with ID: {booking.booking_id}'
             }
             
+        except IntegrityError:
+            # Seat uniqueness and occupancy constraints reject seats another booking took meanwhile
+            return {
+                'success': False,
+                'booking': None,
+                'message': 'Some of the selected seats were just booked by someone else, please try again'
+            }
         except ValidationError as e:
             return {
                 'success': False,
@@ -333,7 +363,7 @@ class BookingService:
             
             # Delete seat bookings for this specific booking
             seat_bookings = SeatBooking.objects.filter(
-                train_seat__train=booking.train,
+                train_id=booking.train_id,
                 passenger__booking=booking
             )
             seat_bookings.delete()
@@ -344,18 +374,14 @@ class BookingService:
             
             booking.booking_status = 'CANCELLED'
             booking.save()
+            invalidate_train_manifest(booking.train_id)
+            record_booking_cancelled(booking)
+            if booking.qr_code_data:
+                delete_qr_images(booking.booking_id, booking.qr_code_data)
             
             try:
-                # Check if there was a payment for this booking
-                payment_transaction = Transaction.objects.filter(
-                    user=user,
-                    amount=booking.total_fare,
-                    purpose='PAYMENT',
-                    status='COMPLETED',
-                    booking_id=booking.booking_id
-                ).first()
-                
-                if payment_transaction:
+                # Only bookings paid through the wallet carry a payment link
+                if booking.payment_transaction_id:
                     # Process refund using TransactionService
                     from feature_transaction.services import TransactionService
                     refund_result = TransactionService.process_refund(
@@ -396,99 +422,118 @@ class BookingService:
     
     @staticmethod
     def get_booking_summary(booking):
+        """Expects a booking loaded with BOOKING_DETAIL_RELATED; seats and segments come from one query."""
         try:
-            # Get passengers directly from the booking relationship
-            passengers = booking.passengers.all()
-            
+            seat_bookings = SeatBooking.objects.filter(passenger__booking=booking).select_related(
+                'passenger', 'train_seat__seat_class',
+                'train_segment__segment_source', 'train_segment__segment_destination'
+            ).order_by('passenger_id', 'train_segment__segment_number')
+
+            passengers = []
             seat_assignments = []
-            segment_details = []
-            
-            for passenger in passengers:
-                # Get the seat booking for this passenger
-                seat_booking = SeatBooking.objects.filter(
-                    passenger=passenger,
-                    train_seat__train=booking.train
-                ).first()
-                
-                if seat_booking:
+            segments = {}
+            for seat_booking in seat_bookings:
+                passenger = seat_booking.passenger
+                if not passengers or passengers[-1].pk != passenger.pk:
+                    passengers.append(passenger)
                     seat_assignments.append({
                         'passenger': passenger,
+                        'seat': seat_booking.train_seat,
                         'seat_number': seat_booking.train_seat.seat_number
                     })
-            
-            # Get segment information for segment bookings
-            if booking.journey_source and booking.journey_destination:
-                # This is a segment booking
-                segments = SeatBooking.objects.filter(
-                    passenger__booking=booking,
-                    train_seat__train=booking.train
-                ).values_list('train_segment', flat=True).distinct()
-                
-                for segment_id in segments:
-                    try:
-                        from .models import TrainSegment
-                        segment = TrainSegment.objects.get(id=segment_id)
-                        segment_details.append({
-                            'segment_number': segment.segment_number,
-                            'source': segment.segment_source,
-                            'destination': segment.segment_destination,
-                            'departure_time': segment.departure_date_time,
-                            'arrival_time': segment.arrival_date_time
-                        })
-                    except:
-                        continue
-            
+                segments.setdefault(seat_booking.train_segment.segment_number, seat_booking.train_segment)
+
+            is_segment_booking = booking.journey_source_id is not None and booking.journey_destination_id is not None
+            segment_details = []
+            if is_segment_booking:
+                segment_details = [
+                    {
+                        'segment_number': segment.segment_number,
+                        'source': segment.segment_source,
+                        'destination': segment.segment_destination,
+                        'departure_time': segment.departure_date_time,
+                        'arrival_time': segment.arrival_date_time
+                    }
+                    for _, segment in sorted(segments.items())
+                ]
+
             # Calculate fare breakdown
             fare_breakdown = {
                 'total_fare': booking.total_fare,
                 'per_passenger_fare': booking.total_fare / booking.passenger_count if booking.passenger_count > 0 else 0,
                 'passenger_count': booking.passenger_count
             }
-            
+
             return {
                 'booking': booking,
                 'passengers': passengers,
                 'seat_assignments': seat_assignments,
-                'passenger_count': passengers.count(),
+                'passenger_count': len(passengers),
                 'segment_details': segment_details,
                 'fare_breakdown': fare_breakdown,
-                'is_segment_booking': booking.journey_source is not None and booking.journey_destination is not None,
+                'is_segment_booking': is_segment_booking,
                 'route': booking.train.route,
                 'train': booking.train
             }
-            
+
         except Exception as e:
             return {'error': str(e)}
-    
+
     @staticmethod
-    def _get_overlapping_segments(train, journey_source, journey_destination):
-        route = train.route
-        
-        station_sequence = []
-        station_sequence.append({
-            'station': route.source_station,
-            'sequence': 0
-        })
-        
-        for halt in RouteHalt.objects.filter(route=route).order_by('sequence_number'):
-            station_sequence.append({
-                'station': halt.station,
-                'sequence': halt.sequence_number
-            })
-        
-        station_sequence.append({
-            'station': route.destination_station,
-            'sequence': len(station_sequence)
-        })
-        
-        source_sequence = None
-        destination_sequence = None
-        
-        for station_item in station_sequence:
-            if station_item['station'] == journey_source:
-                source_sequence = station_item['sequence']
-            if station_item['station'] == journey_destination:
-                destination_sequence = station_item['sequence']
+    def get_profile_summary(user):
+        """Everything the profile page shows, in four queries however many bookings the user has."""
+        # The page lists every booking anyway, so the counts come from the loaded rows
+        bookings = list(Booking.objects.filter(user=user).select_related(*BOOKING_DETAIL_RELATED))
+        # Finished journeys moved out by archive_completed_journeys still belong in the history
+        archived = list(
+            ArchivedBooking.objects.filter(user=user)
+            .select_related('route__source_station', 'route__destination_station', 'journey_source', 'journey_destination', 'seat_class')
+        )
+        wallet = Wallet.objects.filter(user=user).first()
+        recent_transactions = list(Transaction.objects.filter(user=user).order_by('-created_at')[:5])
+        user_bookings = bookings + archived
+        user_bookings.sort(key=lambda booking: booking.booking_date, reverse=True)
+        return {
+            'user_bookings': user_bookings,
+            'wallet': wallet,
+            'wallet_balance': wallet.balance if wallet else Decimal('0.00'),
+            'recent_transactions': recent_transactions,
+            'total_bookings': len(user_bookings),
+            'confirmed_bookings': sum(1 for booking in bookings if booking.booking_status == 'CONFIRMED'),
+            'verified_bookings': sum(1 for booking in user_bookings if booking.is_verified),
+        }
+
+    @staticmethod
+    def get_archived_booking_summary(booking):
+        """The booking_summary shape the detail page uses, built from the archived passengers."""
+        passengers = list(booking.passengers.order_by('id'))
+        return {
+            'booking': booking,
+            'passengers': passengers,
+            'seat_assignments': [
+                {'passenger': passenger, 'seat': None, 'seat_number': passenger.seat_number}
+                for passenger in passengers
+            ],
+            'passenger_count': len(passengers),
+            'segment_details': [],
+            'fare_breakdown': {
+                'total_fare': booking.total_fare,
+                'per_passenger_fare': booking.total_fare / booking.passenger_count if booking.passenger_count > 0 else 0,
+                'passenger_count': booking.passenger_count
+            },
+            'is_segment_booking': booking.is_segment_booking,
+            'route': booking.route,
+            'train': booking.train
+        }
+
+    @staticmethod
+    def _get_overlapping_segments(train, journey_source, journey_destination, route=None):
+        route = route or reference.get_route(train.route_id)
+        if route is None:
+            return TrainSegment.objects.none()
+        station_positions = route.station_positions
+        source_sequence = station_positions.get(journey_source.pk)
+        destination_sequence = station_positions.get(journey_destination.pk)
         
         if source_sequence is None or destination_sequence is None:
             return TrainSegment.objects.none()
@@ -509,26 +554,22 @@ class BookingService:
         try:
             total_seats = TrainSeat.objects.filter(
                 train=train,
-                seat_class=seat_class
+                seat_class_id=seat_class.pk
             ).count()
             
-            if not segments.exists():
+            segment_numbers = [segment.segment_number for segment in segments]
+            if not segment_numbers:
                 return {
                     'total_seats': total_seats,
                     'available_seats': total_seats
                 }
             
-            min_available = total_seats
-            
-            for segment in segments:
-                booked_count = SeatBooking.objects.filter(
-                    train_segment=segment,
-                    train_seat__seat_class=seat_class
-                ).count()
-                
-                available_in_segment = total_seats - booked_count
-                if available_in_segment < min_available:
-                    min_available = available_in_segment
+            booked_counts = SeatBooking.objects.filter(
+                train=train,
+                seat_class_id=seat_class.pk,
+                segment_number__in=segment_numbers
+            ).values('segment_number').annotate(booked=Count('train_seat')).order_by()
+            min_available = total_seats - max((row['booked'] for row in booked_counts), default=0)
             
             return {
                 'total_seats': total_seats,
@@ -543,42 +584,235 @@ class BookingService:
     
     @staticmethod
     def _get_segment_timing(train, journey_source, journey_destination):
-        route = train.route
-        
-        station_sequence = []
-        station_sequence.append({
-            'station': route.source_station,
-            'duration_from_start': timedelta(seconds=0)
-        })
-        
-        for halt in RouteHalt.objects.filter(route=route).order_by('sequence_number'):
-            station_sequence.append({
-                'station': halt.station,
-                'duration_from_start': halt.journey_duration_from_source
-            })
-        
-        station_sequence.append({
-            'station': route.destination_station,
-            'duration_from_start': route.journey_duration
-        })
-        
-        source_timing = None
-        destination_timing = None
-        
-        for station_item in station_sequence:
-            if station_item['station'] == journey_source:
-                source_timing = station_item
-            if station_item['station'] == journey_destination:
-                destination_timing = station_item
-        
-        if source_timing and destination_timing:
-            departure = train.departure_date_time + source_timing['duration_from_start']
-            arrival = train.departure_date_time + destination_timing['duration_from_start']
-            
+        timing = get_segment_timing(train, journey_source, journey_destination)
+        if timing:
             return {
-                'departure': departure,
-                'arrival': arrival
+                'departure': timing['segment_departure'],
+                'arrival': timing['segment_arrival']
             }
-        
         return None
-    
+
+
+@tag_service_methods
+class BookingPaymentService:
+
+    @staticmethod
+    def pay_and_confirm(booking, otp_code):
+        """
+        Consume the payment OTP, debit the wallet, record the linked transaction
+        and confirm the booking in a single database transaction.
+        """
+        try:
+            with transaction.atomic():
+                return BookingPaymentService._pay_and_confirm(booking, otp_code)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to process payment'
+            }
+
+    @staticmethod
+    def _pay_and_confirm(booking, otp_code):
+        # Every check that can fail runs before the first write, so an early return leaves nothing to roll back
+        # The route comes along for the rollup; of=('self',) keeps the lock on the booking row alone
+        locked_booking = Booking.objects.select_for_update(of=('self',)).only(
+            'id', 'booking_id', 'user_id', 'train_id', 'total_fare', 'passenger_count', 'booking_status'
+        ).annotate(route_id=F('train__route_id')).get(pk=booking.pk)
+
+        if locked_booking.booking_status == 'CONFIRMED':
+            return {
+                'success': False,
+                'error': 'Already paid',
+                'message': 'This booking is already paid'
+            }
+
+        if locked_booking.booking_status != 'PENDING_PAYMENT':
+            return {
+                'success': False,
+                'error': 'Invalid booking status',
+                'message': f'Booking is {locked_booking.booking_status}, payment not allowed'
+            }
+
+        amount = locked_booking.total_fare
+        wallet = Wallet.objects.select_for_update().get(user_id=locked_booking.user_id)
+
+        if wallet.balance < amount:
+            return {
+                'success': False,
+                'error': 'Insufficient balance',
+                'message': f'Insufficient balance. Available: ₹{wallet.balance}, Required: ₹{amount}'
+            }
+
+        # Consuming the OTP is the last check; with the cache backend it cannot be rolled back
+        otp_result = OTPService.verify_otp(locked_booking.user_id, otp_code, 'PAYMENT')
+        if not otp_result['success']:
+            return otp_result
+
+        now = timezone.now()
+        balance_before = wallet.balance
+        wallet.balance -= amount
+        wallet.save(update_fields=['balance', 'updated_at'])
+
+        txn = Transaction.objects.create(
+            user_id=locked_booking.user_id,
+            amount=amount,
+            transaction_type='DEBIT',
+            purpose='PAYMENT',
+            status='COMPLETED',
+            description=f'Payment for booking {locked_booking.booking_id}',
+            booking_id=locked_booking.booking_id,
+            wallet_balance_before=balance_before,
+            wallet_balance_after=wallet.balance,
+            otp_verification=otp_result['otp_verification'],
+            processed_at=now,
+            completed_at=now
+        )
+
+        # The ticket is signed once here, so reading it later never writes
+        qr_code_data = issue_ticket_token(locked_booking)
+        Booking.objects.filter(pk=locked_booking.pk).update(
+            booking_status='CONFIRMED', payment_transaction=txn, qr_code_data=qr_code_data
+        )
+        booking.booking_status = 'CONFIRMED'
+        booking.payment_transaction = txn
+        booking.qr_code_data = qr_code_data
+        invalidate_train_manifest(booking.train_id)
+        record_booking_confirmed(locked_booking, route_id=locked_booking.route_id)
+        schedule_qr_prerender(booking.pk)
+
+        return {
+            'success': True,
+            'transaction': txn,
+            'new_balance': wallet.balance,
+            'message': 'Payment successful! Your booking is confirmed.'
+        }
+
+
+@tag_service_methods
+class TicketScanService:
+
+    MAX_BATCH_SIZE = 500
+
+    @staticmethod
+    def _parse_scan_time(value, now):
+        if value is None:
+            return now
+        try:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                # Scanners send epoch seconds or milliseconds
+                scanned_at = datetime.fromtimestamp(value / 1000 if value > 1e11 else value, tz=dt_timezone.utc)
+            elif isinstance(value, str):
+                scanned_at = parse_datetime(value)
+                if timezone.is_naive(scanned_at):
+                    scanned_at = timezone.make_aware(scanned_at)
+            else:
+                raise ValueError(value)
+        except (ValueError, TypeError, AttributeError, OverflowError, OSError):
+            raise ValidationError('Invalid timestamp')
+        # A device clock running ahead must not push the first scan into the future
+        return min(scanned_at, now)
+
+    @staticmethod
+    def verify_batch(events):
+        """
+        Record a batch of scan events with one bulk update, keeping the earliest
+        verification time per booking, and return one result per event.
+        """
+        if len(events) > TicketScanService.MAX_BATCH_SIZE:
+            return {
+                'success': False,
+                'error': 'Batch too large',
+                'message': f'At most {TicketScanService.MAX_BATCH_SIZE} scans can be sent at once'
+            }
+
+        now = timezone.now()
+        results = []
+        earliest_scans = {}
+        for event in events:
+            result = {'booking_id': None, 'device': None}
+            results.append(result)
+            try:
+                if not isinstance(event, dict):
+                    raise ValidationError('Invalid scan event')
+                result['device'] = event.get('device')
+                scanned_at = TicketScanService._parse_scan_time(event.get('timestamp'), now)
+                if event.get('qr_data'):
+                    # Offline scans may be synced after the ticket expires, so check expiry against the scan time
+                    ticket = verify_ticket_token(event['qr_data'], check_expiry=False)
+                    if ticket['exp'] < scanned_at.timestamp():
+                        raise ValidationError('Ticket had expired when scanned')
+                    booking_id = ticket['b']
+                else:
+                    booking_id = event.get('booking_id')
+                if not booking_id or not isinstance(booking_id, str):
+                    raise ValidationError('booking_id or qr_data is required')
+            except ValidationError as e:
+                result.update(status='INVALID', error=e.messages[0])
+                continue
+
+            result['booking_id'] = booking_id
+            result['scanned_at'] = scanned_at
+            if booking_id not in earliest_scans or scanned_at < earliest_scans[booking_id]:
+                earliest_scans[booking_id] = scanned_at
+
+        try:
+            with transaction.atomic():
+                current = {
+                    row['booking_id']: row for row in Booking.objects.select_for_update().filter(
+                        booking_id__in=earliest_scans
+                    ).values('booking_id', 'booking_status', 'is_verified', 'verification_timestamp')
+                }
+
+                confirmed = {
+                    booking_id: scanned_at for booking_id, scanned_at in earliest_scans.items()
+                    if booking_id in current and current[booking_id]['booking_status'] == 'CONFIRMED'
+                }
+                if confirmed:
+                    scan_time = Case(
+                        *[When(booking_id=booking_id, then=Value(scanned_at)) for booking_id, scanned_at in confirmed.items()],
+                        output_field=DateTimeField()
+                    )
+                    Booking.objects.filter(booking_id__in=confirmed).update(
+                        is_verified=True,
+                        verification_timestamp=Least(Coalesce('verification_timestamp', scan_time), scan_time)
+                    )
+        except Exception:
+            # Scanning devices get a fixed message; the database error stays in the log
+            logger.exception('Recording a batch of %s ticket scans failed', len(events))
+            return {
+                'success': False,
+                'error': 'Scans could not be recorded',
+                'message': 'Failed to record scans'
+            }
+
+        reported_new = set()
+        for result in results:
+            if 'status' in result:
+                continue
+            booking_id = result['booking_id']
+            scanned_at = result.pop('scanned_at')
+            row = current.get(booking_id)
+            if row is None:
+                result.update(status='NOT_FOUND', error='Booking not found')
+            elif booking_id not in confirmed:
+                result.update(status='NOT_CONFIRMED', error=f"Booking status is {row['booking_status']}")
+            else:
+                first_verification = row['verification_timestamp']
+                if first_verification is None or confirmed[booking_id] < first_verification:
+                    first_verification = confirmed[booking_id]
+                # Scans with the same timestamp would otherwise all count as the first one
+                was_verified = row['is_verified'] or booking_id in reported_new or scanned_at > first_verification
+                if not was_verified:
+                    reported_new.add(booking_id)
+                result.update(
+                    status='ALREADY_VERIFIED' if was_verified else 'NEWLY_VERIFIED',
+                    verification_timestamp=first_verification.isoformat()
+                )
+
+        return {
+            'success': True,
+            'results': results,
+            'verified': sum(1 for result in results if result['status'] == 'NEWLY_VERIFIED'),
+            'message': f'Processed {len(results)} scans'
+        }
@@ -1,6 +1,7 @@
 from django import forms
 from django.forms import formset_factory
 from .models import Station, SeatClass, Route, RouteHalt, RouteSeatClass, Train, Passenger
+from .analytics import MAX_REPORT_DAYS
 
 class StationForm(forms.ModelForm):
     class Meta:
@@ -112,4 +113,49 @@ class BookingConfirmationForm(forms.Form):
         max_length=6,
         required=False,
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter 6-digit OTP'})
-    )
\ No newline at end of file
+    )
+class TrainListFilterForm(forms.Form):
+    STATUS_CHOICES = [
+        ('', 'All trains'),
+        ('upcoming', 'Upcoming'),
+        ('departed', 'Departed'),
+    ]
+
+    route = forms.ModelChoiceField(
+        queryset=Route.objects.all(),
+        required=False,
+        empty_label='All routes',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    start_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    end_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    status = forms.ChoiceField(
+        choices=STATUS_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+class LoadFactorReportForm(forms.Form):
+    start_date = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    end_date = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        if start_date and end_date:
+            if end_date < start_date:
+                raise forms.ValidationError('End date must be on or after the start date')
+            if (end_date - start_date).days >= MAX_REPORT_DAYS:
+                raise forms.ValidationError(f'Reports can cover at most {MAX_REPORT_DAYS} days')
+        return cleaned_data
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from feature_railways.archive import archivable_bookings, archive_bookings, purge_finished_trains
+
+
+class Command(BaseCommand):
+    help = 'Move bookings on trains that arrived more than --days ago into the archive tables and delete the finished trains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep journeys that ended within this many days')
+        parser.add_argument('--batch-size', type=int, default=500, help='Bookings or trains per transaction')
+        parser.add_argument('--keep-trains', action='store_true', help='Archive bookings but leave trains, segments and seats in place')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        last_id = 0
+        total_archived = 0
+
+        while True:
+            booking_ids = list(
+                archivable_bookings(cutoff).filter(id__gt=last_id)
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not booking_ids:
+                break
+            last_id = booking_ids[-1]
+            total_archived += archive_bookings(booking_ids)
+            self.stdout.write(f'Archived bookings up to id {last_id}, {total_archived} so far')
+
+        total_trains = 0
+        if not options['keep_trains']:
+            while True:
+                deleted = purge_finished_trains(cutoff, batch_size)
+                if not deleted:
+                    break
+                total_trains += deleted
+                self.stdout.write(f'Deleted {total_trains} finished trains so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {total_archived} bookings and deleted {total_trains} trains'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from feature_railways.models import Booking
+from feature_transaction.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Link existing bookings to their PAYMENT transaction (matched on the booking_id string) in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total_linked = 0
+
+        while True:
+            bookings = list(
+                Booking.objects.filter(id__gt=last_id, payment_transaction__isnull=True)
+                .order_by('id')
+                .only('id', 'booking_id', 'user_id', 'total_fare')[:batch_size]
+            )
+            if not bookings:
+                break
+            last_id = bookings[-1].id
+
+            payments = {}
+            for txn in Transaction.objects.filter(
+                booking_id__in=[booking.booking_id for booking in bookings],
+                purpose='PAYMENT',
+                status='COMPLETED'
+            ).only('id', 'booking_id', 'user_id', 'amount').order_by('created_at'):
+                payments.setdefault(txn.booking_id, txn)
+
+            to_update = []
+            for booking in bookings:
+                txn = payments.get(booking.booking_id)
+                if txn and txn.user_id == booking.user_id and txn.amount == booking.total_fare:
+                    booking.payment_transaction = txn
+                    to_update.append(booking)
+
+            with transaction.atomic():
+                Booking.objects.bulk_update(to_update, ['payment_transaction'])
+            total_linked += len(to_update)
+            self.stdout.write(f'Processed bookings up to id {last_id}, linked {total_linked} so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Linked {total_linked} bookings to their payments'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Q, Subquery
+
+from feature_railways.models import SeatBooking, TrainSeat, TrainSegment
+
+
+class Command(BaseCommand):
+    help = 'Fill the denormalized train, seat_class and segment_number columns on existing SeatBookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Seat bookings per UPDATE')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        seat = TrainSeat.objects.filter(pk=OuterRef('train_seat_id'))
+        segment = TrainSegment.objects.filter(pk=OuterRef('train_segment_id'))
+        missing = Q(train__isnull=True) | Q(seat_class__isnull=True) | Q(segment_number__isnull=True)
+        last_id = 0
+        total_updated = 0
+
+        while True:
+            ids = list(
+                SeatBooking.objects.filter(missing, id__gt=last_id)
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            total_updated += SeatBooking.objects.filter(id__in=ids).update(
+                train_id=Subquery(seat.values('train_id')),
+                seat_class_id=Subquery(seat.values('seat_class_id')),
+                segment_number=Subquery(segment.values('segment_number')),
+            )
+            self.stdout.write(f'Processed seat bookings up to id {last_id}, {total_updated} updated so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Filled denormalized columns on {total_updated} seat bookings'))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from feature_railways.models import Route, Train, TrainSegment
+from feature_railways.services import get_route_station_offsets
+
+
+class Command(BaseCommand):
+    help = 'Fill departure/arrival times and durations on existing TrainSegments from their route halts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Trains per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        route_offsets = {}
+        last_id = 0
+        total_updated = 0
+
+        while True:
+            train_ids = list(
+                Train.objects.filter(id__gt=last_id, segments__departure_date_time__isnull=True)
+                .order_by('id').values_list('id', flat=True).distinct()[:batch_size]
+            )
+            if not train_ids:
+                break
+            last_id = train_ids[-1]
+
+            trains = Train.objects.in_bulk(train_ids)
+            to_update = []
+            for segment in TrainSegment.objects.filter(train_id__in=train_ids).order_by('train_id', 'segment_number'):
+                train = trains[segment.train_id]
+                if train.route_id not in route_offsets:
+                    route = Route.objects.select_related('source_station', 'destination_station').get(pk=train.route_id)
+                    route_offsets[train.route_id] = [offset for _, offset in get_route_station_offsets(route)]
+                offsets = route_offsets[train.route_id]
+                if segment.segment_number >= len(offsets):
+                    continue
+                departure_offset = offsets[segment.segment_number - 1]
+                arrival_offset = offsets[segment.segment_number]
+                segment.departure_date_time = train.departure_date_time + departure_offset
+                segment.arrival_date_time = train.departure_date_time + arrival_offset
+                segment.segment_journey_duration = arrival_offset - departure_offset
+                to_update.append(segment)
+
+            with transaction.atomic():
+                TrainSegment.objects.bulk_update(
+                    to_update, ['departure_date_time', 'arrival_date_time', 'segment_journey_duration'], batch_size=1000
+                )
+            total_updated += len(to_update)
+            self.stdout.write(f'Processed trains up to id {last_id}, {total_updated} segments updated so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Filled times on {total_updated} segments'))
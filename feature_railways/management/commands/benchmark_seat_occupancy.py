@@ -0,0 +1,96 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from feature_railways import reference
+from feature_railways.booking_services import BookingService
+from feature_railways.models import SeatBooking, SeatOccupancy, TrainSeat, TrainSegment
+from feature_railways.occupancy import count_available_seats, segment_range
+
+
+class Command(BaseCommand):
+    help = 'Compare row counts, table sizes and availability latency of SeatBooking against SeatOccupancy ranges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trains', type=int, default=20, help='Trains with bookings to sample')
+        parser.add_argument('--queries', type=int, default=200, help='Availability lookups per store')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def _table_size(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+            return cursor.fetchone()[0]
+
+    def _measure(self, lookups, check):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for train, seat_class, segments, first, last in lookups:
+                start = time.perf_counter()
+                check(train, seat_class, segments, first, last)
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            'mean': statistics.mean(timings),
+            'median': statistics.median(timings),
+            'p95': timings[int(len(timings) * 0.95) - 1],
+            'queries': len(queries) / len(timings),
+        }
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write(self.style.ERROR('SeatOccupancy needs PostgreSQL'))
+            return
+
+        seat_bookings = SeatBooking.objects.count()
+        occupancies = SeatOccupancy.objects.count()
+        self.stdout.write(f'SeatBooking:   {seat_bookings} rows, {self._table_size(SeatBooking) // 1024} KiB')
+        self.stdout.write(f'SeatOccupancy: {occupancies} rows, {self._table_size(SeatOccupancy) // 1024} KiB')
+        if occupancies:
+            self.stdout.write(f'Rows per occupancy: {seat_bookings / occupancies:.1f}')
+
+        train_classes = list(
+            TrainSeat.objects.filter(occupancies__isnull=False)
+            .values_list('train', 'seat_class').distinct().order_by('train', 'seat_class')[:options['trains']]
+        )
+        if not train_classes:
+            self.stdout.write(self.style.WARNING('No occupancies to benchmark; run migrate_seat_occupancy first'))
+            return
+
+        rng = random.Random(options['seed'])
+        segments_by_train = {}
+        for segment in TrainSegment.objects.filter(train_id__in={train_id for train_id, _ in train_classes}).select_related('train'):
+            segments_by_train.setdefault(segment.train_id, []).append(segment)
+
+        lookups = []
+        for _ in range(options['queries']):
+            train_id, seat_class_id = rng.choice(train_classes)
+            segments = sorted(segments_by_train.get(train_id, []), key=lambda segment: segment.segment_number)
+            if not segments:
+                continue
+            first, last = sorted(rng.sample(range(len(segments)), 2)) if len(segments) > 1 else (0, 0)
+            journey = segments[first:last + 1]
+            lookups.append((journey[0].train, reference.get_seat_class(seat_class_id), journey, journey[0].segment_number, journey[-1].segment_number))
+        if not lookups:
+            self.stdout.write(self.style.WARNING('No lookups to benchmark; the sampled trains have no segments or --queries is 0'))
+            return
+
+        def seat_booking_check(train, seat_class, segments, first, last):
+            BookingService._get_segment_availability(
+                train, seat_class, TrainSegment.objects.filter(id__in=[segment.id for segment in segments])
+            )
+
+        def occupancy_check(train, seat_class, segments, first, last):
+            count_available_seats(train, seat_class, segment_range(first, last))
+
+        for label, check in (('SeatBooking', seat_booking_check), ('SeatOccupancy', occupancy_check)):
+            result = self._measure(lookups, check)
+            self.stdout.write(
+                f"{label:<14} availability: mean {result['mean']:.2f} ms, median {result['median']:.2f} ms, "
+                f"p95 {result['p95']:.2f} ms, {result['queries']:.1f} queries per lookup"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {len(lookups)} lookups over {len(train_classes)} train classes'))
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from feature_railways.manifest import bump_manifest_version
+from feature_railways.models import Booking
+from feature_railways.qr_images import delete_qr_images
+from feature_railways.tickets import TICKET_VALIDITY_AFTER_ARRIVAL_SECONDS
+
+
+class Command(BaseCommand):
+    help = 'Mark confirmed bookings whose journey has ended as COMPLETED; meant to run every few minutes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Bookings per UPDATE')
+        parser.add_argument(
+            '--grace-hours', type=float, default=TICKET_VALIDITY_AFTER_ARRIVAL_SECONDS / 3600,
+            help='Wait this long after arrival so late ticket scans still find a confirmed booking'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        # Segment bookings carry their own arrival time; full-route bookings use the train's
+        departed = Booking.objects.filter(
+            Q(arrival_datetime__lt=cutoff) | Q(arrival_datetime__isnull=True, train__arrival_date_time__lt=cutoff),
+            booking_status='CONFIRMED'
+        )
+        total_completed = 0
+        train_ids = set()
+
+        while True:
+            batch = list(departed.values_list('id', 'booking_id', 'train_id', 'qr_code_data')[:batch_size])
+            if not batch:
+                break
+
+            total_completed += Booking.objects.filter(
+                id__in=[row[0] for row in batch], booking_status='CONFIRMED'
+            ).update(booking_status='COMPLETED')
+            for _, booking_id, train_id, qr_code_data in batch:
+                train_ids.add(train_id)
+                if qr_code_data:
+                    delete_qr_images(booking_id, qr_code_data)
+            self.stdout.write(f'{total_completed} bookings completed so far')
+
+        for train_id in train_ids:
+            bump_manifest_version(train_id)
+
+        self.stdout.write(self.style.SUCCESS(f'Marked {total_completed} bookings on {len(train_ids)} trains as completed'))
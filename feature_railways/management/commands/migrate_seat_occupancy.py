@@ -0,0 +1,52 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from feature_railways.models import SeatBooking, SeatOccupancy
+from feature_railways.occupancy import occupancies_from_seat_bookings
+
+
+class Command(BaseCommand):
+    help = 'Copy SeatBooking rows into SeatOccupancy ranges for passengers that do not have occupancies yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Passengers per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Occupancies are built from the denormalized columns, so rows saved before they existed are filled first
+        call_command('backfill_seat_booking_columns', stdout=self.stdout)
+        last_id = 0
+        total_created = 0
+        total_conflicts = 0
+        pending = SeatBooking.objects.exclude(
+            Exists(SeatOccupancy.objects.filter(passenger_id=OuterRef('passenger_id')))
+        )
+
+        while True:
+            passenger_ids = list(
+                pending.filter(passenger_id__gt=last_id)
+                .order_by('passenger_id').values_list('passenger_id', flat=True).distinct()[:batch_size]
+            )
+            if not passenger_ids:
+                break
+            last_id = passenger_ids[-1]
+
+            rows = SeatBooking.objects.filter(passenger_id__in=passenger_ids).values_list(
+                'passenger_id', 'train_seat_id', 'train_id', 'seat_class_id', 'segment_number'
+            ).order_by('passenger_id', 'train_seat_id', 'segment_number')
+            occupancies = occupancies_from_seat_bookings(rows)
+
+            with transaction.atomic():
+                before = SeatOccupancy.objects.filter(passenger_id__in=passenger_ids).count()
+                # Rows that would overlap an existing occupancy of the same seat are skipped and reported
+                SeatOccupancy.objects.bulk_create(occupancies, batch_size=1000, ignore_conflicts=True)
+                created = SeatOccupancy.objects.filter(passenger_id__in=passenger_ids).count() - before
+            total_created += created
+            total_conflicts += len(occupancies) - created
+            self.stdout.write(f'Processed passengers up to id {last_id}, {total_created} occupancies created so far')
+
+        if total_conflicts:
+            self.stdout.write(self.style.WARNING(f'{total_conflicts} occupancies overlapped an existing booking of the same seat and were skipped'))
+        self.stdout.write(self.style.SUCCESS(f'Created {total_created} seat occupancies'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from feature_railways.models import Booking
+from feature_railways.qr_images import QR_CONTENT_TYPES, get_qr_image
+from feature_railways.tickets import issue_ticket_token
+
+
+class Command(BaseCommand):
+    help = 'Render and store QR images (PNG and SVG) for confirmed bookings, issuing tickets for those confirmed without one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total_rendered = 0
+
+        while True:
+            bookings = list(
+                Booking.objects.filter(id__gt=last_id, booking_status='CONFIRMED')
+                .order_by('id')[:batch_size]
+            )
+            if not bookings:
+                break
+            last_id = bookings[-1].id
+
+            for booking in bookings:
+                token = booking.get_qr_data()
+                if token is None:
+                    # Confirmed before tickets were issued at payment
+                    token = issue_ticket_token(booking)
+                    Booking.objects.filter(pk=booking.pk).update(qr_code_data=token)
+                for image_format in QR_CONTENT_TYPES:
+                    get_qr_image(booking.booking_id, token, image_format)
+                total_rendered += 1
+            self.stdout.write(f'Processed bookings up to id {last_id}, {total_rendered} rendered so far')
+
+        self.stdout.write(self.style.SUCCESS(f'QR images ready for {total_rendered} bookings'))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from feature_railways.models import Booking, DailyRouteStats
+from feature_transaction.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailyRouteStats rollup from existing bookings'
+
+    def handle(self, *args, **options):
+        tz = timezone.get_current_timezone()
+        stats = {}
+
+        def add(rows, **fields):
+            for row in rows:
+                entry = stats.setdefault((row['day'], row['route_id']), {})
+                for field, source in fields.items():
+                    entry[field] = entry.get(field, 0) + (row[source] or 0)
+
+        bookings = Booking.objects.annotate(route_id=F('train__route_id'))
+
+        add(
+            bookings.annotate(day=TruncDate('booking_date', tzinfo=tz))
+            .values('day', 'route_id').annotate(count=Count('id')).order_by(),
+            bookings='count'
+        )
+
+        # Every cancelled or completed booking was confirmed first
+        confirmed = bookings.filter(booking_status__in=['CONFIRMED', 'CANCELLED', 'COMPLETED'])
+        add(
+            confirmed.annotate(day=TruncDate(Coalesce('payment_transaction__completed_at', 'booking_date'), tzinfo=tz))
+            .values('day', 'route_id')
+            .annotate(count=Count('id'), fare=Sum('total_fare'), seats=Sum('passenger_count')).order_by(),
+            confirmations='count', revenue='fare', seats_sold='seats'
+        )
+
+        refunded_at = Transaction.objects.filter(
+            booking_id=OuterRef('booking_id'), purpose='REFUND'
+        ).order_by('created_at').values('created_at')[:1]
+        cancelled = bookings.filter(booking_status='CANCELLED').annotate(
+            day=TruncDate(Coalesce(Subquery(refunded_at), 'booking_date'), tzinfo=tz)
+        )
+        rows = list(
+            cancelled.values('day', 'route_id')
+            .annotate(count=Count('id'), fare=Sum('total_fare'), seats=Sum('passenger_count')).order_by()
+        )
+        for row in rows:
+            row['fare'] = -(row['fare'] or 0)
+            row['seats'] = -(row['seats'] or 0)
+        add(rows, cancellations='count', revenue='fare', seats_sold='seats')
+
+        with transaction.atomic():
+            DailyRouteStats.objects.all().delete()
+            DailyRouteStats.objects.bulk_create(
+                [DailyRouteStats(date=day, route_id=route_id, **fields) for (day, route_id), fields in stats.items()],
+                batch_size=1000
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(stats)} daily route rows'))
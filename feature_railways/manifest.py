@@ -0,0 +1,119 @@
+"""
+Per-train passenger manifest (the "chart").
+
+The manifest is a flat list of occupancy entries, one per passenger seat and run of
+consecutive segments, built from a single SeatBooking query. Each train has a cache
+version that is bumped whenever one of its bookings changes; manifests are cached
+per version, so older versions stay around long enough to serve deltas to scanners.
+"""
+import csv
+import io
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+MANIFEST_CACHE_TIMEOUT = 24 * 3600
+
+MANIFEST_FIELDS = ['seat', 'class', 'from_segment', 'to_segment', 'booking_id', 'status', 'name', 'age', 'gender']
+
+
+def _version_key(train_id):
+    return f'manifest:version:{train_id}'
+
+
+def _manifest_key(train_id, version):
+    return f'manifest:{train_id}:{version}'
+
+
+def get_manifest_version(train_id):
+    version = cache.get(_version_key(train_id))
+    if version is None:
+        cache.add(_version_key(train_id), int(time.time() * 1000), MANIFEST_CACHE_TIMEOUT)
+        version = cache.get(_version_key(train_id))
+    return version
+
+
+def bump_manifest_version(train_id):
+    # Millisecond timestamps keep versions increasing even if the cache entry was evicted
+    current = cache.get(_version_key(train_id)) or 0
+    cache.set(_version_key(train_id), max(current + 1, int(time.time() * 1000)), MANIFEST_CACHE_TIMEOUT)
+
+
+def invalidate_train_manifest(train_id):
+    """Call after changing a train's bookings; the bump happens once the transaction commits."""
+    transaction.on_commit(lambda: bump_manifest_version(train_id))
+
+
+def build_train_manifest(train):
+    from .models import SeatBooking, TrainSegment
+
+    rows = SeatBooking.objects.filter(train_id=train.id, passenger__booking__isnull=False).values_list(
+        'train_seat__seat_number', 'seat_class__code', 'segment_number',
+        'passenger_id', 'passenger__booking__booking_id', 'passenger__booking__booking_status',
+        'passenger__name', 'passenger__age', 'passenger__gender'
+    ).order_by('train_seat__seat_number', 'passenger_id', 'segment_number')
+
+    entries = []
+    current = None
+    current_passenger = None
+    for seat_number, class_code, segment_number, passenger_id, booking_id, status, name, age, gender in rows:
+        # Extend the open run while the same passenger holds the next segment on the same seat
+        if current and current_passenger == passenger_id and current[0] == seat_number and current[3] + 1 == segment_number:
+            current[3] = segment_number
+            continue
+        current = [seat_number, class_code, segment_number, segment_number, booking_id, status, name, age, gender]
+        current_passenger = passenger_id
+        entries.append(current)
+
+    segments = list(
+        TrainSegment.objects.filter(train_id=train.id).order_by('segment_number').values_list(
+            'segment_number', 'segment_source__code', 'segment_destination__code'
+        )
+    )
+
+    return {
+        'train': train.id,
+        'departure': train.departure_date_time.isoformat(),
+        'segments': [list(segment) for segment in segments],
+        'fields': MANIFEST_FIELDS,
+        'entries': entries,
+    }
+
+
+def get_train_manifest(train):
+    version = get_manifest_version(train.id)
+    manifest = cache.get(_manifest_key(train.id, version))
+    if manifest is None:
+        manifest = build_train_manifest(train)
+        manifest['version'] = version
+        cache.set(_manifest_key(train.id, version), manifest, MANIFEST_CACHE_TIMEOUT)
+    return manifest
+
+
+def get_manifest_delta(train, since_version):
+    """Entries added and removed since `since_version`, or None if that version is no longer cached."""
+    manifest = get_train_manifest(train)
+    if since_version == manifest['version']:
+        return {'version': manifest['version'], 'since': since_version, 'added': [], 'removed': []}
+
+    previous = cache.get(_manifest_key(train.id, since_version))
+    if previous is None:
+        return None
+
+    current_entries = set(map(tuple, manifest['entries']))
+    previous_entries = set(map(tuple, previous['entries']))
+    return {
+        'version': manifest['version'],
+        'since': since_version,
+        'added': sorted(current_entries - previous_entries),
+        'removed': sorted(previous_entries - current_entries),
+    }
+
+
+def manifest_to_csv(manifest):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(manifest['fields'])
+    writer.writerows(manifest['entries'])
+    return buffer.getvalue()
@@ -1,6 +1,10 @@
 from core_users.models import CustomUser
 from datetime import datetime, timedelta
+from types import SimpleNamespace
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import IntegerRangeField, RangeOperators
 from django.db import models
+from django.db.models import F, Func, Q, Value
 
 
 class Station(models.Model):
@@ -57,6 +61,12 @@ class RouteHalt(models.Model):
     sequence_number = models.PositiveIntegerField()
     journey_duration_from_source = models.DurationField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'sequence_number'], name='routehalt_unique_sequence'),
+            models.UniqueConstraint(fields=['route', 'station'], name='routehalt_unique_station'),
+        ]
+
     def __str__(self):
         return f"Halt Station {self.station.code} on route {self.route.code}"
 
@@ -76,6 +86,14 @@ class Train(models.Model):
     departure_date_time = models.DateTimeField()
     arrival_date_time = models.DateTimeField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'departure_date_time'], name='train_unique_route_departure'),
+        ]
+        indexes = [
+            models.Index(fields=['departure_date_time', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.route} [{self.departure_date_time.strftime('%H:%M %d-%m-%Y')}]"
 
@@ -89,6 +107,15 @@ class TrainSegment(models.Model):
     segment_number = models.PositiveIntegerField()
     segment_journey_duration = models.DurationField(null=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['train', 'segment_number'], name='trainsegment_unique_number'),
+        ]
+        indexes = [
+            models.Index(fields=['segment_source', 'departure_date_time']),
+            models.Index(fields=['segment_destination', 'arrival_date_time']),
+        ]
+
     def __str__(self):
         return f"Train Segment on {self.train.route.code} [{self.segment_source.code} to {self.segment_destination.code} ({self.segment_number})]"
 
@@ -98,6 +125,11 @@ class TrainSeat(models.Model):
     seat_class = models.ForeignKey(SeatClass, on_delete=models.CASCADE)
     seat_number = models.CharField(max_length=10)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['train', 'seat_class', 'seat_number'], name='trainseat_unique_number'),
+        ]
+
     def __str__(self):
         return f"{self.train} - {self.seat_class.code} {self.seat_number}"
 
@@ -108,11 +140,63 @@ class SeatBooking(models.Model):
     passenger = models.ForeignKey(Passenger, on_delete=models.CASCADE)
     booked_at = models.DateTimeField(auto_now_add=True)
     price_for_segment = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Copied from train_seat and train_segment so availability queries need no joins. Rows saved before these
+    # columns existed are filled by backfill_seat_booking_columns, which deploys run right after migrate
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='seat_bookings', null=True, db_index=False)
+    seat_class = models.ForeignKey(SeatClass, on_delete=models.CASCADE, related_name='seat_bookings', null=True, db_index=False)
+    segment_number = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            # A seat can be sold only once per segment
+            models.UniqueConstraint(fields=['train_segment', 'train_seat'], name='seatbooking_unique_seat_segment'),
+        ]
+        indexes = [
+            # Covers per-segment counts and booked seat lookups as index-only scans
+            models.Index(fields=['train', 'seat_class', 'segment_number'], include=['train_seat'], name='seatbooking_availability_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.train_id is None:
+            self.train_id = self.train_seat.train_id
+        if self.seat_class_id is None:
+            self.seat_class_id = self.train_seat.seat_class_id
+        if self.segment_number is None:
+            self.segment_number = self.train_segment.segment_number
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.train_seat} booked for {self.train_segment} by {self.passenger.booking_by}"
 
 
+class SeatOccupancy(models.Model):
+    """One row per passenger seat covering a half-open range of segment numbers"""
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='occupancies')
+    train_seat = models.ForeignKey(TrainSeat, on_delete=models.CASCADE, related_name='occupancies')
+    seat_class = models.ForeignKey(SeatClass, on_delete=models.CASCADE)
+    passenger = models.ForeignKey(Passenger, on_delete=models.CASCADE, related_name='occupancies')
+    segments = IntegerRangeField()
+    booked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # The seat goes in as a single-value range so both columns use built-in range GiST support
+            ExclusionConstraint(
+                name='seat_occupancy_no_overlap',
+                expressions=[
+                    (Func(F('train_seat'), F('train_seat'), Value('[]'), function='int8range'), RangeOperators.OVERLAPS),
+                    ('segments', RangeOperators.OVERLAPS),
+                ],
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['train', 'seat_class']),
+        ]
+
+    def __str__(self):
+        return f"{self.train_seat} held for segments [{self.segments.lower}, {self.segments.upper}) by {self.passenger.name}"
+
+
 class Booking(models.Model):
     BOOKING_STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -137,6 +221,15 @@ class Booking(models.Model):
     is_verified = models.BooleanField(default=False)
     verification_timestamp = models.DateTimeField(null=True, blank=True)
     qr_code_data = models.TextField(blank=True)
+    payment_transaction = models.ForeignKey('feature_transaction.Transaction', on_delete=models.SET_NULL, related_name='paid_bookings', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'booking_date']),
+            # Partial indexes over live tickets only; complete_departed_bookings moves finished ones out
+            models.Index(fields=['train'], condition=Q(booking_status='CONFIRMED'), name='booking_confirmed_train_idx'),
+            models.Index(fields=['arrival_datetime'], condition=Q(booking_status='CONFIRMED'), name='booking_confirmed_arrival_idx'),
+        ]
 
     def __str__(self):
         return f"Booking {self.booking_id} - {self.user.username} - {self.train}"
@@ -149,23 +242,9 @@ class Booking(models.Model):
         super().save(*args, **kwargs)
 
     def get_qr_data(self):
+        """Signed ticket token encoded in the QR code; issued when the booking is confirmed"""
         if self.booking_status == 'CONFIRMED':
-            import json
-            import hashlib
-            
-            qr_data = {
-                'booking_id': self.booking_id,
-                'user_id': self.user.id,
-                'train_id': self.train.id,
-                'passenger_count': self.passenger_count,
-                'total_fare': str(self.total_fare)
-            }
-            
-            qr_string = json.dumps(qr_data, sort_keys=True)
-            verification_hash = hashlib.sha256(qr_string.encode()).hexdigest()[:16]
-            qr_data['verification_hash'] = verification_hash
-            
-            return qr_data
+            return self.qr_code_data or None
         return None
 
     def verify_booking(self):
@@ -235,3 +314,107 @@ class Booking(models.Model):
             return f"Segment Journey ({self.actual_source_station.code} → {self.actual_destination_station.code})"
         else:
             return f"Complete Journey ({self.actual_source_station.code} → {self.actual_destination_station.code})"
+
+
+class ArchivedBooking(models.Model):
+    """A booking whose journey ended long ago, moved out of the hot tables by archive_completed_journeys"""
+    is_archived = True
+
+    booking_id = models.CharField(max_length=20, unique=True)
+    user = models.ForeignKey('core_users.CustomUser', on_delete=models.CASCADE, related_name='archived_bookings')
+    train_number = models.PositiveBigIntegerField()
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='archived_bookings')
+    seat_class = models.ForeignKey(SeatClass, on_delete=models.CASCADE)
+    passenger_count = models.PositiveIntegerField()
+    total_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    booking_status = models.CharField(max_length=20, choices=Booking.BOOKING_STATUS_CHOICES)
+    booking_date = models.DateTimeField()
+    journey_source = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='archived_bookings_as_source', null=True, blank=True)
+    journey_destination = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='archived_bookings_as_destination', null=True, blank=True)
+    departure_datetime = models.DateTimeField()
+    arrival_datetime = models.DateTimeField()
+    is_verified = models.BooleanField(default=False)
+    verification_timestamp = models.DateTimeField(null=True, blank=True)
+    payment_transaction = models.ForeignKey('feature_transaction.Transaction', on_delete=models.SET_NULL, related_name='paid_archived_bookings', null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'booking_date']),
+        ]
+
+    def __str__(self):
+        return f"Archived booking {self.booking_id} - {self.user.username} - Train #{self.train_number}"
+
+    @property
+    def train(self):
+        """Stand-in for the train, which is usually deleted once all its bookings are archived"""
+        return SimpleNamespace(
+            id=self.train_number, route=self.route,
+            departure_date_time=self.departure_datetime, arrival_date_time=self.arrival_datetime
+        )
+
+    @property
+    def actual_source_station(self):
+        return self.journey_source or self.route.source_station
+
+    @property
+    def actual_destination_station(self):
+        return self.journey_destination or self.route.destination_station
+
+    @property
+    def actual_departure_time(self):
+        return self.departure_datetime
+
+    @property
+    def actual_arrival_time(self):
+        return self.arrival_datetime
+
+    @property
+    def actual_journey_duration(self):
+        duration = self.arrival_datetime - self.departure_datetime
+        hours = duration.total_seconds() // 3600
+        minutes = (duration.total_seconds() % 3600) // 60
+        if hours >= 1:
+            return f"{int(hours)}h {int(minutes)}m"
+        return f"{int(minutes)}m"
+
+    @property
+    def is_segment_booking(self):
+        return self.journey_source_id is not None and self.journey_destination_id is not None
+
+    @property
+    def journey_type_display(self):
+        journey_type = "Segment Journey" if self.is_segment_booking else "Complete Journey"
+        return f"{journey_type} ({self.actual_source_station.code} → {self.actual_destination_station.code})"
+
+
+class ArchivedPassenger(models.Model):
+    booking = models.ForeignKey(ArchivedBooking, on_delete=models.CASCADE, related_name='passengers')
+    name = models.CharField(max_length=50)
+    age = models.PositiveIntegerField()
+    gender = models.CharField(choices=Passenger.GENDER_CHOICES, max_length=1)
+    seat_number = models.CharField(max_length=10, blank=True)
+    first_segment = models.PositiveIntegerField(null=True)
+    last_segment = models.PositiveIntegerField(null=True)
+
+    def __str__(self):
+        return f"Archived passenger {self.name} on {self.booking.booking_id} seat {self.seat_number}"
+
+
+class DailyRouteStats(models.Model):
+    """Per-day, per-route booking counters, bumped by booking events and rebuilt by rebuild_route_stats"""
+    date = models.DateField()
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='daily_stats')
+    bookings = models.IntegerField(default=0)
+    confirmations = models.IntegerField(default=0)
+    cancellations = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    seats_sold = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'route']
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.route.code} on {self.date}: {self.confirmations} confirmed, ₹{self.revenue}"
@@ -0,0 +1,88 @@
+"""
+Range-based seat occupancy.
+
+SeatBooking stores a row per seat per segment; SeatOccupancy stores a row per
+passenger seat with the half-open range of segment numbers it holds, so a journey
+writes one row per passenger however many segments it spans. The GiST exclusion
+constraint (same seat, overlapping segments) makes double booking a database error, and
+availability is one range-overlap query instead of a count per segment.
+
+Bookings write both stores while SEAT_OCCUPANCY_RANGES is enabled; existing
+SeatBooking rows are copied over with the migrate_seat_occupancy command.
+"""
+from django.conf import settings
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.db.models import Exists, OuterRef
+
+
+def occupancy_enabled():
+    return getattr(settings, 'SEAT_OCCUPANCY_RANGES', False)
+
+
+def segment_range(first_segment, last_segment):
+    """Range covering segment numbers first_segment..last_segment inclusive."""
+    return NumericRange(first_segment, last_segment + 1, '[)')
+
+
+def journey_segment_range(segments):
+    numbers = [segment.segment_number for segment in segments]
+    if not numbers:
+        return None
+    return segment_range(min(numbers), max(numbers))
+
+
+def free_seats(train, seat_class, segments):
+    """TrainSeats of the class with no occupancy overlapping `segments`, in seat order."""
+    from .models import SeatOccupancy, TrainSeat
+
+    return TrainSeat.objects.filter(train=train, seat_class_id=seat_class.pk).exclude(
+        Exists(SeatOccupancy.objects.filter(train_seat=OuterRef('pk'), segments__overlap=segments))
+    ).order_by('seat_number')
+
+
+def count_available_seats(train, seat_class, segments):
+    return free_seats(train, seat_class, segments).count()
+
+
+def record_occupancy(train, seat_class, passenger_seats, segments):
+    """
+    Write one row per (passenger, seat) pair. Overlapping another row on the same seat
+    raises IntegrityError from the exclusion constraint.
+    """
+    from .models import SeatOccupancy
+
+    return SeatOccupancy.objects.bulk_create([
+        SeatOccupancy(train=train, train_seat=seat, seat_class_id=seat_class.pk, passenger=passenger, segments=segments)
+        for passenger, seat in passenger_seats
+    ])
+
+
+def occupancies_from_seat_bookings(rows):
+    """
+    Collapse SeatBooking rows into SeatOccupancy instances. `rows` are
+    (passenger_id, train_seat_id, train_id, seat_class_id, segment_number) tuples ordered
+    by passenger, seat and segment number; each run of consecutive segments
+    becomes one occupancy.
+    """
+    from .models import SeatOccupancy
+
+    occupancies = []
+    current = None
+    for passenger_id, seat_id, train_id, seat_class_id, segment_number in rows:
+        if (current and current['passenger_id'] == passenger_id and current['train_seat_id'] == seat_id
+                and current['last'] + 1 == segment_number):
+            current['last'] = segment_number
+            continue
+        current = {
+            'passenger_id': passenger_id, 'train_seat_id': seat_id, 'train_id': train_id,
+            'seat_class_id': seat_class_id, 'first': segment_number, 'last': segment_number,
+        }
+        occupancies.append(current)
+
+    return [
+        SeatOccupancy(
+            passenger_id=entry['passenger_id'], train_seat_id=entry['train_seat_id'], train_id=entry['train_id'],
+            seat_class_id=entry['seat_class_id'], segments=segment_range(entry['first'], entry['last'])
+        )
+        for entry in occupancies
+    ]
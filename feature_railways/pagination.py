@@ -0,0 +1,77 @@
+"""
+Keyset pagination for the staff list views.
+
+Pages are addressed by the ordering values of the row just outside them instead of
+an OFFSET, so every page costs the same index range scan no matter how deep it is.
+Cursors are opaque base64url strings passed as ?after= or ?before=.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+STAFF_PAGE_SIZE = 50
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, model, fields):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if len(values) != len(fields):
+            return None
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        return None
+
+
+def _keyset_filter(fields, values, lookup):
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    condition = Q()
+    for i, field in enumerate(fields):
+        equal_prefix = {fields[j]: values[j] for j in range(i)}
+        condition |= Q(**equal_prefix, **{f'{field}__{lookup}': values[i]})
+    return condition
+
+
+def keyset_paginate(request, queryset, fields, page_size=STAFF_PAGE_SIZE):
+    """
+    Return one page of `queryset` ordered ascending by `fields`, which must end with
+    a unique field. The result holds the rows plus query strings for the
+    neighbouring pages that keep the request's other parameters.
+    """
+    model = queryset.model
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+    cursor = _decode_cursor(before or after, model, fields) if (before or after) else None
+
+    if cursor and before:
+        rows = list(
+            queryset.filter(_keyset_filter(fields, cursor, 'lt'))
+            .order_by(*[f'-{field}' for field in fields])[:page_size + 1]
+        )
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if cursor:
+            queryset = queryset.filter(_keyset_filter(fields, cursor, 'gt'))
+        rows = list(queryset.order_by(*fields)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = cursor is not None
+
+    def page_query(key, row):
+        params = request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params[key] = _encode_cursor([getattr(row, field) for field in fields])
+        return params.urlencode()
+
+    return {
+        'items': rows,
+        'next_query': page_query('after', rows[-1]) if rows and has_next else None,
+        'previous_query': page_query('before', rows[0]) if rows and has_previous else None,
+    }
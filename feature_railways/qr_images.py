@@ -0,0 +1,113 @@
+"""
+Rendered QR images for ticket tokens.
+
+Images are stored under QR_IMAGE_ROOT, named by booking id and a hash of the token,
+so an image never has to be invalidated: a new token simply gets a new file. The
+same hash is used as the ETag for conditional GETs.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+QR_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+_executor = None
+
+
+@lru_cache(maxsize=1)
+def get_qr_storage():
+    return FileSystemStorage(location=settings.QR_IMAGE_ROOT)
+
+
+def qr_content_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:20]
+
+
+def qr_image_name(booking_id, token, image_format):
+    return f'{booking_id}-{qr_content_hash(token)}.{image_format}'
+
+
+def render_qr_image(token, image_format):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(token)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    if image_format == 'svg':
+        # The SVG factory writes XML directly and never touches Pillow
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def get_qr_image(booking_id, token, image_format='png'):
+    """Return the rendered image bytes, rendering and storing them on first use."""
+    storage = get_qr_storage()
+    name = qr_image_name(booking_id, token, image_format)
+    try:
+        with storage.open(name, 'rb') as image_file:
+            return image_file.read()
+    except FileNotFoundError:
+        pass
+
+    content = render_qr_image(token, image_format)
+    try:
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+    except OSError:
+        # Serving the image matters more than caching it
+        logger.warning('Could not store QR image %s', name, exc_info=True)
+    return content
+
+
+def delete_qr_images(booking_id, token):
+    storage = get_qr_storage()
+    for image_format in QR_CONTENT_TYPES:
+        storage.delete(qr_image_name(booking_id, token, image_format))
+
+
+def prerender_qr_images(booking_pk):
+    from .models import Booking
+
+    close_old_connections()
+    try:
+        booking = Booking.objects.get(pk=booking_pk)
+        token = booking.get_qr_data()
+        if token:
+            for image_format in QR_CONTENT_TYPES:
+                get_qr_image(booking.booking_id, token, image_format)
+    except Exception:
+        logger.exception('Pre-rendering QR images for booking %s failed', booking_pk)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.QR_PRERENDER_WORKERS, thread_name_prefix='qr-prerender')
+    return _executor
+
+
+def schedule_qr_prerender(booking_pk):
+    """Render the ticket images in a worker thread once the confirming transaction commits."""
+    transaction.on_commit(lambda: _get_executor().submit(prerender_qr_images, booking_pk))
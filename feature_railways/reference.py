@@ -0,0 +1,332 @@
+"""
+Two-tier cache of the railway reference data: stations, seat classes, routes with
+their halts, and the seat classes offered on each route.
+
+These tables are small and rarely change, but the search and booking pages read
+them on every request. Each process keeps one snapshot of all of them as compact
+__slots__ records, and the rows behind it are also stored in the shared cache
+under the current version, so after a change only one process rebuilds it from
+the database. Saving or deleting any of these models bumps the version once the
+transaction commits. Processes compare their snapshot's version with the shared
+one at most every VERSION_CHECK_SECONDS, so every worker sees a change within a
+second. Queryset update() and bulk_create() send no signals; call
+invalidate_reference_data() after using them on these models.
+
+Records compare equal to (and hash like) the model instances they stand for and
+have the attributes the templates use, so views and services can mix the two;
+filter on `<field>_id=record.pk` rather than passing a record to the ORM.
+"""
+import time
+from datetime import timedelta
+
+from asgiref.local import Local
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import Route, RouteHalt, RouteSeatClass, SeatClass, Station
+
+REFERENCE_CACHE_TIMEOUT = 24 * 3600
+VERSION_CHECK_SECONDS = 1
+VERSION_KEY = 'reference-data:version'
+
+_process = {'snapshot': None, 'checked_at': 0.0}
+# Per thread / async context: whether the open transaction changed reference data, and its own snapshot
+_local = Local()
+
+
+class _Record:
+    __slots__ = ()
+    model = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, (type(self), self.model)):
+            return self.id == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self}>'
+
+
+class StationRecord(_Record):
+    __slots__ = ('id', 'name', 'code')
+    model = Station
+
+    def __init__(self, id, name, code):
+        self.id = id
+        self.name = name
+        self.code = code
+
+    def __str__(self):
+        return f"{self.code}:{self.name}"
+
+
+class SeatClassRecord(_Record):
+    __slots__ = ('id', 'class_type', 'code')
+    model = SeatClass
+
+    def __init__(self, id, class_type, code):
+        self.id = id
+        self.class_type = class_type
+        self.code = code
+
+    def __str__(self):
+        return f"{self.code}:{self.class_type}"
+
+
+class RouteSeatClassRecord(_Record):
+    __slots__ = ('id', 'route_id', 'seat_class', 'num_of_available_seats', 'base_fare_per_hour')
+    model = RouteSeatClass
+
+    def __init__(self, id, route_id, seat_class, num_of_available_seats, base_fare_per_hour):
+        self.id = id
+        self.route_id = route_id
+        self.seat_class = seat_class
+        self.num_of_available_seats = num_of_available_seats
+        self.base_fare_per_hour = base_fare_per_hour
+
+    def __str__(self):
+        return f"{self.seat_class} on route {self.route_id}"
+
+
+class RouteRecord(_Record):
+    """
+    `stations` holds the route's stations in order with their journey time from the
+    source; a station's index in it is the number of the segment that ends there.
+    """
+    __slots__ = (
+        'id', 'name', 'code', 'base_fare', 'source_station', 'destination_station', 'journey_duration',
+        'stations', 'station_offsets', 'station_positions', 'seat_classes'
+    )
+    model = Route
+
+    def __init__(self, id, name, code, base_fare, source_station, destination_station, journey_duration, halts):
+        self.id = id
+        self.name = name
+        self.code = code
+        self.base_fare = base_fare
+        self.source_station = source_station
+        self.destination_station = destination_station
+        self.journey_duration = journey_duration
+        self.stations = ((source_station, timedelta(seconds=0)), *halts, (destination_station, journey_duration))
+        self.station_offsets = {}
+        self.station_positions = {}
+        for position, (station, offset) in enumerate(self.stations):
+            self.station_offsets[station.id] = offset
+            self.station_positions[station.id] = position
+        self.seat_classes = ()
+
+    def __str__(self):
+        return f"{self.code} : {self.name} ({self.source_station.code} to {self.destination_station.code})"
+
+    def get_seat_class(self, seat_class_id):
+        for route_seat in self.seat_classes:
+            if route_seat.seat_class.id == seat_class_id:
+                return route_seat
+        return None
+
+
+class ReferenceData:
+    __slots__ = ('version', 'stations', 'stations_by_code', 'seat_classes', 'routes')
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.stations = {row[0]: StationRecord(*row) for row in rows['stations']}
+        self.stations_by_code = {station.code.upper(): station for station in self.stations.values()}
+        self.seat_classes = {row[0]: SeatClassRecord(*row) for row in rows['seat_classes']}
+
+        halts = {}
+        for route_id, station_id, offset in rows['halts']:
+            halts.setdefault(route_id, []).append((self.stations[station_id], offset))
+        self.routes = {}
+        for id, name, code, base_fare, source_id, destination_id, journey_duration in rows['routes']:
+            self.routes[id] = RouteRecord(
+                id, name, code, base_fare, self.stations[source_id], self.stations[destination_id],
+                journey_duration, halts.get(id, ())
+            )
+
+        route_seats = {}
+        for id, route_id, seat_class_id, num_of_available_seats, base_fare_per_hour in rows['route_seat_classes']:
+            route_seats.setdefault(route_id, []).append(RouteSeatClassRecord(
+                id, route_id, self.seat_classes[seat_class_id], num_of_available_seats, base_fare_per_hour
+            ))
+        for route_id, seats in route_seats.items():
+            self.routes[route_id].seat_classes = tuple(seats)
+
+
+def load_reference_rows():
+    """Plain rows of every reference table, as stored in the shared cache."""
+    # Always the primary: a lagging replica would be cached under the new version
+    using = DEFAULT_DB_ALIAS
+    return {
+        'stations': list(Station.objects.using(using).order_by('id').values_list('id', 'name', 'code')),
+        'seat_classes': list(SeatClass.objects.using(using).order_by('id').values_list('id', 'class_type', 'code')),
+        'routes': list(Route.objects.using(using).order_by('id').values_list(
+            'id', 'name', 'code', 'base_fare', 'source_station_id', 'destination_station_id', 'journey_duration'
+        )),
+        'halts': list(RouteHalt.objects.using(using).order_by('route_id', 'sequence_number').values_list(
+            'route_id', 'station_id', 'journey_duration_from_source'
+        )),
+        'route_seat_classes': list(RouteSeatClass.objects.using(using).order_by('route_id', 'seat_class__code').values_list(
+            'id', 'route_id', 'seat_class_id', 'num_of_available_seats', 'base_fare_per_hour'
+        )),
+    }
+
+
+def _data_key(version):
+    return f'reference-data:{version}'
+
+
+def get_reference_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), REFERENCE_CACHE_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_reference_version():
+    # Millisecond timestamps keep versions increasing even if the cache entry was evicted
+    current = cache.get(VERSION_KEY) or 0
+    cache.set(VERSION_KEY, max(current + 1, int(time.time() * 1000)), REFERENCE_CACHE_TIMEOUT)
+    _process['snapshot'] = None
+    _local.dirty = False
+    _local.snapshot = None
+
+
+def _shared_snapshot():
+    now = time.monotonic()
+    snapshot = _process['snapshot']
+    if snapshot is not None and now - _process['checked_at'] < VERSION_CHECK_SECONDS:
+        return snapshot
+
+    version = get_reference_version()
+    if snapshot is None or snapshot.version != version:
+        rows = cache.get(_data_key(version))
+        if rows is None:
+            rows = load_reference_rows()
+            cache.set(_data_key(version), rows, REFERENCE_CACHE_TIMEOUT)
+        snapshot = ReferenceData(rows, version)
+    _process['snapshot'] = snapshot
+    _process['checked_at'] = now
+    return snapshot
+
+
+def get_reference_data():
+    if getattr(_local, 'dirty', False):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # This transaction changed reference data nobody else can see yet, so it gets a snapshot of its own
+            if getattr(_local, 'snapshot', None) is None:
+                _local.snapshot = ReferenceData(load_reference_rows(), None)
+            return _local.snapshot
+        # Rolled back; a commit would have cleared the flag
+        _local.dirty = False
+        _local.snapshot = None
+    return _shared_snapshot()
+
+
+def invalidate_reference_data():
+    """Call after changing reference data; the bump happens once the transaction commits."""
+    _local.dirty = True
+    _local.snapshot = None
+    transaction.on_commit(bump_reference_version)
+
+
+def _reference_data_changed(sender, **kwargs):
+    invalidate_reference_data()
+
+
+for _model in (Station, SeatClass, Route, RouteHalt, RouteSeatClass):
+    post_save.connect(_reference_data_changed, sender=_model, dispatch_uid=f'reference-data-{_model.__name__}-saved')
+    post_delete.connect(_reference_data_changed, sender=_model, dispatch_uid=f'reference-data-{_model.__name__}-deleted')
+
+
+def _lookup(table, key):
+    found = getattr(get_reference_data(), table).get(key)
+    if found is None:
+        # Rows added in the last VERSION_CHECK_SECONDS may be missing; check the version now
+        _process['checked_at'] = 0.0
+        found = getattr(get_reference_data(), table).get(key)
+    return found
+
+
+async def _alookup(table, key):
+    snapshot = _process['snapshot']
+    if snapshot is not None and time.monotonic() - _process['checked_at'] < VERSION_CHECK_SECONDS:
+        found = getattr(snapshot, table).get(key)
+        if found is not None:
+            return found
+    # The version check and any rebuild read the cache and the database, which can't be done from the event loop
+    return await sync_to_async(_lookup)(table, key)
+
+
+def _load_route(route_id):
+    """A record for one route straight from the database, for routes the shared snapshot doesn't have yet."""
+    route = Route.objects.using(DEFAULT_DB_ALIAS).select_related('source_station', 'destination_station').filter(pk=route_id).first()
+    if route is None:
+        return None
+
+    def station_record(station):
+        return StationRecord(station.id, station.name, station.code)
+
+    halts = RouteHalt.objects.using(DEFAULT_DB_ALIAS).filter(route_id=route_id).select_related('station').order_by('sequence_number')
+    record = RouteRecord(
+        route.id, route.name, route.code, route.base_fare, station_record(route.source_station),
+        station_record(route.destination_station), route.journey_duration,
+        [(station_record(halt.station), halt.journey_duration_from_source) for halt in halts]
+    )
+    route_seats = RouteSeatClass.objects.using(DEFAULT_DB_ALIAS).filter(route_id=route_id).select_related('seat_class').order_by('seat_class__code')
+    record.seat_classes = tuple(
+        RouteSeatClassRecord(
+            route_seat.id, route_id, SeatClassRecord(route_seat.seat_class.id, route_seat.seat_class.class_type, route_seat.seat_class.code),
+            route_seat.num_of_available_seats, route_seat.base_fare_per_hour
+        )
+        for route_seat in route_seats
+    )
+    return record
+
+
+def get_station(station_id):
+    return _lookup('stations', station_id)
+
+
+def get_station_by_code(code):
+    return _lookup('stations_by_code', code.upper())
+
+
+async def aget_station(station_id):
+    return await _alookup('stations', station_id)
+
+
+async def aget_station_by_code(code):
+    return await _alookup('stations_by_code', code.upper())
+
+
+def get_seat_class(seat_class_id):
+    return _lookup('seat_classes', seat_class_id)
+
+
+def get_route(route_id):
+    """
+    Trains are checked against their route, so a route is loaded from the database
+    when a version bump from another process hasn't reached the shared cache yet.
+    """
+    return _lookup('routes', route_id) or _load_route(route_id)
+
+
+async def aget_route(route_id):
+    return await _alookup('routes', route_id) or await sync_to_async(_load_route)(route_id)
+
+
+def get_route_seat_classes(route_id):
+    """Seat classes offered on a route, ordered by code."""
+    route = get_route(route_id)
+    return route.seat_classes if route else ()
@@ -0,0 +1,103 @@
+"""
+Incremental booking rollups for the staff dashboard.
+
+Booking events add deltas to the DailyRouteStats row for the day the event happened.
+Counts are bumped after the booking transaction commits, in their own short
+statement, so concurrent bookings on a route never wait on each other for the row
+lock; `rebuild_route_stats` recomputes everything from bookings if they drift.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import DailyRouteStats, Route, Station, Train
+
+ROLLUP_FIELDS = ['bookings', 'confirmations', 'cancellations', 'revenue', 'seats_sold']
+
+REFERENCE_COUNTS_CACHE_KEY = 'dashboard:reference-counts'
+REFERENCE_COUNTS_TIMEOUT = 300
+
+
+def apply_route_stats(route_id, day, **deltas):
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if DailyRouteStats.objects.filter(date=day, route_id=route_id).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            DailyRouteStats.objects.create(date=day, route_id=route_id, **deltas)
+    except IntegrityError:
+        # Another request created the row first
+        DailyRouteStats.objects.filter(date=day, route_id=route_id).update(**updates)
+
+
+def record_route_stats(route_id, **deltas):
+    """Add deltas to today's row for the route once the current transaction commits."""
+    day = timezone.localdate()
+    transaction.on_commit(lambda: apply_route_stats(route_id, day, **deltas))
+
+
+def record_booking_created(booking):
+    record_route_stats(booking.train.route_id, bookings=1)
+
+
+def record_booking_confirmed(booking, route_id=None):
+    """Pass route_id when the caller already has it, so the booking's train isn't loaded."""
+    record_route_stats(
+        route_id or booking.train.route_id, confirmations=1, revenue=booking.total_fare, seats_sold=booking.passenger_count
+    )
+
+
+def record_booking_cancelled(booking):
+    record_route_stats(booking.train.route_id, cancellations=1, revenue=-booking.total_fare, seats_sold=-booking.passenger_count)
+
+
+def get_reference_counts():
+    counts = cache.get(REFERENCE_COUNTS_CACHE_KEY)
+    if counts is None:
+        counts = {
+            'total_stations': Station.objects.count(),
+            'total_routes': Route.objects.count(),
+            'total_trains': Train.objects.count(),
+        }
+        cache.set(REFERENCE_COUNTS_CACHE_KEY, counts, REFERENCE_COUNTS_TIMEOUT)
+    return counts
+
+
+def get_dashboard_totals():
+    totals = DailyRouteStats.objects.aggregate(**{field: Sum(field) for field in ROLLUP_FIELDS})
+    totals = {field: value or 0 for field, value in totals.items()}
+    return {
+        'total_bookings': totals['bookings'],
+        # Only confirmed bookings can be cancelled, so this counts paid bookings, confirmed or completed
+        'confirmed_bookings': totals['confirmations'] - totals['cancellations'],
+        'total_revenue': totals['revenue'] or Decimal('0.00'),
+        'seats_sold': totals['seats_sold'],
+    }
+
+
+def get_daily_trend(days=14):
+    """One row per day for the last `days` days, with zeroes filled in and bar widths as percentages."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rows = {
+        row['date']: row for row in DailyRouteStats.objects.filter(date__gte=start).values('date').annotate(
+            **{f'day_{field}': Sum(field) for field in ROLLUP_FIELDS}
+        ).order_by()
+    }
+
+    trend = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = rows.get(day, {})
+        trend.append({'date': day, **{field: row.get(f'day_{field}') or 0 for field in ROLLUP_FIELDS}})
+
+    peak_bookings = max([day['bookings'] for day in trend] + [1])
+    peak_revenue = max([day['revenue'] for day in trend] + [1])
+    for day in trend:
+        day['bookings_pct'] = round(100 * day['bookings'] / peak_bookings)
+        day['revenue_pct'] = round(100 * max(day['revenue'], 0) / peak_revenue)
+    return trend
@@ -1,6 +1,9 @@
 from .models import Station, SeatClass, Passenger, Route, RouteHalt, RouteSeatClass, Train, TrainSegment, TrainSeat, SeatBooking
+from . import reference
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
 import random 
@@ -30,7 +33,7 @@ def validate_route_for_train_generation(route):
 
 def has_bookings(train):
     booking_count = train.bookings.count()
-    seat_booking_count = SeatBooking.objects.filter(train_seat__train=train).count()
+    seat_booking_count = SeatBooking.objects.filter(train=train).count()
     
     return {
         'has_bookings': booking_count > 0 or seat_booking_count > 0,
@@ -97,7 +100,7 @@ def generate_trains_on_route(route_pk):
 
 def create_train_segments_for_train(train):
     booking_count = train.bookings.count()
-    seat_booking_count = SeatBooking.objects.filter(train_seat__train=train).count()
+    seat_booking_count = SeatBooking.objects.filter(train=train).count()
     
     if booking_count > 0 or seat_booking_count > 0:
         return
@@ -106,27 +109,11 @@ def create_train_segments_for_train(train):
     if existing_segments > 0:
         return
 
-    route = train.route
-    num_of_halts = route.halt_stations.count()
-    
-    halt_stations_list = []
-    ordered_halts = get_ordered_halt_stations(route.pk)
-    
-    halt_stations_list.append(route.source_station)
-    halt_stations_list.extend(ordered_halts)
-    halt_stations_list.append(route.destination_station)
-
-    for i in range(len(halt_stations_list) - 1):
-        train_segment = TrainSegment.objects.create(
-            train=train, 
-            segment_source=halt_stations_list[i],
-            segment_destination=halt_stations_list[i + 1],
-            segment_number=(i + 1)
-        )
+    TrainSegment.objects.bulk_create(build_train_segments(train, get_route_station_offsets(train.route)))
 
 def create_train_seats_for_train(train):
     booking_count = train.bookings.count()
-    seat_booking_count = SeatBooking.objects.filter(train_seat__train=train).count()
+    seat_booking_count = SeatBooking.objects.filter(train=train).count()
     
     if booking_count > 0 or seat_booking_count > 0:
         return
@@ -204,50 +191,110 @@ def get_train_generation_summary(route):
         'trains_to_generate': trains_to_generate,
     }
 
+def get_route_station_offsets(route):
+    """Stations of a route in order, each with its journey time from the route's source."""
+    stations = [(route.source_station, timedelta(seconds=0))]
+    for halt in RouteHalt.objects.filter(route=route).select_related('station').order_by('sequence_number'):
+        stations.append((halt.station, halt.journey_duration_from_source))
+    stations.append((route.destination_station, route.journey_duration))
+    return stations
+
+def build_train_segments(train, station_offsets):
+    segments = []
+    for i in range(len(station_offsets) - 1):
+        source, source_offset = station_offsets[i]
+        destination, destination_offset = station_offsets[i + 1]
+        segments.append(TrainSegment(
+            train=train,
+            segment_source=source,
+            segment_destination=destination,
+            segment_number=(i + 1),
+            departure_date_time=train.departure_date_time + source_offset,
+            arrival_date_time=train.departure_date_time + destination_offset,
+            segment_journey_duration=destination_offset - source_offset
+        ))
+    return segments
+
 def get_segment_timing(train, source_station, destination_station):
-    """Calculate timing information for train segments between two stations."""
-    route = train.route
-    
-    station_sequence = []
-    station_sequence.append({
-        'station': route.source_station,
-        'sequence': 0,
-        'duration_from_start': timedelta(seconds=0)
-    })
-    
-    for halt in RouteHalt.objects.filter(route=route).order_by('sequence_number'):
-        station_sequence.append({
-            'station': halt.station,
-            'sequence': halt.sequence_number,
-            'duration_from_start': halt.journey_duration_from_source
-        })
-    
-    station_sequence.append({
-        'station': route.destination_station,
-        'sequence': len(station_sequence),
-        'duration_from_start': route.journey_duration
-    })
-    
-    source_timing = None
-    destination_timing = None
-    
-    for station_item in station_sequence:
-        if station_item['station'] == source_station:
-            source_timing = station_item
-        if station_item['station'] == destination_station:
-            destination_timing = station_item
-    
-    if source_timing and destination_timing:
-        segment_duration = destination_timing['duration_from_start'] - source_timing['duration_from_start']
-        segment_departure = train.departure_date_time + source_timing['duration_from_start']
-        segment_arrival = train.departure_date_time + destination_timing['duration_from_start']
-        
-        return {
-            'segment_duration': segment_duration,
-            'segment_departure': segment_departure,
-            'segment_arrival': segment_arrival,
-            'source_timing': source_timing,
-            'destination_timing': destination_timing
-        }
-    
-    return None
+    """Departure, arrival and duration between two stations, read from the train's segment times."""
+    boundary_segments = TrainSegment.objects.filter(train=train).filter(
+        models.Q(segment_source_id=source_station.pk) | models.Q(segment_destination_id=destination_station.pk)
+    ).values('segment_number', 'segment_source_id', 'segment_destination_id', 'departure_date_time', 'arrival_date_time')
+
+    departure_segment = None
+    arrival_segment = None
+    for segment in boundary_segments:
+        if segment['segment_source_id'] == source_station.pk:
+            departure_segment = segment
+        if segment['segment_destination_id'] == destination_station.pk:
+            arrival_segment = segment
+
+    if not departure_segment or not arrival_segment:
+        return None
+    if departure_segment['segment_number'] > arrival_segment['segment_number']:
+        return None
+    if departure_segment['departure_date_time'] is None or arrival_segment['arrival_date_time'] is None:
+        # Trains generated before segment times were stored; backfill_segment_times fills these in
+        return _get_segment_timing_from_halts(train, source_station, destination_station)
+
+    return {
+        'segment_duration': arrival_segment['arrival_date_time'] - departure_segment['departure_date_time'],
+        'segment_departure': departure_segment['departure_date_time'],
+        'segment_arrival': arrival_segment['arrival_date_time'],
+    }
+
+def _get_segment_timing_from_halts(train, source_station, destination_station):
+    route = reference.get_route(train.route_id)
+    if route is None:
+        return None
+    offsets = route.station_offsets
+    if source_station.pk not in offsets or destination_station.pk not in offsets:
+        return None
+    return {
+        'segment_duration': offsets[destination_station.pk] - offsets[source_station.pk],
+        'segment_departure': train.departure_date_time + offsets[source_station.pk],
+        'segment_arrival': train.departure_date_time + offsets[destination_station.pk],
+    }
+
+STATION_BOARD_CACHE_TIMEOUT = 30
+STATION_BOARD_MAX_HOURS = 12
+
+def _board_entry(segment, scheduled_time):
+    route = segment.train.route
+    return {
+        'train_id': segment.train_id,
+        'route_code': route.code,
+        'route_name': route.name,
+        'origin': route.source_station.code,
+        'destination': route.destination_station.code,
+        'scheduled': scheduled_time.isoformat(),
+        'time': timezone.localtime(scheduled_time).strftime('%H:%M'),
+    }
+
+def get_station_board(station, hours=3):
+    """Departures and arrivals at a station over the next `hours`, cached briefly for polling kiosks."""
+    cache_key = f'station-board:{station.pk}:{hours}'
+    board = cache.get(cache_key)
+    if board is not None:
+        return board
+
+    now = timezone.now()
+    window_end = now + timedelta(hours=hours)
+    related = ('train__route__source_station', 'train__route__destination_station')
+    departures = TrainSegment.objects.filter(
+        segment_source_id=station.pk, departure_date_time__gte=now, departure_date_time__lt=window_end
+    ).select_related(*related).order_by('departure_date_time')
+    arrivals = TrainSegment.objects.filter(
+        segment_destination_id=station.pk, arrival_date_time__gte=now, arrival_date_time__lt=window_end
+    ).select_related(*related).order_by('arrival_date_time')
+
+    board = {
+        'station': {'code': station.code, 'name': station.name},
+        'generated_at': now.isoformat(),
+        'updated': timezone.localtime(now).strftime('%H:%M:%S'),
+        'hours': hours,
+        'departures': [_board_entry(segment, segment.departure_date_time) for segment in departures],
+        'arrivals': [_board_entry(segment, segment.arrival_date_time) for segment in arrivals],
+    }
+    cache.set(cache_key, board, STATION_BOARD_CACHE_TIMEOUT)
+    return board
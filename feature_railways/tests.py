@@ -1,3 +1,1159 @@
-from django.test import TestCase
+import io
+import json
+import hmac
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time as time_module
+from datetime import time, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, connections, transaction
+from django.http import Http404, HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core import dbrouter, metrics, profiling, querytags
+from core.dbhooks import observe_queries
+from core.middleware import ReplicaPinMiddleware
+from core_users.models import CustomUser
+from feature_transaction.models import OTPVerification, Transaction, Wallet
+from feature_transaction.otp_backends import CacheOTPBackend
+from feature_transaction import async_views as transaction_async_views
+from feature_transaction.services import OTPService
+from . import async_views, reference
+from .analytics import compute_load_factors
+from .booking_services import BOOKING_DETAIL_RELATED, BookingPaymentService, BookingService, TicketScanService
+from .manifest import bump_manifest_version, get_manifest_delta, get_train_manifest
+from .models import ArchivedBooking, Booking, DailyRouteStats, Passenger, Route, RouteHalt, RouteSeatClass, SeatBooking, SeatClass, SeatOccupancy, Station, Train, TrainSeat, TrainSegment
+from .occupancy import segment_range
+from .pagination import keyset_paginate
+from .qr_images import get_qr_storage
+from .rollups import get_dashboard_totals
+from .services import create_train_seats_for_train, create_train_segments_for_train, get_segment_timing, get_station_board
+from .tickets import issue_ticket_token, verify_ticket_token
+
+
+class RailwayTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='passenger@example.com', email='passenger@example.com', password='pass')
+        Wallet.objects.filter(user=self.user).update(balance=Decimal('1000.00'))
+
+        self.source = source = Station.objects.create(name='Source', code='SRC')
+        self.destination = destination = Station.objects.create(name='Destination', code='DST')
+        self.route = route = Route.objects.create(
+            name='Express', code='EXP', base_fare=Decimal('100.00'),
+            source_station=source, destination_station=destination,
+            departure_time=time(9, 0), journey_duration=timedelta(hours=4), running_days='1111111'
+        )
+        departure = timezone.now() + timedelta(days=1)
+        self.train = train = Train.objects.create(route=route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+        self.seat_class = seat_class = SeatClass.objects.create(class_type='Sleeper', code='SL')
+
+        self.booking = Booking.objects.create(
+            user=self.user, train=train, seat_class=seat_class, passenger_count=1,
+            total_fare=Decimal('300.00'), booking_status='PENDING_PAYMENT'
+        )
+
+
+class BookingPaymentServiceTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.otp_code = OTPService.send_otp(self.user, 'PAYMENT')['otp_code']
+
+    def test_pay_and_confirm_debits_links_and_confirms(self):
+        result = BookingPaymentService.pay_and_confirm(self.booking, self.otp_code)
+
+        self.assertTrue(result['success'])
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.booking_status, 'CONFIRMED')
+        self.assertEqual(Wallet.objects.get(user=self.user).balance, Decimal('700.00'))
+        txn = Transaction.objects.get(user=self.user)
+        self.assertEqual(txn.booking_id, self.booking.booking_id)
+        self.assertEqual(self.booking.payment_transaction, txn)
+        self.assertEqual(txn.status, 'COMPLETED')
+        self.assertEqual(txn.wallet_balance_after, Decimal('700.00'))
+        self.assertTrue(txn.otp_verification.is_verified)
+        self.assertEqual(OTPVerification.objects.count(), 1)
+        self.assertEqual(verify_ticket_token(self.booking.get_qr_data())['b'], self.booking.booking_id)
+
+    def test_payment_loads_neither_the_train_nor_the_user(self):
+        booking = Booking.objects.get(pk=self.booking.pk)
+
+        # Savepoint, booking and wallet locks, OTP row, wallet debit, transaction, the two ticket reads,
+        # confirmation, release
+        with self.assertNumQueries(10), mock.patch('feature_railways.booking_services.schedule_qr_prerender'):
+            result = BookingPaymentService.pay_and_confirm(booking, self.otp_code)
+
+        self.assertTrue(result['success'])
+
+    def test_failure_after_debit_rolls_back_everything(self):
+        with mock.patch.object(Transaction, 'save', side_effect=DatabaseError('injected failure')):
+            result = BookingPaymentService.pay_and_confirm(self.booking, self.otp_code)
+
+        self.assertFalse(result['success'])
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.booking_status, 'PENDING_PAYMENT')
+        self.assertEqual(Wallet.objects.get(user=self.user).balance, Decimal('1000.00'))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(OTPVerification.objects.exists())
+
+    def test_insufficient_balance_leaves_otp_unused(self):
+        Wallet.objects.filter(user=self.user).update(balance=Decimal('10.00'))
+
+        result = BookingPaymentService.pay_and_confirm(self.booking, self.otp_code)
+
+        self.assertFalse(result['success'])
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.booking_status, 'PENDING_PAYMENT')
+        self.assertTrue(OTPService.verify_otp(self.user.pk, self.otp_code, 'PAYMENT', persist=False)['success'])
+
+    def test_wrong_otp_attempts_are_limited(self):
+        wrong_code = '000000' if self.otp_code != '000000' else '111111'
+        for _ in range(5):
+            result = BookingPaymentService.pay_and_confirm(self.booking, wrong_code)
+            self.assertFalse(result['success'])
+
+        result = BookingPaymentService.pay_and_confirm(self.booking, self.otp_code)
+
+        self.assertFalse(result['success'])
+        self.assertFalse(OTPVerification.objects.exists())
+
+
+class OTPBackendTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.backend = CacheOTPBackend()
+        self.otp_code = self.backend.send(self.user, 'PAYMENT', '')['otp_code']
+
+    def test_cache_counters_are_exact_under_concurrency_and_keep_their_expiry(self):
+        cache.add('counter', 0, 60)
+
+        def bump():
+            for _ in range(25):
+                cache.incr('counter')
+        threads = [threading.Thread(target=bump) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.get('counter'), 200)
+        with open(cache._key_to_file('counter'), 'rb') as f:
+            self.assertLessEqual(pickle.load(f), time_module.time() + 60)
+
+    def test_parallel_guesses_are_checked_at_most_max_attempts_times(self):
+        wrong_code = '000000' if self.otp_code != '000000' else '111111'
+        compare_digest = hmac.compare_digest
+        checked = []
+
+        def counting_compare(a, b):
+            checked.append(b)
+            return compare_digest(a, b)
+        with mock.patch('feature_transaction.otp_backends.hmac.compare_digest', side_effect=counting_compare):
+            threads = [
+                threading.Thread(target=self.backend.verify, args=(self.user.pk, wrong_code, 'PAYMENT', False)) for _ in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertLessEqual(len(checked), self.backend.max_attempts)
+        self.assertFalse(self.backend.verify(self.user.pk, self.otp_code, 'PAYMENT', persist=False)['success'])
+
+
+    def test_resending_does_not_reset_wrong_guesses(self):
+        wrong_code = '000000' if self.otp_code != '000000' else '111111'
+        for _ in range(self.backend.max_attempts - 1):
+            self.backend.verify(self.user.pk, wrong_code, 'PAYMENT', persist=False)
+        otp_code = self.backend.send(self.user, 'PAYMENT', '')['otp_code']
+        wrong_code = '000000' if otp_code != '000000' else '111111'
+
+        self.assertEqual(self.backend.verify(self.user.pk, wrong_code, 'PAYMENT', persist=False)['error'], 'Too many attempts')
+        self.assertFalse(self.backend.send(self.user, 'PAYMENT', '')['success'])
+        self.assertFalse(self.backend.verify(self.user.pk, otp_code, 'PAYMENT', persist=False)['success'])
+
+
+class TicketTokenTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        segment = TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.destination, segment_number=1)
+        seat = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL01')
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        SeatBooking.objects.create(train_seat=seat, train_segment=segment, passenger=passenger)
+        Booking.objects.filter(pk=self.booking.pk).update(booking_status='CONFIRMED', qr_code_data=issue_ticket_token(self.booking))
+        self.booking.refresh_from_db()
+
+    def test_token_round_trip_carries_passengers_and_segments(self):
+        with self.assertNumQueries(0):
+            token = self.booking.get_qr_data()
+        ticket = verify_ticket_token(token)
+
+        self.assertEqual(ticket['b'], self.booking.booking_id)
+        self.assertEqual(ticket['p'], [['Asha', 30, 'F', 'SL01']])
+        self.assertEqual(ticket['seg'], [1, 1])
+
+    def test_prerender_issues_tickets_for_bookings_confirmed_without_one(self):
+        Booking.objects.filter(pk=self.booking.pk).update(qr_code_data='')
+        qr_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, qr_root, ignore_errors=True)
+        get_qr_storage.cache_clear()
+        self.addCleanup(get_qr_storage.cache_clear)
+
+        with self.settings(QR_IMAGE_ROOT=qr_root):
+            call_command('prerender_qr_images', stdout=io.StringIO())
+
+        self.booking.refresh_from_db()
+        self.assertEqual(verify_ticket_token(self.booking.get_qr_data())['b'], self.booking.booking_id)
+        self.assertEqual(len(os.listdir(qr_root)), 2)
+
+    def test_tampered_token_is_rejected(self):
+        body, signature = self.booking.get_qr_data().split('.')
+        forged_body = body[:-2] + ('AA' if body[-2:] != 'AA' else 'BB')
+
+        with self.assertRaises(ValidationError):
+            verify_ticket_token(f'{forged_body}.{signature}')
+
+
+class TrainManifestTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        first = TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.middle, segment_number=1)
+        second = TrainSegment.objects.create(train=self.train, segment_source=self.middle, segment_destination=self.destination, segment_number=2)
+        self.segments = [first, second]
+        self.seat = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL01')
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        for segment in self.segments:
+            SeatBooking.objects.create(train_seat=self.seat, train_segment=segment, passenger=passenger)
+
+    def test_consecutive_segments_collapse_into_one_entry(self):
+        manifest = get_train_manifest(self.train)
+
+        self.assertEqual(manifest['entries'], [['SL01', 'SL', 1, 2, self.booking.booking_id, 'PENDING_PAYMENT', 'Asha', 30, 'F']])
+        self.assertEqual(len(manifest['segments']), 2)
+
+    def test_delta_reports_new_entries_after_version_bump(self):
+        version = get_train_manifest(self.train)['version']
+        other = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL02')
+        passenger = Passenger.objects.create(name='Ravi', age=40, gender='M', booking_by=self.user, booking=self.booking)
+        SeatBooking.objects.create(train_seat=other, train_segment=self.segments[1], passenger=passenger)
+        bump_manifest_version(self.train.id)
+
+        delta = get_manifest_delta(self.train, version)
+
+        self.assertEqual(delta['added'], [('SL02', 'SL', 2, 2, self.booking.booking_id, 'PENDING_PAYMENT', 'Ravi', 40, 'M')])
+        self.assertEqual(delta['removed'], [])
+        self.assertIsNone(get_manifest_delta(self.train, version - 1))
+
+
+class TicketScanServiceTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Booking.objects.filter(pk=self.booking.pk).update(booking_status='CONFIRMED')
+        self.pending = Booking.objects.create(
+            user=self.user, train=self.train, seat_class=self.seat_class, passenger_count=1,
+            total_fare=Decimal('300.00'), booking_status='PENDING_PAYMENT'
+        )
+
+    def test_batch_keeps_earliest_scan_and_reports_each_event(self):
+        first_scan = timezone.now() - timedelta(hours=2)
+        later_scan = first_scan + timedelta(minutes=30)
+
+        result = TicketScanService.verify_batch([
+            {'booking_id': self.booking.booking_id, 'timestamp': later_scan.isoformat(), 'device': 'gate-1'},
+            {'booking_id': self.booking.booking_id, 'timestamp': int(first_scan.timestamp() * 1000), 'device': 'gate-2'},
+            {'booking_id': self.pending.booking_id, 'device': 'gate-1'},
+            {'booking_id': 'BKMISSING', 'device': 'gate-1'},
+            {'qr_data': 'not.a-ticket', 'device': 'gate-3'},
+            {'qr_data': 123, 'device': 'gate-3'},
+            {'qr_data': ['a.b'], 'device': 'gate-3'},
+        ])
+
+        self.assertTrue(result['success'])
+        self.assertEqual(
+            [item['status'] for item in result['results']],
+            ['ALREADY_VERIFIED', 'NEWLY_VERIFIED', 'NOT_CONFIRMED', 'NOT_FOUND', 'INVALID', 'INVALID', 'INVALID']
+        )
+        self.booking.refresh_from_db()
+        self.assertTrue(self.booking.is_verified)
+        self.assertEqual(int(self.booking.verification_timestamp.timestamp()), int(first_scan.timestamp()))
+        self.assertFalse(Booking.objects.get(pk=self.pending.pk).is_verified)
+
+    def test_scans_with_the_same_time_verify_a_booking_once(self):
+        scan_time = (timezone.now() - timedelta(minutes=5)).isoformat()
+
+        result = TicketScanService.verify_batch([
+            {'booking_id': self.booking.booking_id, 'timestamp': scan_time, 'device': 'gate-1'},
+            {'booking_id': self.booking.booking_id, 'timestamp': scan_time, 'device': 'gate-2'},
+        ])
+
+        self.assertEqual([item['status'] for item in result['results']], ['NEWLY_VERIFIED', 'ALREADY_VERIFIED'])
+        self.assertEqual(result['verified'], 1)
+
+    def test_database_errors_are_not_sent_to_scanners(self):
+        failure = DatabaseError('relation "secret" does not exist')
+        with mock.patch.object(Booking.objects, 'select_for_update', side_effect=failure), self.assertLogs('feature_railways.booking_services', 'ERROR'):
+            result = TicketScanService.verify_batch([{'booking_id': self.booking.booking_id}])
+
+        self.assertFalse(result['success'])
+        self.assertNotIn('secret', result['error'])
+
+    def test_later_batch_does_not_move_verification_time_forward(self):
+        first_scan = timezone.now() - timedelta(hours=1)
+        TicketScanService.verify_batch([{'booking_id': self.booking.booking_id, 'timestamp': first_scan.isoformat()}])
+
+        result = TicketScanService.verify_batch([{'booking_id': self.booking.booking_id}])
+
+        self.assertEqual(result['results'][0]['status'], 'ALREADY_VERIFIED')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.verification_timestamp, first_scan)
+
+
+class QRImageTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.qr_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.qr_root, ignore_errors=True)
+        get_qr_storage.cache_clear()
+        self.addCleanup(get_qr_storage.cache_clear)
+        Booking.objects.filter(pk=self.booking.pk).update(booking_status='CONFIRMED', qr_code_data=issue_ticket_token(self.booking))
+        self.client.force_login(self.user)
+        self.url = reverse('feature_railways:generate_qr_code', args=[self.booking.booking_id])
+
+    def test_image_is_stored_and_repeat_view_is_not_modified(self):
+        with self.settings(QR_IMAGE_ROOT=self.qr_root):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(len(os.listdir(self.qr_root)), 1)
+
+            repeat = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(repeat.status_code, 304)
+
+    def test_svg_variant(self):
+        with self.settings(QR_IMAGE_ROOT=self.qr_root):
+            response = self.client.get(self.url, {'format': 'svg'})
+
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+
+class RouteStatsTests(RailwayTestCase):
+
+    def test_payment_and_cancellation_update_daily_rollup(self):
+        otp_code = OTPService.send_otp(self.user, 'PAYMENT')['otp_code']
+        with self.captureOnCommitCallbacks(execute=True), mock.patch('feature_railways.booking_services.schedule_qr_prerender'):
+            BookingPaymentService.pay_and_confirm(self.booking, otp_code)
+
+        stats = DailyRouteStats.objects.get(route=self.route, date=timezone.localdate())
+        self.assertEqual((stats.confirmations, stats.revenue, stats.seats_sold), (1, Decimal('300.00'), 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = BookingService.cancel_booking(self.booking.booking_id, self.user)
+        self.assertTrue(result['success'])
+
+        stats.refresh_from_db()
+        self.assertEqual((stats.cancellations, stats.revenue, stats.seats_sold), (1, Decimal('0.00'), 0))
+        self.assertEqual(get_dashboard_totals()['confirmed_bookings'], 0)
+
+    def test_rebuild_matches_bookings(self):
+        Booking.objects.filter(pk=self.booking.pk).update(booking_status='CONFIRMED')
+
+        call_command('rebuild_route_stats', stdout=io.StringIO())
+
+        totals = get_dashboard_totals()
+        self.assertEqual(totals['total_bookings'], 1)
+        self.assertEqual(totals['confirmed_bookings'], 1)
+        self.assertEqual(totals['total_revenue'], Decimal('300.00'))
+
+
+class LoadFactorTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        middle = Station.objects.create(name='Middle', code='MID')
+        first = TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=middle, segment_number=1)
+        TrainSegment.objects.create(train=self.train, segment_source=middle, segment_destination=self.destination, segment_number=2)
+        seat = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL01')
+        TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL02')
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        SeatBooking.objects.create(train_seat=seat, train_segment=first, passenger=passenger)
+
+    def test_load_factor_per_segment_class_and_route_day(self):
+        departure_day = timezone.localtime(self.train.departure_date_time).date()
+
+        report = compute_load_factors(departure_day, departure_day)
+
+        self.assertEqual((report['booked'], report['capacity'], report['load_factor']), (1, 4, 0.25))
+        self.assertEqual(report['by_class'], [['SL', 1, 4, 0.25]])
+        self.assertEqual(report['by_segment'], [
+            ['EXP', 1, 'SRC', 'MID', 1, 1, 2, 0.5, 0.5, 0],
+            ['EXP', 2, 'MID', 'DST', 1, 0, 2, 0.0, 0.0, 0],
+        ])
+        self.assertEqual(report['by_route_day'], [[departure_day.isoformat(), 'EXP', 1, 1, 4, 0.25]])
+
+    def test_empty_range(self):
+        report = compute_load_factors(timezone.localdate() - timedelta(days=30), timezone.localdate() - timedelta(days=20))
+
+        self.assertEqual(report['trains'], 0)
+        self.assertEqual(report['by_segment'], [])
+
+
+class StaffListTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for days in range(2, 5):
+            departure = self.train.departure_date_time + timedelta(days=days)
+            Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+
+    def test_keyset_pages_walk_forward_and_back(self):
+        factory = RequestFactory()
+        trains = Train.objects.all()
+        expected = list(trains.order_by('departure_date_time', 'id'))
+
+        first = keyset_paginate(factory.get('/'), trains, ['departure_date_time', 'id'], page_size=3)
+        second = keyset_paginate(factory.get(f"/?{first['next_query']}"), trains, ['departure_date_time', 'id'], page_size=3)
+        back = keyset_paginate(factory.get(f"/?{second['previous_query']}"), trains, ['departure_date_time', 'id'], page_size=3)
+
+        self.assertEqual(first['items'] + second['items'], expected)
+        self.assertIsNone(second['next_query'])
+        self.assertEqual(back['items'], first['items'])
+        self.assertIsNone(back['previous_query'])
+
+    def test_view_trains_annotates_seat_counts(self):
+        self.user.is_staff = True
+        self.user.save()
+        seat = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL01')
+        TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number='SL02')
+        segment = TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.destination, segment_number=1)
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        SeatBooking.objects.create(train_seat=seat, train_segment=segment, passenger=passenger)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('feature_railways:view_trains'), {'route': self.route.pk, 'status': 'upcoming'})
+
+        self.assertEqual(response.status_code, 200)
+        train = response.context['trains'][0]
+        self.assertEqual((train.pk, train.booked_seats, train.total_seats), (self.train.pk, 1, 2))
+
+
+class ProfileQueryTests(RailwayTestCase):
+
+    def add_booking(self, seat_number):
+        booking = Booking.objects.create(
+            user=self.user, train=self.train, seat_class=self.seat_class, passenger_count=2,
+            total_fare=Decimal('200.00'), booking_status='CONFIRMED', journey_source=self.source, journey_destination=self.destination
+        )
+        for index, name in enumerate(['Asha', 'Ravi']):
+            seat = TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number=f'{seat_number}{index}')
+            passenger = Passenger.objects.create(name=name, age=30, gender='F', booking_by=self.user, booking=booking)
+            for segment in self.segments:
+                SeatBooking.objects.create(train_seat=seat, train_segment=segment, passenger=passenger)
+        return booking
+
+    def setUp(self):
+        super().setUp()
+        middle = Station.objects.create(name='Middle', code='MID')
+        self.segments = [
+            TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=middle, segment_number=1),
+            TrainSegment.objects.create(train=self.train, segment_source=middle, segment_destination=self.destination, segment_number=2),
+        ]
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_profile_queries_do_not_grow_with_bookings(self):
+        self.add_booking('A')
+        few = self.count_queries(reverse('feature_railways:user_profile'))
+        for seat_number in 'BCD':
+            self.add_booking(seat_number)
+
+        self.assertEqual(self.count_queries(reverse('feature_railways:user_profile')), few)
+
+    def test_profile_summary_query_count(self):
+        for seat_number in 'AB':
+            self.add_booking(seat_number)
+
+        with self.assertNumQueries(4):
+            summary = BookingService.get_profile_summary(self.user)
+
+        self.assertEqual(summary['total_bookings'], len(summary['user_bookings']))
+
+    def test_booking_summary_uses_one_seat_query(self):
+        booking = Booking.objects.select_related(*BOOKING_DETAIL_RELATED).get(pk=self.add_booking('A').pk)
+
+        with self.assertNumQueries(1):
+            summary = BookingService.get_booking_summary(booking)
+
+        self.assertEqual([assignment['seat_number'] for assignment in summary['seat_assignments']], ['A0', 'A1'])
+        self.assertEqual([segment['segment_number'] for segment in summary['segment_details']], [1, 2])
+
+
+class SegmentTimingTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        RouteHalt.objects.create(route=self.route, station=self.middle, sequence_number=1, journey_duration_from_source=timedelta(hours=1, minutes=30))
+
+    def test_generated_segments_carry_times(self):
+        departure = self.train.departure_date_time + timedelta(days=1)
+        train = Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+
+        create_train_segments_for_train(train)
+
+        segments = list(train.segments.order_by('segment_number'))
+        self.assertEqual(
+            [(s.departure_date_time, s.arrival_date_time, s.segment_journey_duration) for s in segments],
+            [
+                (departure, departure + timedelta(hours=1, minutes=30), timedelta(hours=1, minutes=30)),
+                (departure + timedelta(hours=1, minutes=30), departure + timedelta(hours=4), timedelta(hours=2, minutes=30)),
+            ]
+        )
+
+    def test_timing_reads_segments_and_backfill_fills_missing_times(self):
+        TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.middle, segment_number=1)
+        TrainSegment.objects.create(train=self.train, segment_source=self.middle, segment_destination=self.destination, segment_number=2)
+        call_command('backfill_segment_times', stdout=io.StringIO())
+
+        with self.assertNumQueries(1):
+            timing = get_segment_timing(self.train, self.middle, self.destination)
+
+        self.assertEqual(timing['segment_departure'], self.train.departure_date_time + timedelta(hours=1, minutes=30))
+        self.assertEqual(timing['segment_duration'], timedelta(hours=2, minutes=30))
+        self.assertIsNone(get_segment_timing(self.train, self.destination, self.source))
+
+
+class StationBoardTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        soon = timezone.now() + timedelta(hours=1)
+        self.train.departure_date_time = soon
+        self.train.save()
+        TrainSegment.objects.create(
+            train=self.train, segment_source=self.source, segment_destination=self.destination, segment_number=1,
+            departure_date_time=soon, arrival_date_time=soon + timedelta(hours=4)
+        )
+
+    def test_board_lists_departures_in_window_and_is_cached(self):
+        url = reverse('feature_railways:station_board_data', args=['src'])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['train_id'] for entry in response.json()['departures']], [self.train.pk])
+        self.assertEqual(response.json()['arrivals'], [])
+        self.assertIn('max-age=30', response['Cache-Control'])
+
+        # The station comes from the reference data cache and the board from the cache
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_arrivals_outside_window_are_left_out(self):
+        board = self.client.get(reverse('feature_railways:station_board_data', args=['DST']), {'hours': 2}).json()
+
+        self.assertEqual(board['arrivals'], [])
+        self.assertEqual(board['hours'], 2)
+
+
+class SeatOccupancyTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        RouteHalt.objects.create(route=self.route, station=self.middle, sequence_number=1, journey_duration_from_source=timedelta(hours=2))
+        TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.middle, segment_number=1)
+        TrainSegment.objects.create(train=self.train, segment_source=self.middle, segment_destination=self.destination, segment_number=2)
+        self.seats = [
+            TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number=f'SL0{i}') for i in (1, 2)
+        ]
+
+    def test_migration_collapses_segments_and_constraint_rejects_overlap(self):
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        for segment in self.train.segments.all():
+            SeatBooking.objects.create(train_seat=self.seats[0], train_segment=segment, passenger=passenger)
+        # Saved before the denormalized columns existed
+        SeatBooking.objects.update(train=None, seat_class=None, segment_number=None)
+
+        call_command('migrate_seat_occupancy', stdout=io.StringIO())
+        call_command('migrate_seat_occupancy', stdout=io.StringIO())
+
+        occupancy = SeatOccupancy.objects.get()
+        self.assertEqual((occupancy.passenger, occupancy.train_seat, occupancy.segments), (passenger, self.seats[0], segment_range(1, 2)))
+        other = Passenger.objects.create(name='Ravi', age=40, gender='M', booking_by=self.user, booking=self.booking)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SeatOccupancy.objects.create(
+                train=self.train, train_seat=self.seats[0], seat_class=self.seat_class, passenger=other, segments=segment_range(2, 2)
+            )
+
+    @override_settings(SEAT_OCCUPANCY_RANGES=True)
+    def test_bookings_write_ranges_and_availability_reads_overlaps(self):
+        passengers = [{'name': 'Asha', 'age': 30, 'gender': 'F'}]
+        result = BookingService.create_booking(self.user, self.train, self.seat_class, passengers, '', self.middle, self.destination)
+
+        self.assertTrue(result['success'], result['message'])
+        self.assertEqual(SeatOccupancy.objects.get().segments, segment_range(2, 2))
+        first_leg = BookingService.check_seat_availability(self.train, self.seat_class, 2, self.source, self.middle)
+        second_leg = BookingService.check_seat_availability(self.train, self.seat_class, 2, self.middle, self.destination)
+        self.assertEqual((first_leg['available_seats'], second_leg['available_seats']), (2, 1))
+        BookingService.create_booking(self.user, self.train, self.seat_class, passengers, '', self.source, self.destination)
+        self.assertEqual(SeatOccupancy.objects.get(passenger__booking=Booking.objects.latest('id')).train_seat, self.seats[1])
+
+    @override_settings(SEAT_OCCUPANCY_RANGES=True)
+    def test_benchmark_runs_both_availability_paths(self):
+        passengers = [{'name': 'Asha', 'age': 30, 'gender': 'F'}]
+        BookingService.create_booking(self.user, self.train, self.seat_class, passengers, '', self.source, self.destination)
+        out = io.StringIO()
+
+        call_command('benchmark_seat_occupancy', '--queries', '5', stdout=out)
+
+        lines = [line for line in out.getvalue().splitlines() if 'availability:' in line]
+        self.assertEqual(len(lines), 2)
+        # A failing lookup returns early with no queries, so this catches the benchmark passing the wrong arguments
+        self.assertFalse([line for line in lines if ' 0.0 queries per lookup' in line], lines)
+
+    @override_settings(SEAT_OCCUPANCY_RANGES=True)
+    def test_benchmark_without_lookups_says_so(self):
+        passengers = [{'name': 'Asha', 'age': 30, 'gender': 'F'}]
+        BookingService.create_booking(self.user, self.train, self.seat_class, passengers, '', self.source, self.destination)
+        out = io.StringIO()
+
+        call_command('benchmark_seat_occupancy', '--queries', '0', stdout=out)
+
+        self.assertIn('No lookups to benchmark', out.getvalue())
+
+
+class ArchiveTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        departure = timezone.now() - timedelta(days=40)
+        self.old_train = Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+        segment = TrainSegment.objects.create(train=self.old_train, segment_source=self.source, segment_destination=self.destination, segment_number=1)
+        seat = TrainSeat.objects.create(train=self.old_train, seat_class=self.seat_class, seat_number='SL07')
+        self.old_booking = Booking.objects.create(
+            user=self.user, train=self.old_train, seat_class=self.seat_class, passenger_count=1,
+            total_fare=Decimal('250.00'), booking_status='CONFIRMED'
+        )
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.old_booking)
+        SeatBooking.objects.create(train_seat=seat, train_segment=segment, passenger=passenger)
+
+    def test_command_moves_finished_journeys_and_drops_their_trains(self):
+        call_command('archive_completed_journeys', days=30, batch_size=1, stdout=io.StringIO())
+
+        archived = ArchivedBooking.objects.get()
+        self.assertEqual((archived.booking_id, archived.booking_status, archived.train_number), (self.old_booking.booking_id, 'COMPLETED', self.old_train.pk))
+        self.assertEqual(list(archived.passengers.values_list('name', 'seat_number', 'first_segment', 'last_segment')), [('Asha', 'SL07', 1, 1)])
+        self.assertEqual(list(Booking.objects.all()), [self.booking])
+        self.assertFalse(Train.objects.filter(pk=self.old_train.pk).exists())
+        self.assertFalse(SeatBooking.objects.exists())
+        self.assertTrue(Train.objects.filter(pk=self.train.pk).exists())
+
+    def test_history_pages_read_the_archive(self):
+        call_command('archive_completed_journeys', days=30, stdout=io.StringIO())
+        self.client.force_login(self.user)
+
+        profile = self.client.get(reverse('feature_railways:user_profile'))
+        detail = self.client.get(reverse('feature_railways:booking_detail', args=[self.old_booking.booking_id]))
+
+        self.assertEqual(profile.context['total_bookings'], 2)
+        self.assertEqual([booking.booking_id for booking in profile.context['user_bookings']], [self.old_booking.booking_id, self.booking.booking_id])
+        self.assertContains(detail, 'SL07')
+        self.assertContains(detail, 'Archived')
+
+
+class SeatBookingColumnTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        self.segments = [
+            TrainSegment.objects.create(train=self.train, segment_source=self.source, segment_destination=self.middle, segment_number=1),
+            TrainSegment.objects.create(train=self.train, segment_source=self.middle, segment_destination=self.destination, segment_number=2),
+        ]
+        self.seats = [TrainSeat.objects.create(train=self.train, seat_class=self.seat_class, seat_number=f'SL0{i}') for i in (1, 2, 3)]
+        passenger = Passenger.objects.create(name='Asha', age=30, gender='F', booking_by=self.user, booking=self.booking)
+        SeatBooking.objects.create(train_seat=self.seats[0], train_segment=self.segments[1], passenger=passenger)
+
+    def test_columns_are_filled_on_insert_and_by_backfill(self):
+        expected = [(self.train.pk, self.seat_class.pk, 2)]
+        self.assertEqual(list(SeatBooking.objects.values_list('train', 'seat_class', 'segment_number')), expected)
+
+        SeatBooking.objects.update(train=None, seat_class=None, segment_number=None)
+        call_command('backfill_seat_booking_columns', stdout=io.StringIO())
+
+        self.assertEqual(list(SeatBooking.objects.values_list('train', 'seat_class', 'segment_number')), expected)
+
+    def test_segment_availability_is_one_grouped_query(self):
+        with self.assertNumQueries(2):
+            availability = BookingService._get_segment_availability(self.train, self.seat_class, self.segments)
+
+        self.assertEqual(availability, {'total_seats': 3, 'available_seats': 2})
+
+
+class QueryPlanTests(RailwayTestCase):
+    """Sequential scans are disabled, so a Seq Scan in a plan means no index fits the query."""
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        RouteHalt.objects.create(route=self.route, station=self.middle, sequence_number=1, journey_duration_from_source=timedelta(hours=2))
+        RouteSeatClass.objects.create(route=self.route, seat_class=self.seat_class, num_of_available_seats=3)
+        # Segments and seats are only generated for trains without bookings
+        departure = self.train.departure_date_time + timedelta(hours=1)
+        self.train = Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+        create_train_segments_for_train(self.train)
+        create_train_seats_for_train(self.train)
+        self.client.force_login(self.user)
+        passengers = [{'name': 'Asha', 'age': 30, 'gender': 'F'}]
+        self.assertTrue(BookingService.create_booking(self.user, self.train, self.seat_class, passengers, '', self.middle, self.destination)['success'])
+
+    def assertQueriesUseIndexes(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            func(*args, **kwargs)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in queries:
+                # Unfiltered reads of small reference tables (form choices and the like) are expected to scan
+                if not query['sql'].startswith('SELECT') or ' WHERE ' not in query['sql']:
+                    continue
+                cursor.execute(f"EXPLAIN {query['sql']}")
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                self.assertNotIn('Seq Scan', plan, f"{query['sql']}\n{plan}")
+
+    def test_booking_service_queries_use_indexes(self):
+        self.assertQueriesUseIndexes(BookingService.check_seat_availability, self.train, self.seat_class, 1, self.source, self.middle)
+        self.assertQueriesUseIndexes(BookingService.create_booking, self.user, self.train, self.seat_class, [{'name': 'Ravi', 'age': 40, 'gender': 'M'}], '', self.source, self.destination)
+        self.assertQueriesUseIndexes(BookingService.get_profile_summary, self.user)
+
+    def test_service_and_view_queries_use_indexes(self):
+        self.assertQueriesUseIndexes(get_station_board, self.middle)
+        self.assertQueriesUseIndexes(get_segment_timing, self.train, self.middle, self.destination)
+        date = timezone.localtime(self.train.departure_date_time).date()
+        self.assertQueriesUseIndexes(self.client.get, reverse('feature_railways:search_trains'), {'source': self.middle.pk, 'destination': self.destination.pk, 'date': date})
+        self.assertQueriesUseIndexes(self.client.get, reverse('feature_railways:booking_detail', args=[Booking.objects.latest('id').booking_id]))
+
+    def test_seat_cannot_be_sold_twice_for_a_segment(self):
+        seat_booking = SeatBooking.objects.get()
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SeatBooking.objects.create(train_seat=seat_booking.train_seat, train_segment=seat_booking.train_segment, passenger=seat_booking.passenger)
+
+
+class CompleteDepartedBookingsTests(RailwayTestCase):
+
+    def add_confirmed_booking(self, arrived_hours_ago):
+        arrival = timezone.now() - timedelta(hours=arrived_hours_ago)
+        train = Train.objects.create(route=self.route, departure_date_time=arrival - timedelta(hours=4), arrival_date_time=arrival)
+        return Booking.objects.create(
+            user=self.user, train=train, seat_class=self.seat_class, passenger_count=1,
+            total_fare=Decimal('300.00'), booking_status='CONFIRMED'
+        )
+
+    def test_only_bookings_past_the_grace_period_are_completed(self):
+        finished = self.add_confirmed_booking(arrived_hours_ago=8)
+        scanning = self.add_confirmed_booking(arrived_hours_ago=1)
+        segment = self.add_confirmed_booking(arrived_hours_ago=-2)
+        Booking.objects.filter(pk=segment.pk).update(arrival_datetime=timezone.now() - timedelta(hours=7))
+        version = get_train_manifest(finished.train)['version']
+
+        call_command('complete_departed_bookings', batch_size=1, stdout=io.StringIO())
+
+        statuses = dict(Booking.objects.values_list('id', 'booking_status'))
+        self.assertEqual(
+            [statuses[booking.pk] for booking in (finished, scanning, segment, self.booking)],
+            ['COMPLETED', 'CONFIRMED', 'COMPLETED', 'PENDING_PAYMENT']
+        )
+        self.assertGreater(get_train_manifest(finished.train)['version'], version)
+
+
+class MetricsTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        settings_override = override_settings(METRICS_DIR=metrics_dir, METRICS_TOKEN='scrape-token')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.reset()
+
+    def test_requests_are_counted_per_view_and_exposed(self):
+        url = reverse('feature_railways:station_board_data', args=['SRC'])
+        self.client.get(url)
+        self.client.get(url)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('django_http_requests_total{method="GET",status="200",view="feature_railways:station_board_data"} 2', body)
+        self.assertIn('django_http_request_duration_seconds_count{view="feature_railways:station_board_data"} 2', body)
+        # The cached second request only looks up the station
+        self.assertIn('django_db_queries_per_request_bucket{view="feature_railways:station_board_data",le="1"} 1', body)
+        self.assertIn('django_cache_gets_total{result="hit"}', body)
+
+    def test_files_of_exited_workers_are_archived_without_losing_counts(self):
+        metrics.inc('django_cache_gets_total', {'result': 'hit'}, 3)
+        metrics.flush(force=True)
+        worker = subprocess.Popen([sys.executable, '-c', ''])
+        worker.wait()
+        shutil.copy(metrics._worker_path(), metrics._worker_path(worker.pid))
+
+        self.assertIn('django_cache_gets_total{result="hit"} 6', metrics.render())
+        self.assertEqual(sorted(os.listdir(settings.METRICS_DIR)), [f'metrics-{os.getpid()}.json', 'metrics-archive.json', 'metrics.lock'])
+        self.assertIn('django_cache_gets_total{result="hit"} 6', metrics.render())
+
+    def test_a_worker_reusing_a_pid_keeps_the_exited_workers_counts(self):
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        with open(metrics._worker_path(), 'w') as f:
+            json.dump({'counters': [['django_cache_gets_total', [['result', 'hit']], 4]], 'histograms': []}, f)
+        metrics.inc('django_cache_gets_total', {'result': 'hit'}, 1)
+
+        metrics.flush(force=True)
+
+        self.assertIn('django_cache_gets_total{result="hit"} 5', metrics.render())
+
+    def test_metrics_need_the_token_or_a_staff_session(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class ProfilingTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        profiles_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiles_dir)
+        settings_override = override_settings(PROFILES_DIR=profiles_dir, PROFILING_INTERVAL=0.001)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def test_staff_can_profile_a_request(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(reverse('feature_railways:search_trains'), {'_profile': '1'})
+
+        profile = profiling.load_profile(response['X-Profile-Id'])
+        self.assertEqual(profile['trigger'], 'staff')
+        self.assertEqual(profile['view'], 'feature_railways:search_trains')
+        self.assertTrue(profile['sql'])
+        listing = self.client.get(reverse('profile_list'))
+        self.assertContains(listing, reverse('profile_detail', args=[profile['id']]))
+        self.assertEqual(self.client.get(reverse('profile_detail', args=[profile['id']])).status_code, 200)
+        download = self.client.get(reverse('profile_download', args=[profile['id']]))
+        self.assertEqual(download.content.decode(), profiling.folded(profile))
+
+    def test_only_staff_can_ask_for_a_profile(self):
+        response = self.client.get(reverse('feature_railways:search_trains'), HTTP_X_PROFILE='1')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profiling.recent_profiles(), [])
+        self.assertEqual(self.client.get(reverse('profile_list')).status_code, 302)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_sampled_requests_are_stored_without_the_header(self):
+        response = self.client.get(reverse('feature_railways:search_trains'))
+
+        self.assertNotIn('X-Profile-Id', response)
+        [profile] = profiling.recent_profiles()
+        self.assertEqual(profile['trigger'], 'sampled')
+        self.assertEqual(profile['user'], self.user.get_username())
+
+    def test_old_profiles_are_pruned_and_bad_ids_rejected(self):
+        with override_settings(PROFILES_KEEP=2):
+            for second in range(3):
+                profiling.save_profile(f'20260101-00000{second}-0000000{second}', {'id': second, 'stacks': {}, 'sql': []})
+
+        self.assertEqual([profile['id'] for profile in profiling.recent_profiles()], [2, 1])
+        self.assertIsNone(profiling.load_profile('../settings'))
+
+
+class QueryTagTests(RailwayTestCase):
+
+    def test_request_queries_carry_the_request_id_and_view(self):
+        statements = []
+        self.client.force_login(self.user)
+        with observe_queries(lambda alias, sql, *rest: statements.append(sql)):
+            response = self.client.get(reverse('feature_railways:search_trains'), HTTP_X_REQUEST_ID='req-123')
+
+        self.assertEqual(response['X-Request-ID'], 'req-123')
+        self.assertTrue(statements)
+        # Session and user lookups run before the view is resolved
+        self.assertTrue(all(sql.startswith("/*request_id='req-123'") for sql in statements))
+        self.assertIn("/*request_id='req-123',view='feature_railways:search_trains'*/ SELECT", statements[-1])
+
+    def test_service_methods_tag_their_queries(self):
+        statements = []
+        with querytags.tags(view="x'*/ DROP TABLE"), observe_queries(lambda alias, sql, *rest: statements.append(sql)):
+            BookingService.check_seat_availability(self.train, self.seat_class, 1)
+
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertTrue(sql.startswith("/*view='x____DROP_TABLE',service='BookingService.check_seat_availability'*/ "), sql)
+
+    async def test_async_requests_are_tagged_too(self):
+        statements = []
+        with observe_queries(lambda alias, sql, *rest: statements.append(sql)):
+            response = await self.async_client.get(
+                reverse('feature_railways:station_board_data', args=['SRC']), headers={'X-Request-ID': 'async-1'}
+            )
+
+        self.assertEqual(response['X-Request-ID'], 'async-1')
+        self.assertIn("/*request_id='async-1',view='feature_railways:station_board_data'*/ SELECT", statements[-1])
+
+
+class SlowRequestLogTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_sql_and_plans(self):
+        with self.assertLogs('core.slowlog', 'WARNING') as logs:
+            self.client.get(reverse('feature_railways:search_trains'), HTTP_X_REQUEST_ID='nginx-42')
+
+        [record] = logs.records
+        entry = json.loads(record.getMessage())
+        self.assertEqual(entry['request_id'], 'nginx-42')
+        self.assertEqual(entry['view'], 'feature_railways:search_trains')
+        self.assertEqual(entry['query_count'], len(entry['queries']))
+        self.assertTrue(entry['plans'])
+        for plan in entry['plans']:
+            self.assertIn("/*request_id='nginx-42'", plan['sql'])
+            self.assertNotIn('EXPLAIN failed', plan['plan'])
+            self.assertIn('cost=', plan['plan'])
+
+    @override_settings(SLOW_REQUEST_MS=60000, SLOW_QUERY_MS=60000)
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('core.slowlog'):
+            response = self.client.get(reverse('feature_railways:search_trains'))
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncReadViewTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RouteSeatClass.objects.create(route=self.route, seat_class=self.seat_class, num_of_available_seats=3)
+        departure = timezone.now() + timedelta(days=2)
+        self.train = Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+        create_train_segments_for_train(self.train)
+        create_train_seats_for_train(self.train)
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_availability_matches_the_sync_view(self):
+        url = reverse('feature_railways:train_availability', args=[self.train.id])
+        query = {'source': self.source.id, 'destination': self.destination.id}
+        sync_response = await sync_to_async(self.client.get)(url, query)
+
+        response = await async_views.train_availability(self.factory.get(url, query), self.train.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(sync_response.content))
+        self.assertEqual(json.loads(response.content)['classes'], [
+            {'code': 'SL', 'class_type': 'Sleeper', 'available_seats': 3, 'total_seats': 3}
+        ])
+
+    async def test_async_search_matches_the_sync_view(self):
+        query = {'source': self.source.id, 'destination': self.destination.id, 'date': self.train.departure_date_time.date().isoformat()}
+        sync_context = (await sync_to_async(self.client.get)(reverse('feature_railways:search_trains'), query)).context
+
+        with mock.patch.object(async_views, 'render', side_effect=lambda request, template, context: context):
+            context = await async_views.search_trains(self.factory.get('/', query))
+
+        self.assertEqual(context['trains'], sync_context['trains'])
+        self.assertEqual(context['trains'][0].seat_availability, sync_context['trains'][0].seat_availability)
+        self.assertEqual(list(context['trains'][0].seat_availability.values()), [{'available_seats': 3, 'total_seats': 3}])
+
+    async def test_async_board_and_balance(self):
+        board = await async_views.station_board_data(self.factory.get('/', {'hours': 'x'}), 'src')
+        self.assertEqual(board.status_code, 400)
+        board = await async_views.station_board_data(self.factory.get('/'), 'src')
+        self.assertEqual(json.loads(board.content)['station']['code'], self.source.code)
+
+        request = self.factory.get('/')
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        response = await transaction_async_views.wallet_api_balance(request)
+        self.assertEqual(json.loads(response.content)['balance'], '1000.00')
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRouterTests(RailwayTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, dbrouter, '_replica_down_until', 0.0)
+        # Only the stand-in replica has this train, so finding it shows which database answered
+        source = Station.objects.using('replica').create(name='Replica Source', code='RPS')
+        destination = Station.objects.using('replica').create(name='Replica Destination', code='RPD')
+        route = Route.objects.using('replica').create(
+            name='Replica Only', code='RPL', source_station=source, destination_station=destination,
+            departure_time=time(9, 0), journey_duration=timedelta(hours=1)
+        )
+        departure = timezone.now() + timedelta(days=1)
+        self.replica_train = Train.objects.using('replica').create(
+            id=self.train.pk + 1000, route=route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=1)
+        )
+        self.probe_url = reverse('feature_railways:train_availability', args=[self.replica_train.pk])
+
+    def test_read_only_views_read_from_the_replica(self):
+        self.assertEqual(self.client.get(self.probe_url).status_code, 200)
+        # Views that aren't marked for the replica read from the primary
+        self.assertFalse(Train.objects.filter(pk=self.replica_train.pk).exists())
+
+    def test_clients_that_wrote_are_pinned_to_the_primary(self):
+        def write_view(request):
+            Station.objects.create(name='Middle', code='MID')
+            with dbrouter.reading_from_replica():
+                # Reads after a write in the same request stay on the primary
+                self.assertTrue(Station.objects.filter(code='MID').exists())
+            return HttpResponse()
+
+        response = ReplicaPinMiddleware(write_view)(RequestFactory().get('/'))
+
+        self.assertIn(dbrouter.PIN_COOKIE, response.cookies)
+        self.client.cookies[dbrouter.PIN_COOKIE] = '1'
+        self.assertEqual(self.client.get(self.probe_url).status_code, 404)
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError) as ensure_connection:
+            self.assertEqual(self.client.get(self.probe_url).status_code, 404)
+            self.assertEqual(self.client.get(reverse('feature_railways:station_board_data', args=['SRC'])).status_code, 200)
+
+        # The replica isn't tried again until REPLICA_RETRY_SECONDS have passed
+        self.assertEqual(ensure_connection.call_count, 1)
+
+
+class ReferenceDataTests(RailwayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.middle = Station.objects.create(name='Middle', code='MID')
+        RouteHalt.objects.create(route=self.route, station=self.middle, sequence_number=10, journey_duration_from_source=timedelta(hours=1))
+        RouteSeatClass.objects.create(route=self.route, seat_class=self.seat_class, num_of_available_seats=10, base_fare_per_hour=Decimal('10.00'))
+        # What committing the setUp writes would do
+        reference.bump_reference_version()
+        self.addCleanup(reference._process.update, snapshot=None)
+
+    def test_records_stand_in_for_model_instances(self):
+        station = reference.get_station_by_code('src')
+        route = reference.get_route(self.route.pk)
+
+        self.assertEqual(station, self.source)
+        self.assertEqual(hash(station), hash(self.source))
+        self.assertFalse(hasattr(station, '__dict__'))
+        self.assertEqual(str(route), str(self.route))
+        self.assertEqual([station for station, offset in route.stations], [self.source, self.middle, self.destination])
+        self.assertEqual(route.get_seat_class(self.seat_class.pk).base_fare_per_hour, Decimal('10.00'))
+
+    def test_reads_come_from_the_process_then_the_shared_cache(self):
+        reference.get_reference_data()
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.get_seat_class(self.seat_class.pk), self.seat_class)
+
+        # Another worker starting up takes the rows from the shared cache
+        reference._process['snapshot'] = None
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.get_station(self.middle.pk).name, 'Middle')
+
+    def test_committed_writes_reach_every_worker_within_a_check_interval(self):
+        snapshot = reference.get_reference_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            Station.objects.create(name='Junction', code='JCT')
+        self.assertIsNotNone(reference.get_station_by_code('JCT'))
+        self.assertNotEqual(reference.get_reference_version(), snapshot.version)
+
+        # A worker that checked the version just now keeps its snapshot until the next check
+        reference._process.update(snapshot=snapshot, checked_at=time_module.monotonic())
+        self.assertNotIn('JCT', reference.get_reference_data().stations_by_code)
+        reference._process['checked_at'] -= reference.VERSION_CHECK_SECONDS
+        self.assertIn('JCT', reference.get_reference_data().stations_by_code)
+
+    def test_routes_newer_than_the_snapshot_are_still_found(self):
+        snapshot = reference.get_reference_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            route = Route.objects.create(
+                name='Local', code='LOC', base_fare=Decimal('50.00'), source_station=self.source, destination_station=self.middle,
+                departure_time=time(9, 0), journey_duration=timedelta(hours=1)
+            )
+        train = Train.objects.create(route=route, departure_date_time=self.train.departure_date_time, arrival_date_time=self.train.departure_date_time)
+
+        # Checked less than VERSION_CHECK_SECONDS ago, so only a miss makes it look at the version again
+        reference._process.update(snapshot=snapshot, checked_at=time_module.monotonic())
+        self.assertEqual(reference.get_route(route.pk), route)
+
+        # A bump that hasn't reached the shared cache yet; the route is read from the database
+        reference._process.update(snapshot=snapshot, checked_at=time_module.monotonic())
+        with mock.patch.object(reference, 'get_reference_version', return_value=snapshot.version):
+            self.assertEqual(reference.get_route(route.pk).destination_station, self.middle)
+            self.assertEqual(BookingService.calculate_fare(train, self.seat_class, 1)['total_fare'], Decimal('100.00'))
+
+    async def test_async_lookups_answer_from_memory_between_version_checks(self):
+        await sync_to_async(reference.get_reference_data)()
+        with mock.patch.object(reference, '_lookup', side_effect=AssertionError('left the event loop')):
+            self.assertEqual(await reference.aget_station_by_code('mid'), self.middle)
+
+        reference._process['checked_at'] -= reference.VERSION_CHECK_SECONDS
+        self.assertEqual(await reference.aget_station(self.middle.pk), self.middle)
+        with self.assertRaises(Http404):
+            await async_views.station_board_data(AsyncRequestFactory().get('/'), 'nowhere')
+
+    def test_uncommitted_writes_are_only_seen_by_their_transaction(self):
+        version = reference.get_reference_version()
+        Station.objects.create(name='Junction', code='JCT')
+
+        self.assertIsNotNone(reference.get_station_by_code('JCT'))
+        self.assertIsNone(reference._process['snapshot'])
+        self.assertIsNone(cache.get(f'reference-data:{version}'))
+
+    def test_fare_and_segments_use_the_route_halts(self):
+        fare = BookingService.calculate_fare(self.train, self.seat_class, 2, self.middle, self.destination)
+        self.assertEqual(fare['per_passenger_fare'], Decimal('130.00'))
+        self.assertEqual(fare['total_fare'], Decimal('260.00'))
+
+        departure = self.train.departure_date_time + timedelta(days=1)
+        train = Train.objects.create(route=self.route, departure_date_time=departure, arrival_date_time=departure + timedelta(hours=4))
+        create_train_segments_for_train(train)
+        # The halt's sequence number is 10, but it ends segment 1
+        segments = BookingService._get_overlapping_segments(train, self.middle, self.destination)
+        self.assertEqual([segment.segment_number for segment in segments], [2])
@@ -0,0 +1,118 @@
+"""
+Signed ticket tokens for QR codes.
+
+A token is `<payload>.<signature>`, both base64url without padding. The payload is
+compact JSON describing the journey and passengers, signed with Ed25519 so scanners
+can check it offline with the public key from `ticket_public_key`.
+"""
+import base64
+import hashlib
+import json
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+TICKET_VERSION = 1
+
+# Tickets stay valid for a while after arrival so late scans still pass
+TICKET_VALIDITY_AFTER_ARRIVAL_SECONDS = 6 * 3600
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+@lru_cache(maxsize=1)
+def get_signing_key():
+    configured_key = getattr(settings, 'TICKET_SIGNING_KEY', '')
+    if configured_key:
+        return serialization.load_pem_private_key(configured_key.encode(), password=None)
+    # Without a configured key, derive a stable one from SECRET_KEY so every worker signs alike
+    seed = hashlib.sha256(f'ticket-signing:{settings.SECRET_KEY}'.encode()).digest()
+    return Ed25519PrivateKey.from_private_bytes(seed)
+
+
+@lru_cache(maxsize=1)
+def get_public_key_bytes():
+    return get_signing_key().public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+
+def get_public_key_b64():
+    return _b64encode(get_public_key_bytes())
+
+
+def build_ticket_payload(booking):
+    """Needs two queries: the booking with its related rows and the seat assignments."""
+    from .models import Booking, SeatBooking
+
+    booking = Booking.objects.select_related(
+        'train__route__source_station', 'train__route__destination_station',
+        'journey_source', 'journey_destination', 'seat_class'
+    ).get(pk=booking.pk)
+
+    passengers = {}
+    segment_numbers = []
+    for row in SeatBooking.objects.filter(passenger__booking=booking).values_list(
+        'passenger_id', 'passenger__name', 'passenger__age', 'passenger__gender',
+        'train_seat__seat_number', 'train_segment__segment_number'
+    ).order_by('passenger_id'):
+        passenger_id, name, age, gender, seat_number, segment_number = row
+        passengers.setdefault(passenger_id, [name, age, gender, seat_number])
+        segment_numbers.append(segment_number)
+
+    return {
+        'v': TICKET_VERSION,
+        'b': booking.booking_id,
+        't': booking.train_id,
+        'r': booking.train.route.name,
+        'c': booking.seat_class.code,
+        'f': booking.actual_source_station.code,
+        'to': booking.actual_destination_station.code,
+        'dep': int(booking.actual_departure_time.timestamp()),
+        'exp': int(booking.actual_arrival_time.timestamp()) + TICKET_VALIDITY_AFTER_ARRIVAL_SECONDS,
+        'seg': [min(segment_numbers), max(segment_numbers)] if segment_numbers else [],
+        'fare': str(booking.total_fare),
+        'p': list(passengers.values()),
+    }
+
+
+def sign_ticket(payload):
+    body = _b64encode(json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode())
+    signature = _b64encode(get_signing_key().sign(body.encode('ascii')))
+    return f'{body}.{signature}'
+
+
+def verify_ticket_token(token, public_key_bytes=None, check_expiry=True):
+    """Return the payload of a correctly signed token, otherwise raise ValidationError."""
+    # Scanner uploads are JSON, so the token may be any JSON value
+    if not isinstance(token, str):
+        raise ValidationError('Invalid or tampered ticket')
+    try:
+        body, signature = token.strip().split('.')
+        public_key = Ed25519PublicKey.from_public_bytes(public_key_bytes or get_public_key_bytes())
+        public_key.verify(_b64decode(signature), body.encode('ascii'))
+        payload = json.loads(_b64decode(body))
+    except (ValueError, InvalidSignature, UnicodeError):
+        raise ValidationError('Invalid or tampered ticket')
+
+    if payload.get('v') != TICKET_VERSION:
+        raise ValidationError('Unsupported ticket version')
+    if check_expiry and payload.get('exp', 0) < timezone.now().timestamp():
+        raise ValidationError('Ticket has expired')
+    return payload
+
+
+def issue_ticket_token(booking):
+    return sign_ticket(build_ticket_payload(booking))
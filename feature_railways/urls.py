@@ -1,11 +1,18 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'feature_railways'
 
+# Search, availability and departure boards are served by async views under ASGI
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
+
 urlpatterns = [
     path('', views.index, name='index'),
-    path('search/', views.search_trains, name='search_trains'),
+    path('search/', read_views.search_trains, name='search_trains'),
+    path('trains/<int:train_id>/availability/', read_views.train_availability, name='train_availability'),
+    path('board/<str:station_code>/', read_views.station_board, name='station_board'),
+    path('board/<str:station_code>/data/', read_views.station_board_data, name='station_board_data'),
     
     # Booking Flow
     path('book/<int:train_id>/', views.book_train, name='book_train'),
@@ -30,6 +37,9 @@ urlpatterns = [
     path('staff/view-routes/', views.view_routes, name='view_routes'),
     path('staff/view-trains/', views.view_trains, name='view_trains'),
     path('staff/view-seat-classes/', views.view_seat_classes, name='view_seat_classes'),
+    path('staff/load-factor/', views.load_factor_report, name='load_factor_report'),
+    path('staff/trains/<int:train_id>/manifest/', views.train_manifest, name='train_manifest'),
+    path('staff/trains/<int:train_id>/manifest/download/', views.train_manifest_download, name='train_manifest_download'),
     
     # User Profile and QR Code URLs
     path('profile/', views.user_profile, name='user_profile'),
@@ -41,4 +51,6 @@ urlpatterns = [
     # QR Verification (Staff only)
     path('staff/qr-scanner/', views.qr_scanner, name='qr_scanner'),
     path('staff/verify-ticket/', views.verify_ticket, name='verify_ticket'),
+    path('staff/verify-tickets/batch/', views.verify_tickets_batch, name='verify_tickets_batch'),
+    path('staff/ticket-public-key/', views.ticket_public_key, name='ticket_public_key'),
 ]
\ No newline at end of file
@@ -1,32 +1,61 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 import json
 import base64
-import io
-import qrcode
 from decimal import Decimal
-from datetime import timedelta
-from .models import Station, Train, Route, SeatClass, RouteHalt, RouteSeatClass, TrainSegment, TrainSeat, Booking
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from core.dbrouter import replica_reads
+from .models import Station, Train, Route, SeatClass, RouteHalt, RouteSeatClass, TrainSegment, TrainSeat, SeatBooking, Booking, ArchivedBooking
 from .forms import (
     TrainSearchForm, BookingForm, StationForm, SeatClassForm, RouteForm,
-    RouteHaltForm, RouteSeatClassForm, TrainGenerationForm, PassengerDetailForm, PassengerFormSet, BookingConfirmationForm
+    RouteHaltForm, RouteSeatClassForm, TrainGenerationForm, PassengerDetailForm, PassengerFormSet, BookingConfirmationForm,
+    LoadFactorReportForm, TrainListFilterForm
 )
-from .services import generate_trains_on_route, get_train_generation_summary, get_segment_timing
-from .booking_services import BookingService
-from feature_transaction.services import WalletService
+from .services import (
+    STATION_BOARD_CACHE_TIMEOUT, STATION_BOARD_MAX_HOURS, generate_trains_on_route, get_segment_timing,
+    get_station_board, get_train_generation_summary
+)
+from . import reference
+from .booking_services import BOOKING_DETAIL_RELATED, BookingService, TicketScanService
+from .analytics import REPORT_COLUMNS, compute_load_factors, report_to_csv, report_to_json
+from .manifest import get_manifest_delta, get_manifest_version, get_train_manifest, manifest_to_csv
+from .pagination import keyset_paginate
+from .qr_images import QR_CONTENT_TYPES, get_qr_image, qr_content_hash
+from .rollups import get_daily_trend, get_dashboard_totals, get_reference_counts
+from .tickets import TICKET_VERSION, get_public_key_b64, verify_ticket_token
 
 def is_staff(user):
     return user.is_staff
 
+def _reference_or_404(record):
+    if record is None:
+        raise Http404('No such station or seat class')
+    return record
+
 def index(request):
     return render(request, 'feature_railways/index.html')
 
+def departing_trains(date, after):
+    """Trains leaving on `date` later than `after`, with what the results page shows of their route."""
+    day_start = timezone.make_aware(datetime.combine(date, time.min))
+    return Train.objects.filter(
+        departure_date_time__gte=day_start,
+        departure_date_time__lt=day_start + timedelta(days=1),
+        departure_date_time__gt=after
+    ).select_related(
+        'route',
+        'route__source_station',
+        'route__destination_station'
+    )
+
+@replica_reads
 def search_trains(request):
     form = TrainSearchForm(request.GET or None)
     trains = []
@@ -52,14 +81,7 @@ def search_trains(request):
 
         current_time = timezone.now()
         
-        date_trains = Train.objects.filter(
-            departure_date_time__date=date,
-            departure_date_time__gt=current_time
-        ).select_related(
-            'route',
-            'route__source_station',
-            'route__destination_station'
-        )
+        date_trains = departing_trains(date, current_time)
 
         direct_trains = date_trains.filter(
             route__source_station=source,
@@ -67,53 +89,43 @@ def search_trains(request):
         )
 
         halt_trains = []
+        other_trains = {train.id: train for train in date_trains.exclude(id__in=direct_trains.values_list('id', flat=True))}
 
-        for train in date_trains.exclude(id__in=direct_trains.values_list('id', flat=True)):
-            route = train.route
+        # Boarding and alighting segments for every candidate train in two indexed queries
+        departures = {
+            segment['train_id']: segment for segment in TrainSegment.objects.filter(
+                train_id__in=other_trains, segment_source=source
+            ).values('train_id', 'segment_number', 'departure_date_time')
+        }
+        arrivals = {
+            segment['train_id']: segment for segment in TrainSegment.objects.filter(
+                train_id__in=departures, segment_destination=destination
+            ).values('train_id', 'segment_number', 'arrival_date_time')
+        }
 
-            station_sequence = []
+        for train_id, arrival in arrivals.items():
+            departure = departures[train_id]
+            if departure['segment_number'] > arrival['segment_number']:
+                continue
+            train = other_trains[train_id]
+            if departure['departure_date_time'] is None or arrival['arrival_date_time'] is None:
+                timing = get_segment_timing(train, source, destination)
+                if not timing:
+                    continue
+                train.segment_departure = timing['segment_departure']
+                train.segment_arrival = timing['segment_arrival']
+            else:
+                train.segment_departure = departure['departure_date_time']
+                train.segment_arrival = arrival['arrival_date_time']
+            train.segment_duration = train.segment_arrival - train.segment_departure
 
-            station_sequence.append({
-                'station': route.source_station,
-                'sequence': 0,
-                'duration_from_start': timedelta(seconds=0)
-            })
+            if train.segment_departure <= current_time:
+                continue
 
-            for halt in RouteHalt.objects.filter(route=route).order_by('sequence_number'):
-                station_sequence.append({
-                    'station': halt.station,
-                    'sequence': halt.sequence_number,
-                    'duration_from_start': halt.journey_duration_from_source
-                })
-
-            station_sequence.append({
-                'station': route.destination_station,
-                'sequence': len(station_sequence),
-                'duration_from_start': route.journey_duration
-            })
+            train.journey_source = source
+            train.journey_destination = destination
 
-            source_in_sequence = None
-            destination_in_sequence = None
-
-            for station_item in station_sequence:
-                if station_item['station'] == source:
-                    source_in_sequence = station_item
-                if station_item['station'] == destination:
-                    destination_in_sequence = station_item
-
-            if source_in_sequence and destination_in_sequence:
-                if source_in_sequence['sequence'] < destination_in_sequence['sequence']:
-                    train.segment_departure = train.departure_date_time + source_in_sequence['duration_from_start']
-                    train.segment_arrival = train.departure_date_time + destination_in_sequence['duration_from_start']
-                    train.segment_duration = destination_in_sequence['duration_from_start'] - source_in_sequence['duration_from_start']
-                    
-                    if train.segment_departure <= current_time:
-                        continue
-                    
-                    train.journey_source = source
-                    train.journey_destination = destination
-                    
-                    halt_trains.append(train)
+            halt_trains.append(train)
 
         trains = list(direct_trains) + halt_trains
 
@@ -123,7 +135,7 @@ def search_trains(request):
             journey_source = source
             journey_destination = destination
             
-            available_seat_classes = RouteSeatClass.objects.filter(route=train.route).select_related('seat_class')
+            available_seat_classes = reference.get_route_seat_classes(train.route_id)
             seat_availability = {}
             
             for route_seat in available_seat_classes:
@@ -149,6 +161,48 @@ def search_trains(request):
         'current_time': timezone.now()
     })
 
+@replica_reads
+def station_board(request, station_code):
+    station = _reference_or_404(reference.get_station_by_code(station_code))
+    return render(request, 'feature_railways/station_board.html', {
+        'station': station,
+        'board': get_station_board(station),
+        'refresh_seconds': STATION_BOARD_CACHE_TIMEOUT,
+    })
+
+@replica_reads
+def station_board_data(request, station_code):
+    station = _reference_or_404(reference.get_station_by_code(station_code))
+    try:
+        hours = min(max(int(request.GET.get('hours', 3)), 1), STATION_BOARD_MAX_HOURS)
+    except ValueError:
+        return JsonResponse({'error': 'hours must be a number'}, status=400)
+    response = JsonResponse(get_station_board(station, hours))
+    # Let browsers and any proxy in front of the kiosks reuse the response for as long as it is cached here
+    response['Cache-Control'] = f'public, max-age={STATION_BOARD_CACHE_TIMEOUT}'
+    return response
+
+def parse_journey_ids(request):
+    """Optional ?source=&destination= station ids; raises ValueError for anything else."""
+    source_id = request.GET.get('source')
+    destination_id = request.GET.get('destination')
+    if not source_id and not destination_id:
+        return None, None
+    if not (source_id and destination_id):
+        raise ValueError('source and destination go together')
+    return int(source_id), int(destination_id)
+
+@replica_reads
+def train_availability(request, train_id):
+    train = get_object_or_404(Train, id=train_id)
+    try:
+        source_id, destination_id = parse_journey_ids(request)
+    except ValueError:
+        return JsonResponse({'error': 'source and destination must both be station ids'}, status=400)
+    journey_source = _reference_or_404(reference.get_station(source_id)) if source_id else None
+    journey_destination = _reference_or_404(reference.get_station(destination_id)) if destination_id else None
+    return JsonResponse(BookingService.get_train_availability(train, journey_source, journey_destination))
+
 @login_required
 def book_train(request, train_id, source_id=None, destination_id=None):
     train = get_object_or_404(Train, id=train_id)
@@ -165,8 +219,8 @@ def book_train(request, train_id, source_id=None, destination_id=None):
     segment_arrival = None
     
     if source_id and destination_id:
-        journey_source = get_object_or_404(Station, id=source_id)
-        journey_destination = get_object_or_404(Station, id=destination_id)
+        journey_source = _reference_or_404(reference.get_station(source_id))
+        journey_destination = _reference_or_404(reference.get_station(destination_id))
         
         timing = get_segment_timing(train, journey_source, journey_destination)
         if timing:
@@ -179,7 +233,7 @@ def book_train(request, train_id, source_id=None, destination_id=None):
                 return redirect('feature_railways:search_trains')
 
     seat_availability = {}
-    available_seat_classes = RouteSeatClass.objects.filter(route=train.route).select_related('seat_class')
+    available_seat_classes = reference.get_route_seat_classes(train.route_id)
     
     for route_seat in available_seat_classes:
         availability = BookingService.check_seat_availability(
@@ -272,7 +326,7 @@ def passenger_details(request):
             del request.session['booking_details']
         return redirect('feature_railways:search_trains')
     
-    seat_class = get_object_or_404(SeatClass, id=booking_details['seat_class_id'])
+    seat_class = _reference_or_404(reference.get_seat_class(booking_details['seat_class_id']))
     passenger_count = booking_details['passenger_count']
     
     journey_source = None
@@ -282,8 +336,8 @@ def passenger_details(request):
     segment_arrival = None
     
     if booking_details and 'journey_source_id' in booking_details and 'journey_destination_id' in booking_details:
-        journey_source = get_object_or_404(Station, id=booking_details['journey_source_id'])
-        journey_destination = get_object_or_404(Station, id=booking_details['journey_destination_id'])
+        journey_source = _reference_or_404(reference.get_station(booking_details['journey_source_id']))
+        journey_destination = _reference_or_404(reference.get_station(booking_details['journey_destination_id']))
         
         timing = get_segment_timing(train, journey_source, journey_destination)
         if timing:
@@ -356,7 +410,7 @@ def booking_confirmation(request):
             del request.session['passengers_data']
         return redirect('feature_railways:search_trains')
     
-    seat_class = get_object_or_404(SeatClass, id=booking_details['seat_class_id'])
+    seat_class = _reference_or_404(reference.get_seat_class(booking_details['seat_class_id']))
     
     journey_source = None
     journey_destination = None
@@ -365,8 +419,8 @@ def booking_confirmation(request):
     segment_arrival = None
     
     if 'journey_source_id' in booking_details and 'journey_destination_id' in booking_details:
-        journey_source = get_object_or_404(Station, id=booking_details['journey_source_id'])
-        journey_destination = get_object_or_404(Station, id=booking_details['journey_destination_id'])
+        journey_source = _reference_or_404(reference.get_station(booking_details['journey_source_id']))
+        journey_destination = _reference_or_404(reference.get_station(booking_details['journey_destination_id']))
         
         timing = get_segment_timing(train, journey_source, journey_destination)
         if timing:
@@ -426,7 +480,7 @@ def booking_confirmation(request):
                     messages.error(request, f"Failed to send OTP: {otp_result['message']}")
             else:
                 from feature_transaction.services import OTPService
-                otp_verify_result = OTPService.verify_otp(request.user, otp_code_submitted, 'PAYMENT')
+                otp_verify_result = OTPService.verify_otp(request.user.pk, otp_code_submitted, 'PAYMENT', persist=False)
                 
                 if otp_verify_result['success']:
                     result = BookingService.create_booking(
@@ -475,7 +529,7 @@ def booking_confirmation(request):
 
 @login_required
 def booking_success(request, booking_id):
-    booking = get_object_or_404(Booking, booking_id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.select_related(*BOOKING_DETAIL_RELATED), booking_id=booking_id, user=request.user)
     booking_summary = BookingService.get_booking_summary(booking)
     return render(request, 'feature_railways/booking_success.html', {
         'booking_summary': booking_summary
@@ -484,19 +538,10 @@ def booking_success(request, booking_id):
 @login_required
 @user_passes_test(is_staff)
 def railway_staff_dashboard(request):
-    total_stations = Station.objects.count()
-    total_routes = Route.objects.count()
-    total_trains = Train.objects.count()
-    total_bookings = Booking.objects.count()
-    confirmed_bookings = Booking.objects.filter(booking_status='CONFIRMED').count()
-    total_revenue = Booking.objects.filter(booking_status='CONFIRMED').aggregate(total=Sum('total_fare'))['total'] or 0
     context = {
-        'total_stations': total_stations,
-        'total_routes': total_routes,
-        'total_trains': total_trains,
-        'total_bookings': total_bookings,
-        'confirmed_bookings': confirmed_bookings,
-        'total_revenue': total_revenue,
+        **get_reference_counts(),
+        **get_dashboard_totals(),
+        'daily_trend': get_daily_trend(),
     }
     return render(request, 'feature_railways/railway_staff_dashboard.html', context)
 
@@ -615,58 +660,167 @@ def generate_trains(request):
 @login_required
 @user_passes_test(is_staff)
 def view_stations(request):
-    stations = Station.objects.all()
-    return render(request, 'feature_railways/view_stations.html', {'stations': stations})
+    stations = Station.objects.annotate(
+        route_count=Coalesce(Subquery(
+            RouteHalt.objects.filter(station=OuterRef('pk')).values('station').annotate(count=Count('id')).values('count')
+        ), 0)
+    )
+    query = request.GET.get('q', '').strip()
+    if query:
+        stations = stations.filter(Q(code__icontains=query) | Q(name__icontains=query))
+    page = keyset_paginate(request, stations, ['code', 'id'])
+    return render(request, 'feature_railways/view_stations.html', {'stations': page['items'], 'page': page, 'query': query})
 
 @login_required
 @user_passes_test(is_staff)
 def view_routes(request):
-    routes = Route.objects.all()
-    return render(request, 'feature_railways/view_routes.html', {'routes': routes})
+    routes = Route.objects.select_related('source_station', 'destination_station').annotate(
+        halt_count=Coalesce(Subquery(
+            RouteHalt.objects.filter(route=OuterRef('pk')).values('route').annotate(count=Count('id')).values('count')
+        ), 0),
+        upcoming_train_count=Coalesce(Subquery(
+            Train.objects.filter(route=OuterRef('pk'), departure_date_time__gt=timezone.now())
+            .values('route').annotate(count=Count('id')).values('count')
+        ), 0)
+    )
+    query = request.GET.get('q', '').strip()
+    if query:
+        routes = routes.filter(Q(code__icontains=query) | Q(name__icontains=query))
+    page = keyset_paginate(request, routes, ['code', 'id'])
+    return render(request, 'feature_railways/view_routes.html', {'routes': page['items'], 'page': page, 'query': query})
 
 @login_required
 @user_passes_test(is_staff)
 def view_trains(request):
-    trains = Train.objects.all()
+    now = timezone.now()
+    trains = Train.objects.select_related('route__source_station', 'route__destination_station').annotate(
+        total_seats=Coalesce(Subquery(
+            TrainSeat.objects.filter(train=OuterRef('pk')).values('train').annotate(count=Count('id')).values('count')
+        ), 0),
+        booked_seats=Coalesce(Subquery(
+            SeatBooking.objects.filter(train=OuterRef('pk')).values('train')
+            .annotate(count=Count('train_seat', distinct=True)).values('count')
+        ), 0)
+    )
+
+    filter_form = TrainListFilterForm(request.GET or None)
+    if filter_form.is_valid():
+        filters = filter_form.cleaned_data
+        if filters['route']:
+            trains = trains.filter(route=filters['route'])
+        # Compare against day boundaries rather than __date so the departure index can be used
+        if filters['start_date']:
+            trains = trains.filter(departure_date_time__gte=timezone.make_aware(datetime.combine(filters['start_date'], time.min)))
+        if filters['end_date']:
+            trains = trains.filter(departure_date_time__lt=timezone.make_aware(datetime.combine(filters['end_date'] + timedelta(days=1), time.min)))
+        if filters['status'] == 'upcoming':
+            trains = trains.filter(departure_date_time__gt=now)
+        elif filters['status'] == 'departed':
+            trains = trains.filter(departure_date_time__lte=now)
+
+    page = keyset_paginate(request, trains, ['departure_date_time', 'id'])
     context = {
-        'trains': trains,
-        'now': timezone.now()
+        'trains': page['items'],
+        'page': page,
+        'filter_form': filter_form,
+        'now': now
     }
     return render(request, 'feature_railways/view_trains.html', context)
 
 @login_required
 @user_passes_test(is_staff)
 def view_seat_classes(request):
-    seat_classes = SeatClass.objects.all()
-    return render(request, 'feature_railways/view_seat_classes.html', {'seat_classes': seat_classes})
+    seat_classes = SeatClass.objects.annotate(
+        route_count=Coalesce(Subquery(
+            RouteSeatClass.objects.filter(seat_class=OuterRef('pk')).values('seat_class').annotate(count=Count('id')).values('count')
+        ), 0)
+    )
+    query = request.GET.get('q', '').strip()
+    if query:
+        seat_classes = seat_classes.filter(Q(code__icontains=query) | Q(class_type__icontains=query))
+    page = keyset_paginate(request, seat_classes, ['code', 'id'])
+    return render(request, 'feature_railways/view_seat_classes.html', {'seat_classes': page['items'], 'page': page, 'query': query})
 
 @login_required
-def user_profile(request):
-    user_bookings = Booking.objects.filter(user=request.user).order_by('-booking_date')
+@user_passes_test(is_staff)
+@replica_reads
+def load_factor_report(request):
+    today = timezone.localdate()
+    form = LoadFactorReportForm(request.GET or {'start_date': today - timedelta(days=29), 'end_date': today})
+    report = None
+    if form.is_valid():
+        report = compute_load_factors(form.cleaned_data['start_date'], form.cleaned_data['end_date'])
+        export_format = request.GET.get('format')
+        if export_format == 'json':
+            return JsonResponse(report_to_json(report))
+        if export_format == 'csv':
+            section = request.GET.get('section', 'by_segment')
+            if section not in REPORT_COLUMNS:
+                return JsonResponse({'error': 'Unknown report section'}, status=400)
+            response = HttpResponse(report_to_csv(report, section), content_type='text/csv')
+            response['Content-Disposition'] = (
+                f'attachment; filename="load_factor_{section}_{report["start_date"]}_{report["end_date"]}.csv"'
+            )
+            return response
+    elif request.GET.get('format'):
+        return JsonResponse({'error': 'Invalid date range', 'details': form.errors}, status=400)
+    return render(request, 'feature_railways/load_factor_report.html', {
+        'form': form,
+        'report': report,
+        'export_query': f"start_date={report['start_date']}&end_date={report['end_date']}" if report else '',
+    })
 
-    
-    wallet_info = WalletService.get_wallet_balance(request.user)
-    recent_transactions = WalletService.get_transaction_history(
-        user=request.user,
-        limit=5
-    )
-    
-    context = {
-        'user_bookings': user_bookings,
-        'total_bookings': user_bookings.count(),
-        'confirmed_bookings': user_bookings.filter(booking_status='CONFIRMED').count(),
-        'verified_bookings': user_bookings.filter(is_verified=True).count(),
-        'wallet': wallet_info.get('wallet'),
-        'wallet_balance': wallet_info.get('balance'),
-        'recent_transactions': recent_transactions.get('transactions', []),
-    }
-    
+@login_required
+@user_passes_test(is_staff)
+def train_manifest(request, train_id):
+    train = get_object_or_404(Train.objects.select_related('route'), id=train_id)
+    manifest = get_train_manifest(train)
+    return render(request, 'feature_railways/train_manifest.html', {
+        'train': train,
+        'manifest': manifest,
+        'entries': [dict(zip(manifest['fields'], entry)) for entry in manifest['entries']],
+    })
+
+@login_required
+@user_passes_test(is_staff)
+def train_manifest_download(request, train_id):
+    """Compact manifest for scanners: ?format=csv, or JSON with ?since=<version> for a delta."""
+    train = get_object_or_404(Train, id=train_id)
+    version = get_manifest_version(train.id)
+    etag = f'"{train.id}-{version}-{request.GET.urlencode()}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304)
+
+    if request.GET.get('format') == 'csv':
+        manifest = get_train_manifest(train)
+        response = HttpResponse(manifest_to_csv(manifest), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="train_{train.id}_manifest_v{manifest["version"]}.csv"'
+    else:
+        delta = None
+        since = request.GET.get('since')
+        if since and since.isdigit():
+            delta = get_manifest_delta(train, int(since))
+        if delta is not None:
+            response = JsonResponse(dict(delta, full=False))
+        else:
+            response = JsonResponse(dict(get_train_manifest(train), full=True))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+@replica_reads
+def user_profile(request):
+    context = BookingService.get_profile_summary(request.user)
     return render(request, 'feature_railways/user_profile.html', context)
 
 @login_required
 def booking_detail(request, booking_id):
-    booking = get_object_or_404(Booking, booking_id=booking_id, user=request.user)
-    from .booking_services import BookingService
+    booking = Booking.objects.select_related('payment_transaction', *BOOKING_DETAIL_RELATED).filter(
+        booking_id=booking_id, user=request.user
+    ).first()
+    if booking is None:
+        return archived_booking_detail(request, booking_id)
     booking_summary = BookingService.get_booking_summary(booking)
     
     show_cancel_button = False
@@ -679,12 +833,32 @@ def booking_detail(request, booking_id):
         'booking': booking,
         'booking_summary': booking_summary,
         'qr_data': booking.get_qr_data(),
+        'payment_transaction': booking.payment_transaction,
         'show_cancel_button': show_cancel_button,
         'current_time': timezone.now(),
         'is_segment_booking': booking.journey_source is not None and booking.journey_destination is not None,
     }
     return render(request, 'feature_railways/booking_detail.html', context)
 
+def archived_booking_detail(request, booking_id):
+    booking = get_object_or_404(
+        ArchivedBooking.objects.select_related(
+            'payment_transaction', 'route__source_station', 'route__destination_station',
+            'journey_source', 'journey_destination', 'seat_class'
+        ),
+        booking_id=booking_id, user=request.user
+    )
+    context = {
+        'booking': booking,
+        'booking_summary': BookingService.get_archived_booking_summary(booking),
+        'qr_data': None,
+        'payment_transaction': booking.payment_transaction,
+        'show_cancel_button': False,
+        'current_time': timezone.now(),
+        'is_segment_booking': booking.is_segment_booking,
+    }
+    return render(request, 'feature_railways/booking_detail.html', context)
+
 @login_required
 def generate_qr_code(request, booking_id):
     booking = get_object_or_404(Booking, booking_id=booking_id, user=request.user)
@@ -693,20 +867,16 @@ def generate_qr_code(request, booking_id):
     qr_data = booking.get_qr_data()
     if not qr_data:
         return JsonResponse({'error': 'QR code data not available'}, status=400)
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(json.dumps(qr_data))
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, 'PNG')
-    buffer.seek(0)
-    response = HttpResponse(buffer.getvalue(), content_type='image/png')
-    response['Content-Disposition'] = f'inline; filename="{booking_id}_qr.png"'
+    image_format = 'svg' if request.GET.get('format') == 'svg' else 'png'
+    # The token never changes once issued, so its hash identifies the image
+    etag = f'"{qr_content_hash(qr_data)}-{image_format}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(get_qr_image(booking_id, qr_data, image_format), content_type=QR_CONTENT_TYPES[image_format])
+        response['Content-Disposition'] = f'inline; filename="{booking_id}_qr.{image_format}"'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
     return response
 
 @login_required
@@ -714,6 +884,15 @@ def generate_qr_code(request, booking_id):
 def qr_scanner(request):
     return render(request, 'feature_railways/qr_scanner.html')
 
+@login_required
+@user_passes_test(is_staff)
+def ticket_public_key(request):
+    return JsonResponse({
+        'algorithm': 'Ed25519',
+        'version': TICKET_VERSION,
+        'public_key': get_public_key_b64(),
+    })
+
 @login_required
 @user_passes_test(is_staff) 
 def verify_ticket(request):
@@ -721,75 +900,94 @@ def verify_ticket(request):
         return JsonResponse({'error': 'POST method required'}, status=405)
     try:
         data = json.loads(request.body)
-        qr_data_str = data.get('qr_data')
-        if not qr_data_str:
+        ticket_token = data.get('qr_data')
+        if not ticket_token:
             return JsonResponse({'error': 'QR data is required'}, status=400)
-        qr_data = json.loads(qr_data_str)
-        booking_id = qr_data.get('booking_id')
-        verification_hash = qr_data.get('verification_hash')
-        if not booking_id or not verification_hash:
-            return JsonResponse({'error': 'Invalid QR code format'}, status=400)
         try:
-            booking = Booking.objects.get(booking_id=booking_id)
-        except Booking.DoesNotExist:
-            return JsonResponse({'error': 'Booking not found'}, status=404)
-        stored_qr_data = booking.get_qr_data()
-        if not stored_qr_data or stored_qr_data.get('verification_hash') != verification_hash:
-            return JsonResponse({'error': 'Invalid or tampered QR code'}, status=400)
-        if booking.booking_status != 'CONFIRMED':
-            return JsonResponse({
-                'error': f'Booking status is {booking.booking_status}, not confirmed',
-                'booking_status': booking.booking_status
-            }, status=400)
-        was_already_verified = booking.is_verified
-        first_verification_time = booking.verification_timestamp
-        if not booking.is_verified:
-            booking.verify_booking()
+            ticket = verify_ticket_token(ticket_token)
+        except ValidationError as e:
+            return JsonResponse({'error': e.messages[0]}, status=400)
+        booking_id = ticket['b']
+
+        # The signature already proves the ticket is genuine; the database is only
+        # needed to record the scan and to catch cancellations
+        verification_time = timezone.now()
+        newly_verified = Booking.objects.filter(
+            booking_id=booking_id,
+            booking_status='CONFIRMED',
+            is_verified=False
+        ).update(is_verified=True, verification_timestamp=verification_time)
+
+        if newly_verified:
+            first_verification_time = verification_time
             verification_status = 'NEWLY_VERIFIED'
             status_message = 'Ticket successfully verified!'
         else:
+            current = Booking.objects.filter(booking_id=booking_id).values(
+                'booking_status', 'verification_timestamp'
+            ).first()
+            if not current:
+                return JsonResponse({'error': 'Booking not found'}, status=404)
+            if current['booking_status'] != 'CONFIRMED':
+                return JsonResponse({
+                    'error': f"Booking status is {current['booking_status']}, not confirmed",
+                    'booking_status': current['booking_status']
+                }, status=400)
+            first_verification_time = current['verification_timestamp']
             verification_status = 'ALREADY_VERIFIED'
-            status_message = f'Ticket was already verified on {first_verification_time.strftime("%B %d, %Y at %I:%M %p")}'
-        booking_summary = BookingService.get_booking_summary(booking)
+            status_message = f'Ticket was already verified on {timezone.localtime(first_verification_time).strftime("%B %d, %Y at %I:%M %p")}'
+
+        departure_time = timezone.localtime(datetime.fromtimestamp(ticket['dep'], tz=dt_timezone.utc))
         response_data = {
             'success': True,
             'verification_status': verification_status,
             'status_message': status_message,
-            'booking_id': booking.booking_id,
-            'passenger_count': booking.passenger_count,
-            'train_id': booking.train.id,
-            'route_name': booking.train.route.name,
-            'departure_time': booking.train.departure_date_time.strftime('%Y-%m-%d %H:%M'),
-            'seat_class': booking.seat_class.class_type,
-            'total_fare': str(booking.total_fare),
-            'is_verified': booking.is_verified,
-            'verification_timestamp': booking.verification_timestamp.strftime('%Y-%m-%d %H:%M:%S') if booking.verification_timestamp else None,
-            'first_verification_time': first_verification_time.strftime('%Y-%m-%d %H:%M:%S') if first_verification_time else None,
-            'was_already_verified': was_already_verified,
-            'passenger_details': []
+            'booking_id': booking_id,
+            'passenger_count': len(ticket['p']),
+            'train_id': ticket['t'],
+            'route_name': ticket['r'],
+            'journey': f"{ticket['f']} → {ticket['to']}",
+            'departure_time': departure_time.strftime('%Y-%m-%d %H:%M'),
+            'seat_class': ticket['c'],
+            'total_fare': ticket['fare'],
+            'is_verified': True,
+            'verification_timestamp': first_verification_time.isoformat(),
+            'first_verification_time': first_verification_time.isoformat(),
+            'was_already_verified': not newly_verified,
+            'passenger_details': [
+                {'name': name, 'age': age, 'gender': gender, 'seat_number': seat_number}
+                for name, age, gender, seat_number in ticket['p']
+            ]
         }
-        if booking_summary and not booking_summary.get('error'):
-            seat_assignments = booking_summary.get('seat_assignments', [])
-            for assignment in seat_assignments:
-                if isinstance(assignment, dict):
-                    passenger = assignment.get('passenger')
-                    seat_number = assignment.get('seat_number', 'N/A')
-                else:
-                    passenger = None
-                    seat_number = 'N/A'
-                
-                response_data['passenger_details'].append({
-                    'name': passenger.name if passenger else 'N/A',
-                    'age': passenger.age if passenger else 'N/A',
-                    'gender': passenger.gender if passenger else 'N/A',
-                    'seat_number': seat_number
-                })
         return JsonResponse(response_data)
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
     except Exception as e:
         return JsonResponse({'error': f'Verification failed: {str(e)}'}, status=500)
 
+@login_required
+@user_passes_test(is_staff)
+def verify_tickets_batch(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    scans = data.get('scans') if isinstance(data, dict) else None
+    if not isinstance(scans, list):
+        return JsonResponse({'error': 'A list of scans is required'}, status=400)
+
+    result = TicketScanService.verify_batch(scans)
+    if not result['success']:
+        status = 400 if result['error'] == 'Batch too large' else 500
+        return JsonResponse({'error': result['message']}, status=status)
+    return JsonResponse({
+        'success': True,
+        'verified': result['verified'],
+        'results': result['results'],
+    })
+
 @login_required
 def booking_qr_view(request, booking_id):
     booking = get_object_or_404(Booking, booking_id=booking_id, user=request.user)
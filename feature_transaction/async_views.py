@@ -0,0 +1,17 @@
+"""Async version of the wallet balance endpoint, served when ASYNC_READ_VIEWS is on."""
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from .services import WalletService
+
+
+@login_required
+async def wallet_api_balance(request):
+    """API endpoint to get wallet balance"""
+    wallet_info = await WalletService.aget_wallet_balance(await request.auser())
+
+    return JsonResponse({
+        'success': wallet_info['success'],
+        'balance': str(wallet_info['balance']),
+        'formatted_balance': f"₹{wallet_info['balance']}"
+    })
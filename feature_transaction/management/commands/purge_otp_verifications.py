@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from feature_transaction.models import OTPVerification
+
+
+class Command(BaseCommand):
+    help = 'Delete OTPVerification rows that are used up or expired and not linked to any transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        purgeable = OTPVerification.objects.filter(
+            Q(is_verified=True) | Q(expires_at__lt=timezone.now()),
+            transaction__isnull=True
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'{purgeable.count()} OTP rows would be deleted')
+            return
+
+        total_deleted = 0
+        while True:
+            batch_ids = list(purgeable.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not batch_ids:
+                break
+            deleted, _ = OTPVerification.objects.filter(id__in=batch_ids).delete()
+            total_deleted += deleted
+            self.stdout.write(f'Deleted {total_deleted} OTP rows so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {total_deleted} OTP rows'))
@@ -140,6 +140,7 @@ class Transaction(models.Model):
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['transaction_type', 'purpose']),
+            models.Index(fields=['booking_id']),
         ]
     
     def __str__(self):
@@ -0,0 +1,237 @@
+import hmac
+import random
+import string
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OTPVerification
+
+
+def get_otp_backend():
+    backend_path = getattr(settings, 'OTP_BACKEND', 'feature_transaction.otp_backends.CacheOTPBackend')
+    return import_string(backend_path)()
+
+
+class BaseOTPBackend(ABC):
+    """
+    Issues and verifies OTPs. `persist=True` on verify means the caller is going to
+    link the OTP to a Transaction, so a verified OTPVerification row must be returned.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = getattr(settings, 'OTP_TTL_SECONDS', 300)
+
+    @staticmethod
+    def generate_otp():
+        return ''.join(random.choices(string.digits, k=6))
+
+    @abstractmethod
+    def send(self, user, purpose, phone_number):
+        pass
+
+    @abstractmethod
+    def verify(self, user_id, otp_code, purpose, persist=True):
+        pass
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """Stores every issued OTP as an OTPVerification row (original behaviour)."""
+
+    def send(self, user, purpose, phone_number):
+        otp_code = self.generate_otp()
+        otp_verification = OTPVerification.objects.create(
+            user=user,
+            otp_code=otp_code,
+            purpose=purpose,
+            phone_number=phone_number,
+            expires_at=timezone.now() + timezone.timedelta(seconds=self.ttl_seconds)
+        )
+        return {
+            'success': True,
+            'otp_verification': otp_verification,
+            'otp_code': otp_code,
+            'message': f'OTP sent to {phone_number}'
+        }
+
+    def verify(self, user_id, otp_code, purpose, persist=True):
+        otp_verification = OTPVerification.objects.filter(
+            user_id=user_id,
+            otp_code=otp_code,
+            purpose=purpose,
+            is_verified=False
+        ).first()
+
+        if not otp_verification:
+            return {
+                'success': False,
+                'error': 'Invalid OTP',
+                'message': 'Invalid or expired OTP'
+            }
+
+        if otp_verification.is_expired():
+            return {
+                'success': False,
+                'error': 'OTP expired',
+                'message': 'OTP has expired. Please request a new one.'
+            }
+
+        if otp_verification.verify():
+            return {
+                'success': True,
+                'otp_verification': otp_verification,
+                'message': 'OTP verified successfully'
+            }
+        return {
+            'success': False,
+            'error': 'Verification failed',
+            'message': 'Failed to verify OTP'
+        }
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    """
+    Keeps the pending OTP for each (user, purpose) in the cache with a native TTL.
+    Resending replaces the pending OTP, wrong guesses are counted across resends for
+    the send limit window, and only an OTP that is verified with `persist=True` is
+    written to the database.
+
+    Attempts and sends are counted with cache.add() and cache.incr(), so the limits
+    only hold under concurrent requests with a cache where those are atomic across
+    processes: Redis, Memcached, or core.cache.InstrumentedFileBasedCache, which
+    locks them. Django's own FileBasedCache does not.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.max_attempts = getattr(settings, 'OTP_MAX_ATTEMPTS', 5)
+        self.send_limit = getattr(settings, 'OTP_SEND_RATE_LIMIT', 5)
+        self.send_window_seconds = getattr(settings, 'OTP_SEND_RATE_WINDOW', 600)
+
+    @staticmethod
+    def _otp_key(user_id, purpose):
+        return f'otp:{user_id}:{purpose}'
+
+    @staticmethod
+    def _attempts_key(user_id, purpose):
+        return f'otp-attempts:{user_id}:{purpose}'
+
+    @staticmethod
+    def _rate_key(user_id):
+        return f'otp-rate:{user_id}'
+
+    @staticmethod
+    def _count(key, timeout):
+        """Add one to a counter that expires after `timeout` seconds and return the new count."""
+        cache.add(key, 0, timeout)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, timeout)
+            return 1
+
+    def _allow_send(self, user):
+        return self._count(self._rate_key(user.pk), self.send_window_seconds) <= self.send_limit
+
+    def send(self, user, purpose, phone_number):
+        if (cache.get(self._attempts_key(user.pk, purpose)) or 0) >= self.max_attempts:
+            return {
+                'success': False,
+                'error': 'Too many attempts',
+                'message': 'Too many incorrect attempts. Please try again later.'
+            }
+        if not self._allow_send(user):
+            return {
+                'success': False,
+                'error': 'Rate limited',
+                'message': 'Too many OTP requests. Please try again later.'
+            }
+
+        otp_code = self.generate_otp()
+        expires_at = timezone.now() + timezone.timedelta(seconds=self.ttl_seconds)
+        cache.set(self._otp_key(user.pk, purpose), {
+            'otp_code': otp_code,
+            'phone_number': phone_number,
+            'expires_at': expires_at,
+        }, self.ttl_seconds)
+        # Resending keeps the wrong guesses made so far; the count lasts as long as the send limit window
+        cache.add(self._attempts_key(user.pk, purpose), 0, self.send_window_seconds)
+
+        return {
+            'success': True,
+            'otp_code': otp_code,
+            'message': f'OTP sent to {phone_number}'
+        }
+
+    def verify(self, user_id, otp_code, purpose, persist=True):
+        key = self._otp_key(user_id, purpose)
+        pending = cache.get(key)
+
+        if not pending:
+            return {
+                'success': False,
+                'error': 'Invalid OTP',
+                'message': 'Invalid or expired OTP'
+            }
+
+        now = timezone.now()
+        remaining = int((pending['expires_at'] - now).total_seconds())
+        if remaining <= 0:
+            cache.delete(key)
+            return {
+                'success': False,
+                'error': 'OTP expired',
+                'message': 'OTP has expired. Please request a new one.'
+            }
+
+        # Every guess is counted before it is checked, so guesses sent in parallel
+        # can't all be checked against the same count
+        attempts_key = self._attempts_key(user_id, purpose)
+        attempts = self._count(attempts_key, self.send_window_seconds)
+        correct = attempts <= self.max_attempts and hmac.compare_digest(pending['otp_code'], str(otp_code or ''))
+        if not correct and attempts >= self.max_attempts:
+            # The counter is left to expire; deleting it would give guesses already in flight a fresh count
+            cache.delete(key)
+            return {
+                'success': False,
+                'error': 'Too many attempts',
+                'message': 'Too many incorrect attempts. Please try again later.'
+            }
+        if not correct:
+            return {
+                'success': False,
+                'error': 'Invalid OTP',
+                'message': 'Invalid or expired OTP'
+            }
+
+        # delete() reports whether the key was still there, so two concurrent
+        # requests cannot both consume the same OTP
+        if not cache.delete(key):
+            return {
+                'success': False,
+                'error': 'Invalid OTP',
+                'message': 'Invalid or expired OTP'
+            }
+        cache.delete(attempts_key)
+
+        otp_verification = None
+        if persist:
+            otp_verification = OTPVerification.objects.create(
+                user_id=user_id,
+                otp_code=pending['otp_code'],
+                purpose=purpose,
+                phone_number=pending['phone_number'],
+                is_verified=True,
+                verified_at=now,
+                expires_at=pending['expires_at']
+            )
+
+        return {
+            'success': True,
+            'otp_verification': otp_verification,
+            'message': 'OTP verified successfully'
+        }
@@ -2,17 +2,18 @@ from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from decimal import Decimal
-import random
-import string
 
+from core.querytags import tag_service_methods
 from .models import Wallet, Transaction, OTPVerification
+from .otp_backends import BaseOTPBackend, get_otp_backend
 
 
+@tag_service_methods
 class WalletService:
 
     @staticmethod
     @transaction.atomic
-    def credit_wallet(user, amount, purpose='TOPUP', description='', otp_verification=None):
+    def credit_wallet(user, amount, purpose='TOPUP', description='', otp_verification=None, booking_id=''):
         try:
             wallet = Wallet.objects.select_for_update().get(user=user)
             
@@ -24,6 +25,7 @@ class WalletService:
                 transaction_type='CREDIT',
                 purpose=purpose,
                 description=description,
+                booking_id=booking_id or '',
                 wallet_balance_before=balance_before,
                 otp_verification=otp_verification,
                 status='PROCESSING'
@@ -111,6 +113,21 @@ class WalletService:
                 'balance': Decimal('0.00')
             }
     
+    @staticmethod
+    async def aget_wallet_balance(user):
+        wallet = await Wallet.objects.filter(user=user).afirst()
+        if wallet is None:
+            return {
+                'success': False,
+                'error': 'Wallet not found',
+                'balance': Decimal('0.00')
+            }
+        return {
+            'success': True,
+            'balance': wallet.balance,
+            'wallet': wallet
+        }
+    
     @staticmethod
     def get_transaction_history(user, limit=10):
         try:
@@ -131,10 +148,11 @@ class WalletService:
             }
 
 
+@tag_service_methods
 class OTPService:
     @staticmethod
     def generate_otp():
-        return ''.join(random.choices(string.digits, k=6))
+        return BaseOTPBackend.generate_otp()
     
     @staticmethod
     def send_otp(user, purpose, phone_number=None):
@@ -143,26 +161,10 @@ class OTPService:
             if not phone_number:
                 phone_number = getattr(user, 'phone_number', '') or '1234567890'
             
-            otp_code = OTPService.generate_otp()
-            
-            expires_at = timezone.now() + timezone.timedelta(minutes=5)
-            
-            otp_verification = OTPVerification.objects.create(
-                user=user,
-                otp_code=otp_code,
-                purpose=purpose,
-                phone_number=phone_number,
-                expires_at=expires_at
-            )
-            
             # TODO add sms service (have to learn this for other project)
 
-            return {
-                'success': True,
-                'otp_verification': otp_verification,
-                'otp_code': otp_code,  # TODO Remove this in production
-                'message': f'OTP sent to {phone_number}'
-            }
+            # otp_code is still returned to callers for testing; TODO Remove this in production
+            return get_otp_backend().send(user, purpose, phone_number)
             
         except Exception as e:
             return {
@@ -172,42 +174,14 @@ class OTPService:
             }
     
     @staticmethod
-    def verify_otp(user, otp_code, purpose):
-
+    def verify_otp(user_id, otp_code, purpose, persist=True):
+        """
+        Takes the user's id so callers holding only a row with user_id need no user query.
+        Pass persist=False when the OTP will not be linked to a Transaction,
+        so the cache backend does not write a row for it.
+        """
         try:
-            otp_verification = OTPVerification.objects.filter(
-                user=user,
-                otp_code=otp_code,
-                purpose=purpose,
-                is_verified=False
-            ).first()
-            
-            if not otp_verification:
-                return {
-                    'success': False,
-                    'error': 'Invalid OTP',
-                    'message': 'Invalid or expired OTP'
-                }
-            
-            if otp_verification.is_expired():
-                return {
-                    'success': False,
-                    'error': 'OTP expired',
-                    'message': 'OTP has expired. Please request a new one.'
-                }
-            
-            if otp_verification.verify():
-                return {
-                    'success': True,
-                    'otp_verification': otp_verification,
-                    'message': 'OTP verified successfully'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'Verification failed',
-                    'message': 'Failed to verify OTP'
-                }
+            return get_otp_backend().verify(user_id, otp_code, purpose, persist=persist)
                 
         except Exception as e:
             return {
@@ -217,12 +191,13 @@ class OTPService:
             }
 
 
+@tag_service_methods
 class TransactionService:
 
     @staticmethod
     def process_wallet_topup(user, amount, otp_code):
         try:
-            otp_result = OTPService.verify_otp(user, otp_code, 'WALLET_TOPUP')
+            otp_result = OTPService.verify_otp(user.pk, otp_code, 'WALLET_TOPUP')
             if not otp_result['success']:
                 return otp_result
             
@@ -246,7 +221,7 @@ class TransactionService:
     @staticmethod
     def process_payment(user, amount, description, otp_code):
         try:
-            otp_result = OTPService.verify_otp(user, otp_code, 'PAYMENT')
+            otp_result = OTPService.verify_otp(user.pk, otp_code, 'PAYMENT')
             
             if not otp_result['success']:
                 return otp_result
@@ -275,14 +250,10 @@ class TransactionService:
                 user=user,
                 amount=amount,
                 purpose='REFUND',
-                description=description
+                description=description,
+                booking_id=booking_id
             )
             
-            if result['success'] and booking_id and 'transaction' in result:
-                transaction = result['transaction']
-                transaction.booking_id = booking_id
-                transaction.save()
-            
             return result
             
         except Exception as e:
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'feature_transaction'
 
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
+
 urlpatterns = [
     # Main wallet views
     path('', views.wallet_dashboard, name='wallet_dashboard'),
@@ -14,7 +17,7 @@ urlpatterns = [
     path('payment-success/<str:transaction_id>/', views.payment_success, name='payment_success'),
     
     # API endpoints
-    path('api/balance/', views.wallet_api_balance, name='wallet_api_balance'),
+    path('api/balance/', read_views.wallet_api_balance, name='wallet_api_balance'),
     path('api/send-otp/', views.send_otp, name='send_otp'),
     path('api/verify-otp/', views.verify_otp, name='verify_otp'),
     path('api/process-payment/', views.process_payment, name='process_payment'),
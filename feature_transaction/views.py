@@ -8,6 +8,7 @@ from django.db import transaction
 from decimal import Decimal
 import json
 
+from core.dbrouter import replica_reads
 from .models import Wallet, Transaction, OTPVerification
 from .services import WalletService, OTPService, TransactionService
 
@@ -77,6 +78,7 @@ def topup_wallet(request):
 
 
 @login_required
+@replica_reads
 def transaction_history(request):
     """Transaction history view with pagination"""
     from django.core.paginator import Paginator
@@ -144,7 +146,7 @@ def verify_otp(request):
                 'message': 'OTP code and purpose are required'
             })
         
-        result = OTPService.verify_otp(request.user, otp_code, purpose)
+        result = OTPService.verify_otp(request.user.pk, otp_code, purpose, persist=False)
         return JsonResponse(result)
         
     except Exception as e:
@@ -188,7 +190,7 @@ def process_payment(request):
                 'message': 'OTP is required'
             })
         
-        otp_verify_result = OTPService.verify_otp(request.user, otp_code, 'PAYMENT')
+        otp_verify_result = OTPService.verify_otp(request.user.pk, otp_code, 'PAYMENT')
         
         if not otp_verify_result['success']:
             return JsonResponse({
@@ -278,36 +280,18 @@ def verify_payment_otp(request, booking_id):
         if not otp_code:
             messages.error(request, 'Please enter the OTP code')
         else:
-            otp_verify_result = OTPService.verify_otp(request.user, otp_code, 'PAYMENT')
+            from feature_railways.booking_services import BookingPaymentService
+            result = BookingPaymentService.pay_and_confirm(booking, otp_code)
             
-            if otp_verify_result['success']:
-                result = WalletService.debit_wallet(
-                    user=request.user,
-                    amount=booking.total_fare,
-                    purpose='PAYMENT',
-                    description=f'Payment for booking {booking.booking_id}',
-                    otp_verification=otp_verify_result['otp_verification']
-                )
+            if result['success']:
+                # Clear session
+                request.session.pop('payment_booking_id', None)
+                request.session.pop('payment_amount', None)
                 
-                if result['success'] and 'transaction' in result:
-                    transaction = result['transaction']
-                    transaction.booking_id = booking.booking_id
-                    transaction.save()
-                
-                if result['success']:
-                    booking.booking_status = 'CONFIRMED'
-                    booking.save()
-                    
-                    # Clear session
-                    request.session.pop('payment_booking_id', None)
-                    request.session.pop('payment_amount', None)
-                    
-                    messages.success(request, 'Payment successful! Your booking is confirmed.')
-                    return redirect('feature_railways:booking_detail', booking_id=booking.booking_id)
-                else:
-                    messages.error(request, result['message'])
+                messages.success(request, result['message'])
+                return redirect('feature_railways:booking_detail', booking_id=booking.booking_id)
             else:
-                messages.error(request, f"OTP verification failed: {otp_verify_result['message']}")
+                messages.error(request, f"Payment failed: {result['message']}")
     
     context = {
         'booking': booking,